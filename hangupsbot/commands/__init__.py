@@ -21,6 +21,10 @@ class CommandDispatcher(object):
 
         self.command_tagsets = {}
 
+        self.generation = 0 # incremented when commands or command tags change
+        self._available_commands = {} # (chat_id, conv_id) -> results
+        self._available_generations = None
+
         """
         inbuilt argument preprocessors, recognises:
         * one_chat_id (also resolves #conv)
@@ -298,6 +302,12 @@ class CommandDispatcher(object):
             tagsets = set([tagsets])
 
         self.command_tagsets[command] = self.command_tagsets[command] | tagsets
+        self.invalidate()
+
+    def invalidate(self):
+        """discard cached command availability, call after changing registered commands/tags"""
+        self.generation += 1
+        self._available_commands = {}
 
 
     @property
@@ -311,6 +321,31 @@ class CommandDispatcher(object):
         return config_tags_escalate
 
     def get_available_commands(self, bot, chat_id, conv_id):
+        """returns { "admin": frozenset, "user": frozenset } of commands available to chat_id
+        results are cached per (chat_id, conv_id) until the config, tags or commands change
+        """
+        generations = ( bot.config.generation,
+                        bot.tags.generation,
+                        self.generation )
+
+        if generations != self._available_generations:
+            # something changed, all cached results are stale
+            self._available_commands = {}
+            self._available_generations = generations
+
+        cache_key = (chat_id, conv_id)
+        if cache_key in self._available_commands:
+            return self._available_commands[cache_key]
+
+        results = self._get_available_commands(bot, chat_id, conv_id)
+
+        if bot.memory.exists(["user_data", chat_id]):
+            # unknown users have no tags yet, don't cache
+            self._available_commands[cache_key] = results
+
+        return results
+
+    def _get_available_commands(self, bot, chat_id, conv_id):
         start_time = time.time()
 
         config_tags_deny_prefix = self.deny_prefix
@@ -404,7 +439,7 @@ class CommandDispatcher(object):
         interval = time.time() - start_time
         logger.debug("get_available_commands() - {}".format(interval))
 
-        return { "admin": list(admin_commands), "user": list(user_commands) }
+        return { "admin": frozenset(admin_commands), "user": frozenset(user_commands) }
 
     @asyncio.coroutine
     def run(self, bot, event, *args, **kwds):
@@ -458,6 +493,7 @@ class CommandDispatcher(object):
                 self.commands[func_name] = func
                 if admin:
                     self.admin_commands.append(func_name)
+                self.invalidate()
 
             else:
                 # just register and return the same function
@@ -285,7 +285,20 @@ def resourcememory(bot, event, *args):
 
     message = "memory (resource): {} MB".format(mem)
     logger.info(message)
-    yield from bot.coro_send_message(event.conv,  "<b>" + message + "</b>")
+
+    lines = [ "<b>" + message + "</b>" ]
+    for name, stats in bot._handlers.registry_stats().items():
+        line = "{}: {}".format(name, ", ".join([ "{}={}".format(key, value)
+                                                 for key, value in sorted(stats.items()) ]))
+        logger.info(line)
+        lines.append(line)
+
+    line = "outbound: {}".format(", ".join([ "{}={}".format(key, value)
+                                             for key, value in sorted(bot._outbound.stats().items()) ]))
+    logger.info(line)
+    lines.append(line)
+
+    yield from bot.coro_send_message(event.conv,  "<br />".join(lines))
 
 
 @command.register_unknown
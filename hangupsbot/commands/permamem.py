@@ -62,7 +62,7 @@ def resetunknownusers(bot, event, *args):
 def refreshusermemory(bot, event, *args):
     """refresh specified user chat ids with contact/getentitybyid"""
     logger.info("refreshusermemory started")
-    updated = yield from bot.conversations.get_users_from_query(args)
+    updated = yield from bot.conversations.get_users_from_query(args, force=True)
     logger.info("refreshusermemory {} updated".format(updated))
     logger.info("refreshusermemory ended")
 
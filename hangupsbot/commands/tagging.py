@@ -144,7 +144,7 @@ def tagindexdump(bot, event, *args):
         lines = [_("index: <b><pre>{}</pre></b>").format(relationship)]
         for key, list in bot.tags.indices[relationship].items():
             lines.append(_("key: <pre>{}</pre>").format(key))
-            for item in list:
+            for item in sorted(list):
                 lines.append("... <pre>{}</pre>".format(item))
         if len(lines) == 0:
             continue
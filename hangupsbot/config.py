@@ -1,23 +1,643 @@
-import collections, datetime, functools, json, glob, logging, os, shutil, sys, time
+import asyncio, collections, datetime, functools, json, glob, logging, os, shutil, sqlite3, sys, time
 
-from threading import Timer
+from concurrent.futures import ThreadPoolExecutor
+
+from threading import Lock, Thread, Timer
 
 
 logger = logging.getLogger(__name__)
 
 
+def _apply_to_dict(data, operation, path, value=None):
+    """replay a single set/pop mutation onto a plain dictionary"""
+    parent = functools.reduce(lambda d, k: d[int(k) if isinstance(d, list) else k], path[:-1], data)
+    key = int(path[-1]) if isinstance(parent, list) else path[-1]
+    if operation == "set":
+        parent[key] = value
+    elif operation == "pop":
+        parent.pop(key)
+    else:
+        raise ValueError("unknown journal operation: {}".format(operation))
+
+
+def _json_default(value):
+    """json.dumps() hook: expand the lazy views of the sqlite backend into plain dictionaries"""
+    if isinstance(value, (_SQLiteNamespace, _SQLiteRoot)):
+        return dict(value)
+    raise TypeError("{} is not JSON serializable".format(repr(value)))
+
+
+def _serialise(data):
+    """json text of data, in the format of the config file"""
+    return json.dumps(data, indent=2, sort_keys=True, default=_json_default)
+
+
+def _join_object(members, level):
+    """json object text from sorted (key, formatted value) pairs, as _serialise() would indent it at level"""
+    if not members:
+        return "{}"
+    padding = "\n" + "  " * (level + 1)
+    return ( "{" + ",".join(padding + json.dumps(key) + ": " + value for key, value in members)
+             + "\n" + "  " * level + "}" )
+
+
+def _format_at(serialised, level):
+    """compact json text re-formatted as _serialise() would format it, nested at level"""
+    return _serialise(json.loads(serialised)).replace("\n", "\n" + "  " * level)
+
+
+class JsonStorage:
+    """default storage backend: the entire file is rewritten on every save
+    * on the caller's thread, a save only copies changed entries, as compact json (fast, and
+        immutable once taken): changes to a top-level key or to a key directly below it
+        (e.g. one user in user_data) are tracked via record()
+    * the writer formats the changed entries, reuses the text of the unchanged ones from the
+        previous write, and assembles the file - all in the executor
+    * in-place changes that are never recorded are written with the next recorded change of
+        the same entry, after force_taint() or by flush()
+    """
+    def __init__(self, config):
+        self.config = config
+
+        # caller's thread
+        self._dirty = {} # top-level key -> set of changed second-level keys, True if entirely changed
+        self._dirty_all = True
+        self._known = {} # top-level key -> second-level keys the writer has text for, None if not split
+        self._resync = False # set by the writer if its text cache cannot be trusted anymore
+
+        # writer
+        self._fragments = {} # top-level key -> (formatted text, { second-level key: formatted text } or None)
+        self._written_generation = -1
+
+    def _read_file(self):
+        with open(self.config.filename) as f:
+            return json.load(f)
+
+    def load(self):
+        data = self._read_file()
+        self._dirty_all = True
+        return data
+
+    def record(self, operation, path, value=None):
+        """called for every tracked mutation"""
+        key = path[0]
+        if len(path) == 1:
+            self._dirty[key] = True
+        else:
+            changed = self._dirty.setdefault(key, set())
+            if changed is not True:
+                changed.add(path[1])
+
+    def reset(self):
+        """called when the whole dictionary was replaced or tainted without a tracked mutation"""
+        self._dirty_all = True
+
+    def _snapshot(self):
+        """list of (key, compact json or None, [(second-level key, compact json or None)] or None)
+        None marks text the writer already has, None instead of the list if the entry is not split
+        """
+        data = self.config.config
+        dirty, self._dirty = self._dirty, {}
+        dirty_all = self._dirty_all or self._resync
+        self._dirty_all = self._resync = False
+
+        if not all(isinstance(key, str) for key in data):
+            self._known = {}
+            return json.dumps(data, sort_keys=True)
+
+        known = {}
+        snapshot = []
+        for key, value in data.items():
+            changed = True if dirty_all or key not in self._known else dirty.get(key)
+
+            if changed is None:
+                snapshot.append((key, None, None))
+                known[key] = self._known[key]
+
+            elif isinstance(value, dict) and all(isinstance(subkey, str) for subkey in value):
+                if changed is True or self._known[key] is None:
+                    members = [ (subkey, json.dumps(subvalue, sort_keys=True))
+                                for subkey, subvalue in value.items() ]
+                    known[key] = set(value)
+                else:
+                    members = [ (subkey, json.dumps(subvalue, sort_keys=True)
+                                         if subkey in changed or subkey not in self._known[key] else None)
+                                for subkey, subvalue in value.items() ]
+                    known[key] = self._known[key]
+                    for subkey in changed:
+                        if subkey in value:
+                            known[key].add(subkey)
+                        else:
+                            known[key].discard(subkey)
+                snapshot.append((key, None, members))
+
+            else:
+                snapshot.append((key, json.dumps(value, sort_keys=True), None))
+                known[key] = None
+
+        self._known = known
+        return snapshot
+
+    def _format(self, snapshot):
+        """file contents from a _snapshot(), runs in the writer"""
+        if isinstance(snapshot, str):
+            self._fragments = {}
+            return _format_at(snapshot, 0)
+
+        try:
+            fragments = {}
+            for key, serialised, members in snapshot:
+                if members is None:
+                    if serialised is None:
+                        fragments[key] = self._fragments[key]
+                    else:
+                        fragments[key] = (_format_at(serialised, 1), None)
+                    continue
+
+                previous = self._fragments[key][1] if key in self._fragments else None
+                subfragments = { subkey: previous[subkey] if subserialised is None else _format_at(subserialised, 2)
+                                 for subkey, subserialised in members }
+                fragments[key] = (_join_object(sorted(subfragments.items()), 1), subfragments)
+
+        except (KeyError, TypeError):
+            # snapshot and text cache disagree, the next snapshot copies everything again
+            self._fragments = {}
+            self._resync = True
+            raise
+
+        self._fragments = fragments
+        return _join_object(sorted(( key, fragment[0] ) for key, fragment in fragments.items()), 0)
+
+    def _is_stale(self, generation):
+        """True if a newer snapshot was already written"""
+        if generation < self._written_generation:
+            logger.warning("{} snapshot of generation {} superseded, not written".format(
+                self.config.filename, generation))
+            return True
+        self._written_generation = generation
+        return False
+
+    def prepare(self):
+        """capture the state to be saved, returns a callable that performs the actual i/o
+        prepare() runs on the caller's thread, the writer may be run in an executor
+        """
+        return functools.partial(self._write_formatted, self.config.generation, self._snapshot())
+
+    def _write_formatted(self, generation, snapshot):
+        serialised = self._format(snapshot)
+        if not self._is_stale(generation):
+            self._write_file(serialised)
+
+    def save(self):
+        self.prepare()()
+
+    def _write_file(self, serialised):
+        """atomically replace the file: write to a temporary file, then rename it"""
+        if self.config.failsafe_backups:
+            self.config._make_failsafe_backup()
+
+        temp_filename = self.config.filename + ".tmp"
+        with open(temp_filename, 'w') as f:
+            f.write(serialised)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_filename, self.config.filename)
+
+    def prepare_flush(self):
+        """like prepare(), but also captures in-place changes that were never recorded"""
+        self.reset()
+        return self.prepare()
+
+
+class JournalStorage(JsonStorage):
+    """write-behind storage backend: mutations are appended to <filename>.journal
+    * set_by_path/pop_by_path/__setitem__/__delitem__ are journaled as single json lines
+    * once the journal exceeds compact_threshold entries, it is rotated and merged into the json
+        snapshot by a background thread, the snapshot remains the interchange format
+    * load() reads the snapshot (with failsafe recovery) and replays any outstanding journal
+    * in-place changes to nested objects are not journaled: they are persisted by flush() or
+        whenever a full snapshot is required (e.g. force_taint(), loads()), and lost on a crash
+        until then - store changes with set_by_path() on the changed path or one of its parents,
+        the value is serialised in full when it is recorded (see telesync's ho2tg/tg2ho linkages)
+    """
+    def __init__(self, config, compact_threshold=1000):
+        super().__init__(config)
+
+        self.journal_filename = config.filename + ".journal"
+        self.compacting_filename = config.filename + ".journal.compacting"
+        self.compact_threshold = compact_threshold
+
+        self._pending = []
+        self._journal_entries = 0
+        self._snapshot_required = False
+
+        self._lock = Lock()
+        self._compactor = None
+
+    def _read_journal(self, filename):
+        entries = []
+        try:
+            with open(filename) as f:
+                for line_number, line in enumerate(f, 1):
+                    if not line.strip():
+                        continue
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        # most likely a partial write during a crash, nothing after it is usable
+                        logger.warning("{}:{} corrupted, ignoring remaining entries".format(
+                            filename, line_number))
+                        break
+        except IOError:
+            pass
+        return entries
+
+    def _replay(self, data, entries):
+        for entry in entries:
+            try:
+                _apply_to_dict(data, entry["op"], entry["path"], entry.get("value"))
+            except (KeyError, IndexError, TypeError, ValueError):
+                logger.warning("journal entry could not be replayed: {} {}".format(
+                    entry.get("op"), entry.get("path")))
+
+    def load(self):
+        try:
+            data = super().load()
+        except IOError:
+            data = {}
+
+        # a crash may have happened mid-compaction, replay both journals in order
+        entries = self._read_journal(self.compacting_filename) + self._read_journal(self.journal_filename)
+        self._replay(data, entries)
+        self._journal_entries = len(entries)
+
+        if entries:
+            logger.info("{} journal replayed: {} entries".format(self.config.filename, len(entries)))
+
+        return data
+
+    def record(self, operation, path, value=None):
+        # journaled instead of tracked: every snapshot of this backend copies everything
+        entry = { "op": operation, "path": list(path) }
+        if operation == "set":
+            entry["value"] = value
+
+        # serialise immediately, value may be changed in-place before the journal is written
+        line = json.dumps(entry, sort_keys=True)
+        with self._lock:
+            self._pending.append(line)
+
+    def reset(self):
+        with self._lock:
+            self._pending = []
+            self._snapshot_required = True
+
+    def _full_snapshot(self):
+        with self._lock:
+            self._pending = []
+            self._snapshot_required = False
+        self._dirty_all = True
+        return functools.partial(self._write_snapshot, self.config.generation, self._snapshot())
+
+    def prepare(self):
+        if self._snapshot_required or not os.path.isfile(self.config.filename):
+            return self._full_snapshot()
+
+        with self._lock:
+            pending, self._pending = self._pending, []
+
+        return functools.partial(self._append, pending)
+
+    def _append(self, pending):
+        if pending:
+            with open(self.journal_filename, 'a') as f:
+                f.write("\n".join(pending) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self._journal_entries += len(pending)
+
+        if self._journal_entries >= self.compact_threshold:
+            self.compact()
+
+    def compact(self):
+        """rotate the journal and merge it into the snapshot in the background"""
+        if self._compactor and self._compactor.is_alive():
+            return False
+
+        if os.path.isfile(self.compacting_filename):
+            # leftover from an interrupted compaction, merge it before rotating again
+            pass
+        elif os.path.isfile(self.journal_filename):
+            os.rename(self.journal_filename, self.compacting_filename)
+        else:
+            return False
+
+        self._journal_entries = 0
+        self._compactor = Thread(target=self._compact, name="compactor:" + self.config.filename)
+        self._compactor.daemon = True
+        self._compactor.start()
+        return True
+
+    def _compact(self):
+        start_time = time.time()
+        try:
+            try:
+                data = self._read_file()
+            except IOError:
+                data = {}
+
+            entries = self._read_journal(self.compacting_filename)
+            self._replay(data, entries)
+            self._write_file(_serialise(data))
+            os.remove(self.compacting_filename)
+
+            logger.info("{} compacted {} entries {}".format(
+                self.config.filename, len(entries), time.time() - start_time))
+
+        except ValueError:
+            # corrupted snapshot: keep the journal, the next full snapshot will supersede it
+            logger.exception("{} compaction failed".format(self.config.filename))
+
+    def _write_snapshot(self, generation, snapshot):
+        """write a snapshot of the live dictionary, superseding all journals"""
+        serialised = self._format(snapshot)
+        if self._is_stale(generation):
+            return
+
+        if self._compactor and self._compactor.is_alive():
+            self._compactor.join()
+
+        self._write_file(serialised)
+
+        for filename in (self.compacting_filename, self.journal_filename):
+            if os.path.isfile(filename):
+                os.remove(filename)
+        self._journal_entries = 0
+
+    def prepare_flush(self):
+        return self._full_snapshot()
+
+
+class _SQLiteNamespace(collections.MutableMapping):
+    """lazy view of a single top-level namespace (e.g. user_data), one row per key"""
+    def __init__(self, storage, namespace):
+        self.storage = storage
+        self.namespace = namespace
+
+    def __getitem__(self, key):
+        return self.storage.get_row(self.namespace, key)
+
+    def __setitem__(self, key, value):
+        self.storage.set_row(self.namespace, key, value)
+
+    def __delitem__(self, key):
+        self.storage.delete_row(self.namespace, key)
+
+    def __iter__(self):
+        return iter(self.storage.row_keys(self.namespace))
+
+    def __len__(self):
+        return len(self.storage.row_keys(self.namespace))
+
+    def __contains__(self, key):
+        return key in self.storage.row_keys(self.namespace)
+
+    def __repr__(self):
+        return "<namespace {}: {} rows>".format(self.namespace, len(self))
+
+
+class _SQLiteRoot(collections.MutableMapping):
+    """lazy view of all top-level keys, dict values are exposed as _SQLiteNamespace"""
+    def __init__(self, storage):
+        self.storage = storage
+
+    def __getitem__(self, key):
+        return self.storage.get_namespace(key)
+
+    def __setitem__(self, key, value):
+        self.storage.set_namespace(key, value)
+
+    def __delitem__(self, key):
+        self.storage.delete_namespace(key)
+
+    def __iter__(self):
+        return iter(list(self.storage.namespaces()))
+
+    def __len__(self):
+        return len(self.storage.namespaces())
+
+
+class SQLiteStorage:
+    """sqlite storage backend: top-level dictionaries are stored as one row per second-level key
+    * reading ["user_data", chat_id, ...] only loads the row for chat_id
+    * rows handed out may be modified in-place, they are re-serialised on the next save and only
+        written if they actually changed - all writes of a save happen in a single transaction
+    * the database is <filename without extension>.sqlite, if it is empty and <filename> exists
+        as json, it is migrated once - the json file is left untouched
+    * failsafe backups do not apply, sqlite commits are atomic
+    """
+    def __init__(self, config):
+        self.config = config
+        self.database = os.path.splitext(config.filename)[0] + ".sqlite"
+
+        self._lock = Lock()
+        self._connection = sqlite3.connect(self.database, check_same_thread=False)
+        self._connection.executescript(
+            "CREATE TABLE IF NOT EXISTS namespaces (namespace TEXT PRIMARY KEY, value TEXT);"
+            "CREATE TABLE IF NOT EXISTS rows (namespace TEXT, key TEXT, value TEXT,"
+            " PRIMARY KEY (namespace, key));")
+
+        self._reset_caches()
+
+    def _reset_caches(self):
+        self._namespaces = None # namespace -> None (dictionary) or plain value
+        self._row_keys = {} # namespace -> set of keys
+        self._rows = {} # (namespace, key) -> object
+        self._stored = {} # (namespace, key) -> serialised value as last written
+        self._touched = set()
+        self._deleted = set()
+        self._namespaces_changed = set()
+
+    def _query(self, sql, parameters=()):
+        with self._lock:
+            return self._connection.execute(sql, parameters).fetchall()
+
+    def namespaces(self):
+        if self._namespaces is None:
+            self._namespaces = {}
+            for namespace, value in self._query("SELECT namespace, value FROM namespaces"):
+                self._namespaces[namespace] = None if value is None else json.loads(value)
+        return self._namespaces
+
+    def get_namespace(self, namespace):
+        namespaces = self.namespaces()
+        if namespace not in namespaces:
+            raise KeyError(namespace)
+        if namespaces[namespace] is None:
+            return _SQLiteNamespace(self, namespace)
+        if isinstance(namespaces[namespace], list):
+            # may be modified in-place
+            self._namespaces_changed.add(namespace)
+        return namespaces[namespace]
+
+    def set_namespace(self, namespace, value):
+        if namespace in self.namespaces():
+            self.delete_namespace(namespace)
+
+        if isinstance(value, (dict, _SQLiteNamespace)):
+            rows = dict(value) if isinstance(value, _SQLiteNamespace) else value
+            self._namespaces[namespace] = None
+            self._row_keys[namespace] = set()
+            for key, row in rows.items():
+                self.set_row(namespace, key, row)
+        else:
+            self._namespaces[namespace] = value
+        self._namespaces_changed.add(namespace)
+
+    def delete_namespace(self, namespace):
+        namespaces = self.namespaces()
+        if namespace not in namespaces:
+            raise KeyError(namespace)
+        if namespaces[namespace] is None:
+            for key in list(self.row_keys(namespace)):
+                self.delete_row(namespace, key)
+        del namespaces[namespace]
+        self._namespaces_changed.add(namespace)
+
+    def row_keys(self, namespace):
+        if namespace not in self._row_keys:
+            self._row_keys[namespace] = set( key for key, in self._query(
+                "SELECT key FROM rows WHERE namespace = ?", (namespace,)) )
+        return self._row_keys[namespace]
+
+    def get_row(self, namespace, key):
+        _key = (namespace, key)
+        if _key not in self._rows:
+            if _key in self._deleted:
+                raise KeyError(key)
+            results = self._query("SELECT value FROM rows WHERE namespace = ? AND key = ?", _key)
+            if not results:
+                raise KeyError(key)
+            self._stored[_key] = results[0][0]
+            self._rows[_key] = json.loads(results[0][0])
+
+        # caller may modify the row in-place, re-check it on the next save
+        self._touched.add(_key)
+        return self._rows[_key]
+
+    def set_row(self, namespace, key, value):
+        _key = (namespace, key)
+        self._rows[_key] = value
+        self._touched.add(_key)
+        self._deleted.discard(_key)
+        self.row_keys(namespace).add(key)
+
+    def delete_row(self, namespace, key):
+        _key = (namespace, key)
+        value = self.get_row(namespace, key)
+        del self._rows[_key]
+        self._touched.discard(_key)
+        self._deleted.add(_key)
+        self.row_keys(namespace).discard(key)
+        return value
+
+    def load(self):
+        self._reset_caches()
+        if not self.namespaces() and os.path.isfile(self.config.filename):
+            self.migrate(self.config.filename)
+        return _SQLiteRoot(self)
+
+    def migrate(self, filename):
+        """one-shot import of an existing json memory file"""
+        with open(filename) as f:
+            data = json.load(f)
+        for namespace, value in data.items():
+            self.set_namespace(namespace, value)
+        self.save()
+        logger.info("{} migrated into {}: {} namespaces".format(filename, self.database, len(data)))
+
+    def record(self, operation, path, value=None):
+        """mutations are tracked through the namespace/row views"""
+        pass
+
+    def reset(self):
+        if not isinstance(self.config.config, _SQLiteRoot):
+            # whole dictionary was replaced, e.g. via Config.loads()
+            data = self.config.config
+            for namespace in list(self.namespaces()):
+                self.delete_namespace(namespace)
+            for namespace, value in data.items():
+                self.set_namespace(namespace, value)
+            self.config.config = _SQLiteRoot(self)
+
+    def prepare(self):
+        upserts = []
+        for _key in self._touched:
+            serialised = json.dumps(self._rows[_key], sort_keys=True, default=_json_default)
+            if serialised != self._stored.get(_key):
+                upserts.append(_key + (serialised,))
+                self._stored[_key] = serialised
+        deletes = list(self._deleted)
+
+        namespaces = self.namespaces()
+        namespace_upserts = [ (namespace, None if namespaces[namespace] is None
+                                          else json.dumps(namespaces[namespace], default=_json_default))
+                              for namespace in self._namespaces_changed if namespace in namespaces ]
+        namespace_deletes = [ (namespace,)
+                              for namespace in self._namespaces_changed if namespace not in namespaces ]
+
+        for _key in deletes:
+            self._stored.pop(_key, None)
+        self._touched = set()
+        self._deleted = set()
+        self._namespaces_changed = set()
+
+        return functools.partial(self._commit, namespace_deletes, namespace_upserts, deletes, upserts)
+
+    def _commit(self, namespace_deletes, namespace_upserts, deletes, upserts):
+        with self._lock, self._connection:
+            self._connection.executemany("DELETE FROM namespaces WHERE namespace = ?", namespace_deletes)
+            self._connection.executemany("INSERT OR REPLACE INTO namespaces VALUES (?, ?)", namespace_upserts)
+            self._connection.executemany("DELETE FROM rows WHERE namespace = ? AND key = ?", deletes)
+            self._connection.executemany("INSERT OR REPLACE INTO rows VALUES (?, ?, ?)", upserts)
+
+        logger.debug("{} rows written: {} deleted: {}".format(self.database, len(upserts), len(deletes)))
+
+    def save(self):
+        self.prepare()()
+
+    def prepare_flush(self):
+        """catch in-place changes to rows that were fetched before the last save"""
+        self._touched.update(self._rows.keys())
+        self._namespaces_changed.update(self.namespaces().keys())
+        return self.prepare()
+
+
+storage_backends = { "json": JsonStorage,
+                     "journal": JournalStorage,
+                     "sqlite": SQLiteStorage }
+
+
 class Config(collections.MutableMapping):
     """Configuration JSON storage class"""
-    def __init__(self, filename, default=None, failsafe_backups=0, save_delay=0):
+    def __init__(self, filename, default=None, failsafe_backups=0, save_delay=0, storage="json"):
         self.filename = filename
         self.default = None
         self.config = {}
         self.changed = False
+        self.generation = 0 # incremented on every tracked change, for cache invalidation
         self.failsafe_backups = failsafe_backups
         self.save_delay = save_delay
+
+        if isinstance(storage, str):
+            storage = storage_backends[storage]
+        self.storage = storage(self)
+
         self.load()
 
         self._timer_save = False
+        self._handle_save = False
+        self._executor = None
 
     def _make_failsafe_backup(self):
         try:
@@ -60,8 +680,7 @@ class Config(collections.MutableMapping):
     def load(self, recovery=False):
         """Load config from file"""
         try:
-            with open(self.filename) as f:
-                self.config = json.load(f)
+            self.config = self.storage.load()
             logger.info("{} read".format(self.filename))
 
         except IOError:
@@ -74,46 +693,103 @@ class Config(collections.MutableMapping):
             raise
 
         self.changed = False
+        self.generation += 1
 
     def force_taint(self):
+        self.storage.reset()
         self.changed = True
+        self.generation += 1
 
     def loads(self, json_str):
         """Load config from JSON string"""
         self.config = json.loads(json_str)
+        self.storage.reset()
         self.changed = True
+        self.generation += 1
+
+    def _running_loop(self):
+        """event loop running on the current thread, None if called from elsewhere"""
+        try:
+            loop = asyncio.get_event_loop()
+        except RuntimeError:
+            return None
+        return loop if loop.is_running() else None
+
+    def _write(self, writer):
+        start_time = time.time()
+        writer()
+        interval = time.time() - start_time
+
+        logger.info("{} write {}".format(self.filename, interval))
+
+    def _write_done(self, future):
+        if future.cancelled():
+            logger.error("{} write cancelled".format(self.filename))
+        elif future.exception() is not None:
+            logger.error("{} write failed".format(self.filename), exc_info=future.exception())
 
     def save(self, delay=True):
+        """save config to file (only if config has changed)
+        * with save_delay, repeated calls are coalesced until the delay has passed
+        * the storage takes a cheap snapshot on the caller's thread, from the event loop formatting
+            and disk i/o happen in a dedicated executor thread, writes are always performed in the
+            order they were requested and a stale snapshot never replaces a newer one
+        """
+        loop = self._running_loop()
+
         if self.save_delay:
             if delay:
-                if self._timer_save and self._timer_save.is_alive():
-                    self._timer_save.cancel()
-                self._timer_save = Timer(self.save_delay, self.save, [], {"delay": False})
-                self._timer_save.start()
+                if loop is not None:
+                    if self._handle_save:
+                        self._handle_save.cancel()
+                    self._handle_save = loop.call_later(self.save_delay, self.save, False)
+                else:
+                    if self._timer_save and self._timer_save.is_alive():
+                        self._timer_save.cancel()
+                    self._timer_save = Timer(self.save_delay, self.save, [], {"delay": False})
+                    self._timer_save.start()
                 return False
 
-        """Save config to file (only if config has changed)"""
-        if self.changed:
-            start_time = time.time()
+        if self._handle_save:
+            self._handle_save.cancel()
+            self._handle_save = False
 
-            if self.failsafe_backups:
-                self._make_failsafe_backup()
+        if self.changed:
+            writer = self.storage.prepare()
+            self.changed = False
 
-            with open(self.filename, 'w') as f:
-                json.dump(self.config, f, indent=2, sort_keys=True)
-                self.changed = False
-            interval = time.time() - start_time
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1)
 
-            logger.info("{} write {}".format(self.filename, interval))
+            if loop is not None:
+                loop.run_in_executor(self._executor, self._write, writer).add_done_callback(self._write_done)
+            else:
+                self._executor.submit(self._write, writer).result()
 
         return self.changed
 
+    @asyncio.coroutine
     def flush(self):
+        """write all pending changes, wait for the writes to complete - use during shutdown"""
+        if self._handle_save:
+            logger.info("flushing {}".format(self.filename))
+            self._handle_save.cancel()
+            self._handle_save = False
         if self._timer_save and self._timer_save.is_alive():
             logger.info("flushing {}".format(self.filename))
             self._timer_save.cancel()
+
         self.save(delay=False)
 
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1)
+
+        # snapshot taken here, on the thread that owns the dictionary, formatting and i/o run in the executor
+        writer = self.storage.prepare_flush()
+
+        loop = asyncio.get_event_loop()
+        yield from loop.run_in_executor(self._executor, writer)
+
     def get_by_path(self, keys_list):
         """Get item from config by path (list of keys)"""
         return functools.reduce(lambda d, k: d[int(k) if isinstance(d, list) else k], keys_list, self)
@@ -121,11 +797,15 @@ class Config(collections.MutableMapping):
     def set_by_path(self, keys_list, value):
         """Set item in config by path (list of keys)"""
         self.get_by_path(keys_list[:-1])[keys_list[-1]] = value
+        self.storage.record("set", keys_list, value)
         self.changed = True
+        self.generation += 1
 
     def pop_by_path(self, keys_list):
         popped_value = self.get_by_path(keys_list[:-1]).pop(keys_list[-1])
+        self.storage.record("pop", keys_list)
         self.changed = True
+        self.generation += 1
         return popped_value
 
     def get_option(self, keyname):
@@ -161,11 +841,15 @@ class Config(collections.MutableMapping):
 
     def __setitem__(self, key, value):
         self.config[key] = value
+        self.storage.record("set", [key], value)
         self.changed = True
+        self.generation += 1
 
     def __delitem__(self, key):
         del self.config[key]
+        self.storage.record("pop", [key])
         self.changed = True
+        self.generation += 1
 
     def __iter__(self):
         return iter(self.config)
@@ -1,7 +1,9 @@
 import logging
 import shlex
 import asyncio
+import collections
 import inspect
+import itertools
 import time
 import uuid
 
@@ -14,6 +16,161 @@ from commands import command
 logger = logging.getLogger(__name__)
 
 
+class ExpiringRegistry:
+    """bounded registry for short-lived message metadata (passthrus, contexts, image ids, ...)
+    * entries expire ttl seconds after they were added
+    * when max_size is exceeded, the least recently used entries are evicted first
+    * wait() lets a coroutine await a key that has not been added yet
+    """
+
+    def __init__(self, name, ttl=3600, max_size=10000):
+        self.name = name
+        self.ttl = ttl
+        self.max_size = max_size
+
+        self._entries = collections.OrderedDict() # key -> (expiry, value), least recently used first
+        self._waiters = {} # key -> [asyncio.Future]
+
+        self.counters = { "added": 0,
+                          "hits": 0,
+                          "misses": 0,
+                          "expired": 0,
+                          "evicted": 0 }
+
+    def _prune(self):
+        now = time.time()
+        while self._entries:
+            key, (expiry, value) = next(iter(self._entries.items()))
+            if expiry <= now:
+                self.counters["expired"] += 1
+            elif len(self._entries) > self.max_size:
+                self.counters["evicted"] += 1
+            else:
+                break
+            del self._entries[key]
+
+    def _lookup(self, key):
+        """returns the entry tuple if key is present and not expired, marks it as recently used"""
+        try:
+            expiry, value = self._entries[key]
+        except KeyError:
+            return None
+        if expiry <= time.time():
+            del self._entries[key]
+            self.counters["expired"] += 1
+            return None
+        self._entries.move_to_end(key)
+        return expiry, value
+
+    def __setitem__(self, key, value):
+        self._entries[key] = (time.time() + self.ttl, value)
+        self._entries.move_to_end(key)
+        self.counters["added"] += 1
+        self._prune()
+
+        for future in self._waiters.pop(key, []):
+            if not future.done():
+                future.set_result(value)
+
+    def __getitem__(self, key):
+        entry = self._lookup(key)
+        if entry is None:
+            self.counters["misses"] += 1
+            raise KeyError(key)
+        self.counters["hits"] += 1
+        return entry[1]
+
+    def __delitem__(self, key):
+        del self._entries[key]
+
+    def __contains__(self, key):
+        return self._lookup(key) is not None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def pop(self, key, default=None):
+        try:
+            value = self[key]
+        except KeyError:
+            return default
+        del self._entries[key]
+        return value
+
+    def register(self, value):
+        """store value under a new unique id, returns the id"""
+        _id = str(uuid.uuid4())
+        self[_id] = value
+        return _id
+
+    @asyncio.coroutine
+    def wait(self, key, timeout=None):
+        """return the value for key, waiting up to timeout seconds for it to be added
+        raises asyncio.TimeoutError if the key did not appear in time
+        """
+        entry = self._lookup(key)
+        if entry is not None:
+            self.counters["hits"] += 1
+            return entry[1]
+
+        future = asyncio.Future()
+        self._waiters.setdefault(key, []).append(future)
+        try:
+            return (yield from asyncio.wait_for(future, timeout))
+        finally:
+            if key in self._waiters and future in self._waiters[key]:
+                self._waiters[key].remove(future)
+                if not self._waiters[key]:
+                    del self._waiters[key]
+
+    def stats(self):
+        self._prune()
+        stats = dict(self.counters)
+        stats["size"] = len(self._entries)
+        stats["waiting"] = sum(len(futures) for futures in self._waiters.values())
+        return stats
+
+
+class HandlerDispatch:
+    """pre-computed dispatch record for a registered pluggable
+    * reflection (signature arity, coroutine detection) happens once, at registration
+    * log label is only formatted when it is actually needed
+    """
+
+    def __init__(self, function, type, priority, metadata):
+        self.function = function
+        self.type = type
+        self.priority = priority
+        self.metadata = metadata
+
+        """accepted handler signatures:
+        coroutine(bot, event, command)
+        coroutine(bot, event)
+        function(bot, event, context)
+        function(bot, event)
+        """
+        self.arity = len(inspect.signature(function).parameters)
+        self.is_coroutine = asyncio.iscoroutinefunction(function)
+
+        self._label = None
+
+    @property
+    def label(self):
+        if self._label is None:
+            self._label = "{}: {}.{} : {}".format(
+                self.type,
+                self.metadata["module.path"],
+                self.function.__name__,
+                "coroutine" if self.is_coroutine else "function")
+        return self._label
+
+
 class EventHandler:
     """Handle Hangups conversation events"""
 
@@ -22,12 +179,15 @@ class EventHandler:
         self.bot_command = bot_command
 
         self._prefix_reprocessor = "uuid://"
-        self._reprocessors = {}
+        self._reprocessors = ExpiringRegistry("reprocessors", ttl=21600, max_size=5000)
+
+        self._passthrus = ExpiringRegistry("passthrus")
+        self._contexts = ExpiringRegistry("contexts")
+        self._image_ids = ExpiringRegistry("image_ids", max_size=5000)
+        self._executables = ExpiringRegistry("executables", max_size=5000)
 
-        self._passthrus = {}
-        self._contexts = {}
-        self._image_ids = {}
-        self._executables = {}
+        self._concurrent = None # (event types run in concurrent bands, band timeout)
+        self._concurrent_generation = None
 
         self.pluggables = { "allmessages": [],
                             "call": [],
@@ -87,7 +247,9 @@ class EventHandler:
         if not _metadata.get("module.path"):
             raise ValueError("module.path not defined")
 
-        self.pluggables[type].append((_handler, priority, _metadata))
+        _dispatch = HandlerDispatch(_handler, type, priority, _metadata)
+
+        self.pluggables[type].append((_handler, priority, _metadata, _dispatch))
         self.pluggables[type].sort(key=lambda tup: tup[1])
 
         plugins.tracking.register_handler(_handler, type, priority, module_path=_metadata["module.path"])
@@ -129,19 +291,22 @@ class EventHandler:
             raise ValueError("{} handler(s) {}".format(type, function))
 
     def register_passthru(self, variable):
-        _id = str(uuid.uuid4())
-        self._passthrus[_id] = variable
-        return _id
+        return self._passthrus.register(variable)
 
     def register_context(self, variable):
-        _id = str(uuid.uuid4())
-        self._contexts[_id] = variable
-        return _id
+        return self._contexts.register(variable)
 
     def register_reprocessor(self, callable):
-        _id = str(uuid.uuid4())
-        self._reprocessors[_id] = callable
-        return _id
+        return self._reprocessors.register(callable)
+
+    def registry_stats(self):
+        """size, hit and eviction counters of the message metadata registries"""
+        return { registry.name: registry.stats()
+                 for registry in ( self._reprocessors,
+                                   self._passthrus,
+                                   self._contexts,
+                                   self._image_ids,
+                                   self._executables ) }
 
     def attach_reprocessor(self, callable, return_as_dict=False):
         """reprocessor: map callable to a special hidden context link that can be added anywhere 
@@ -189,32 +354,33 @@ class EventHandler:
     """handler core"""
 
     @asyncio.coroutine
-    def image_uri_from(self, image_id, callback, *args, **kwargs):
+    def image_uri_from(self, image_id, callback, *args, timeout=60, **kwargs):
         """XXX: there isn't a direct way to resolve an image_id to the public url without
         posting it first via the api. other plugins and functions can establish a short-lived
-        task to wait for the image id to be posted, and retrieve the url in an asyncronous way"""
-
-        ticks = 0
-        while True:
-            if image_id not in self._image_ids:
-                yield from asyncio.sleep(1)
-                ticks = ticks + 1
-                if ticks > 60:
-                    return False
-            else:
-                yield from callback(self._image_ids[image_id], *args, **kwargs)
-                return True
+        task to wait for the image id to be posted, and retrieve the url in an asyncronous way
+        * the waiter is woken by handle_chat_message() as soon as the url is associated
+        * returns False if no url was associated within timeout seconds"""
+
+        try:
+            image_uri = yield from self._image_ids.wait(image_id, timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.info("no uri for image_id={} after {}s".format(image_id, timeout))
+            return False
+
+        yield from callback(image_uri, *args, **kwargs)
+        return True
 
     @asyncio.coroutine
     def run_reprocessor(self, id, event, *args, **kwargs):
         if id in self._reprocessors:
-            is_coroutine = asyncio.iscoroutinefunction(self._reprocessors[id])
+            reprocessor = self._reprocessors[id]
+            is_coroutine = asyncio.iscoroutinefunction(reprocessor)
             logger.info("reprocessor uuid found: {} coroutine={}".format(id, is_coroutine))
             if is_coroutine:
-                yield from self._reprocessors[id](self.bot, event, id, *args, **kwargs)
+                yield from reprocessor(self.bot, event, id, *args, **kwargs)
             else:
-                self._reprocessors[id](self.bot, event, id, *args, **kwargs)
-            del self._reprocessors[id]
+                reprocessor(self.bot, event, id, *args, **kwargs)
+            self._reprocessors.pop(id)
 
     @asyncio.coroutine
     def handle_chat_message(self, event):
@@ -234,13 +400,9 @@ class EventHandler:
                     # reprocessor - process event with hidden context from handler.attach_reprocessor()
                     yield from self.run_reprocessor(annotation.value, event)
                 elif annotation.type == 1026:
-                    if annotation.value in self._passthrus:
-                        event.passthru = self._passthrus[annotation.value]
-                        del self._passthrus[annotation.value]
+                    event.passthru = self._passthrus.pop(annotation.value, event.passthru)
                 elif annotation.type == 1027:
-                    if annotation.value in self._contexts:
-                        event.context = self._contexts[annotation.value]
-                        del self._contexts[annotation.value]
+                    event.context = self._contexts.pop(annotation.value, event.context)
 
             if len(event.conv_event.segments) > 0:
                 for segment in event.conv_event.segments:
@@ -259,7 +421,7 @@ class EventHandler:
                         return
 
             """map image ids to their public uris in absence of any fixed server api
-               XXX: small memory leak over time as each id gets cached indefinitely"""
+               entries expire, see ExpiringRegistry"""
 
             if( event.passthru
                     and "original_request" in event.passthru
@@ -271,11 +433,12 @@ class EventHandler:
                 _image_uri = event.conv_event.attachments[0]
 
                 if _image_id not in self._image_ids:
+                    # wakes up any image_uri_from() waiting for this image_id
                     self._image_ids[_image_id] = _image_uri
                     logger.info("associating image_id={} with {}".format(_image_id, _image_uri))
 
             """first occurence of an actual executable id needs to be handled as an event
-               XXX: small memory leak over time as each id gets cached indefinitely"""
+               entries expire, see ExpiringRegistry"""
 
             if( event.passthru and "executable" in event.passthru and event.passthru["executable"] ):
                 if event.passthru["executable"] not in self._executables:
@@ -395,51 +558,132 @@ class EventHandler:
 
     @asyncio.coroutine
     def run_pluggable_omnibus(self, name, *args, **kwargs):
-        if name in self.pluggables:
-            try:
-                for function, priority, plugin_metadata in self.pluggables[name]:
-                    message = ["{}: {}.{}".format(
-                                name,
-                                plugin_metadata["module.path"],
-                                function.__name__)]
-
-                    try:
-                        """accepted handler signatures:
-                        coroutine(bot, event, command)
-                        coroutine(bot, event)
-                        function(bot, event, context)
-                        function(bot, event)
-                        """
-                        _expected = list(inspect.signature(function).parameters)
-                        _passed = args[0:len(_expected)]
-                        if asyncio.iscoroutinefunction(function):
-                            message.append("coroutine")
-                            logger.debug(" : ".join(message))
-                            yield from function(*_passed)
-                        else:
-                            message.append("function")
-                            logger.debug(" : ".join(message))
-                            function(*_passed)
-                    except self.bot.Exceptions.SuppressHandler:
-                        # skip this pluggable, continue with next
-                        message.append("SuppressHandler")
-                        logger.debug(" : ".join(message))
-                        pass
-                    except (self.bot.Exceptions.SuppressEventHandling,
-                            self.bot.Exceptions.SuppressAllHandlers):
-                        # skip all pluggables, decide whether to handle event at next level
-                        raise
-                    except:
-                        message = " : ".join(message)
-                        logger.exception(message)
-
-            except self.bot.Exceptions.SuppressAllHandlers:
-                # skip all other pluggables, but let the event continue
-                message.append("SuppressAllHandlers")
-                logger.debug(" : ".join(message))
-
-            except:
-                raise
+        if name not in self.pluggables:
+            return
+
+        debug = logger.isEnabledFor(logging.DEBUG)
+
+        concurrent_types, timeout = self._concurrent_settings()
+        if name in concurrent_types:
+            yield from self._run_pluggable_bands(name, timeout, debug, *args)
+            return
+
+        try:
+            for function, priority, plugin_metadata, record in self.pluggables[name]:
+                try:
+                    _passed = args[0:record.arity]
+                    if debug:
+                        logger.debug(record.label)
+                    if record.is_coroutine:
+                        yield from record.function(*_passed)
+                    else:
+                        record.function(*_passed)
+                except self.bot.Exceptions.SuppressHandler:
+                    # skip this pluggable, continue with next
+                    if debug:
+                        logger.debug("{} : SuppressHandler".format(record.label))
+                except (self.bot.Exceptions.SuppressEventHandling,
+                        self.bot.Exceptions.SuppressAllHandlers):
+                    # skip all pluggables, decide whether to handle event at next level
+                    raise
+                except:
+                    logger.exception(record.label)
+
+        except self.bot.Exceptions.SuppressAllHandlers:
+            # skip all other pluggables, but let the event continue
+            if debug:
+                logger.debug("{} : SuppressAllHandlers".format(record.label))
+
+    def _concurrent_settings(self):
+        """(event types, band timeout) - resolved once per config generation
+        * config.handlers.concurrent = true (message, allmessages) or explicit list of event types
+        * config.handlers.concurrent.timeout (seconds, default 30)
+        * "sending" handlers mutate the broadcast list in order, and are never run concurrently
+        """
+        if self._concurrent_generation == self.bot.config.generation:
+            return self._concurrent
+
+        config_concurrent = self.bot.get_config_option('handlers.concurrent')
+        if not config_concurrent:
+            types = frozenset()
+        elif config_concurrent is True:
+            types = frozenset(["allmessages", "message"])
+        else:
+            if isinstance(config_concurrent, str):
+                config_concurrent = [config_concurrent]
+            types = frozenset( type for type in config_concurrent if type != "sending" )
+
+        timeout = self.bot.get_config_option('handlers.concurrent.timeout') or 30
+
+        self._concurrent = (types, timeout)
+        self._concurrent_generation = self.bot.config.generation
+        return self._concurrent
+
+    @asyncio.coroutine
+    def _run_dispatch(self, record, debug, *args):
+        """execute a single pluggable within a concurrent band
+        SuppressEventHandling and SuppressAllHandlers are returned instead of raised, so that
+            the remaining handlers in the band are not cancelled by asyncio.gather()
+        """
+        try:
+            _passed = args[0:record.arity]
+            if debug:
+                logger.debug(record.label)
+            if record.is_coroutine:
+                yield from record.function(*_passed)
+            else:
+                record.function(*_passed)
+        except self.bot.Exceptions.SuppressHandler:
+            if debug:
+                logger.debug("{} : SuppressHandler".format(record.label))
+        except (self.bot.Exceptions.SuppressEventHandling,
+                self.bot.Exceptions.SuppressAllHandlers) as e:
+            return e
+        except:
+            logger.exception(record.label)
+
+    @asyncio.coroutine
+    def _run_pluggable_bands(self, name, timeout, debug, *args):
+        """run handlers sharing a priority value concurrently, bands still run in priority order
+        timeout (config.handlers.concurrent.timeout) limits how long a band waits for each
+            handler - overrunning handlers are logged and left to finish in the background
+        """
+        suppressed = None
+        for priority, band in itertools.groupby(list(self.pluggables[name]), key=lambda tup: tup[1]):
+            records = [ pluggable[3] for pluggable in band ]
+
+            tasks = { asyncio.ensure_future(self._run_dispatch(record, debug, *args)): record
+                      for record in records }
+
+            done, pending = yield from asyncio.wait(list(tasks), timeout=timeout)
+
+            for task in pending:
+                logger.warning("{} : overran band p={} timeout of {}s".format(
+                    tasks[task].label, priority, timeout))
+                task.add_done_callback(self._overrun_done)
+
+            for task in done:
+                result = task.result()
+                if isinstance(result, self.bot.Exceptions.SuppressEventHandling):
+                    suppressed = result
+                elif isinstance(result, self.bot.Exceptions.SuppressAllHandlers) and suppressed is None:
+                    if debug:
+                        logger.debug("{} : SuppressAllHandlers".format(tasks[task].label))
+                    suppressed = result
+
+            if suppressed is not None:
+                break
+
+        if isinstance(suppressed, self.bot.Exceptions.SuppressEventHandling):
+            raise suppressed
+
+    def _overrun_done(self, future):
+        """suppression raised after a band has timed out can no longer affect the event"""
+        if future.cancelled():
+            return
+        result = future.result()
+        if result is not None:
+            logger.warning("ignored {} from overrunning handler".format(type(result).__name__))
 
 class HandlerBridge:
     """shim for xmikosbot handler decorator"""
@@ -1,6 +1,6 @@
-import asyncio, logging, time
+import asyncio, functools, logging, time
 
-from collections import namedtuple
+from collections import deque, namedtuple
 
 import hangups
 
@@ -150,6 +150,162 @@ class HangupsConversation(hangups.conversation.Conversation):
         return [ self.bot.get_hangups_user(part.id_.chat_id) for part in self._conversation.participant_data ]
 
 
+class OutboundQueue(object):
+    """outbound message scheduler shared by all conversations
+
+    * messages to the same conversation are sent one at a time, in submission order
+    * opt-in: with outbound.rate set, all conversations draw from one token bucket:
+        outbound.rate messages per second, bursts of up to outbound.burst (default 10)
+        unset (default), sends are not rate limited
+    * hangups.NetworkError is retried up to outbound.retries times (default 3),
+        waiting outbound.backoff seconds (default 1), doubled after every attempt
+    * submit(timeout=...) limits every send attempt, not the time spent queued;
+        a timed out attempt is retried like a NetworkError (the request is re-used)
+    """
+
+    def __init__(self, bot):
+        self.bot = bot
+
+        self._queues = {} # conv_id -> deque of (future, send, timeout, queued_at)
+        self._drains = set() # running _drain() tasks
+        self._tokens = None
+        self._refilled_at = time.time()
+
+        self.counters = { "queued": 0,
+                          "sent": 0,
+                          "retried": 0,
+                          "failed": 0 }
+        self._latency_total = 0.0
+        self._latency_max = 0.0
+
+    def _option(self, key, default):
+        value = self.bot.get_config_option("outbound." + key)
+        return default if value is None else value
+
+    @asyncio.coroutine
+    def _acquire_token(self):
+        while True:
+            rate = self._option("rate", None)
+            if not rate:
+                return
+            burst = self._option("burst", 10)
+
+            now = time.time()
+            if self._tokens is None:
+                self._tokens = burst
+            else:
+                self._tokens = min(burst, self._tokens + (now - self._refilled_at) * rate)
+            self._refilled_at = now
+
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+
+            yield from asyncio.sleep((1 - self._tokens) / rate)
+
+    @asyncio.coroutine
+    def submit(self, conv_id, send, timeout=None):
+        """queue a message for conv_id and wait until it was sent
+
+        send is a callable that returns a new coroutine for every attempt
+        timeout limits each attempt, in seconds
+        raises the last error if all attempts failed"""
+
+        future = asyncio.Future()
+
+        self.counters["queued"] += 1
+
+        if conv_id in self._queues:
+            self._queues[conv_id].append((future, send, timeout, time.time()))
+        else:
+            self._queues[conv_id] = deque([(future, send, timeout, time.time())])
+            drain = asyncio.ensure_future(self._drain(conv_id))
+            self._drains.add(drain)
+            drain.add_done_callback(self._drained)
+
+        return (yield from future)
+
+    @asyncio.coroutine
+    def _drain(self, conv_id):
+        queue = self._queues[conv_id]
+        try:
+            while queue:
+                future, send, timeout, queued_at = queue[0]
+                if future.done():
+                    logger.warning("dropped message to {} after {:.3f}s in queue: sender gave up waiting".format(
+                        conv_id, time.time() - queued_at))
+                else:
+                    try:
+                        yield from self._send(conv_id, send, timeout)
+                    except Exception as e:
+                        if not future.done():
+                            future.set_exception(e)
+                    else:
+                        if not future.done():
+                            future.set_result(None)
+
+                queue.popleft()
+
+                latency = time.time() - queued_at
+                self._latency_total += latency
+                self._latency_max = max(self._latency_max, latency)
+
+        finally:
+            del self._queues[conv_id]
+            for future, send, timeout, queued_at in queue:
+                if not future.done():
+                    future.cancel()
+
+    def _drained(self, drain):
+        self._drains.discard(drain)
+        if not drain.cancelled() and drain.exception() is not None:
+            logger.error("outbound queue failed", exc_info=drain.exception())
+
+    @asyncio.coroutine
+    def _send(self, conv_id, send, timeout=None):
+        retries = self._option("retries", 3)
+        backoff = self._option("backoff", 1)
+
+        attempt = 0
+        while True:
+            yield from self._acquire_token()
+            try:
+                if timeout is None:
+                    yield from send()
+                else:
+                    yield from asyncio.wait_for(send(), timeout)
+            except (hangups.NetworkError, asyncio.TimeoutError) as e:
+                if attempt >= retries:
+                    self.counters["failed"] += 1
+                    raise
+                delay = backoff * 2 ** attempt
+                attempt += 1
+                self.counters["retried"] += 1
+                logger.warning("send to {} failed ({}), retry {}/{} in {}s".format(conv_id, repr(e), attempt, retries, delay))
+                yield from asyncio.sleep(delay)
+            except Exception:
+                self.counters["failed"] += 1
+                raise
+            else:
+                self.counters["sent"] += 1
+                return
+
+    def depth(self, conv_id=None):
+        """number of queued messages for conv_id, or for all conversations"""
+        if conv_id is not None:
+            return len(self._queues.get(conv_id, ()))
+        return sum(len(queue) for queue in self._queues.values())
+
+    def stats(self):
+        completed = self.counters["queued"] - self.depth()
+        stats = dict(self.counters)
+        stats.update({ "depth": self.depth(),
+                       "conversations": len(self._queues),
+                       "latency.avg": round(self._latency_total / completed, 3) if completed else 0,
+                       "latency.max": round(self._latency_max, 3) })
+        return stats
+
+
 class FakeConversation(object):
     def __init__(self, bot, id_):
         self.bot = bot
@@ -239,14 +395,18 @@ class FakeConversation(object):
 
         """send the message"""
 
-        with (yield from asyncio.Lock()):
-            yield from self._client.send_chat_message(
-                hangups.hangouts_pb2.SendChatMessageRequest(
-                    request_header = self._client.get_request_header(),
-                    message_content = hangups.hangouts_pb2.MessageContent( segment=serialised_segments ),
-                    existing_media = media_attachment,
-                    annotation = annotations,
-                    event_request_header = hangups.hangouts_pb2.EventRequestHeader(
-                        conversation_id=hangups.hangouts_pb2.ConversationId( id=self.id_ ),
-                        client_generated_id=self._client.get_client_generated_id(),
-                        expected_otr = otr_status )))
+        # retries re-use the same request (and client_generated_id)
+        request = hangups.hangouts_pb2.SendChatMessageRequest(
+            request_header = self._client.get_request_header(),
+            message_content = hangups.hangouts_pb2.MessageContent( segment=serialised_segments ),
+            existing_media = media_attachment,
+            annotation = annotations,
+            event_request_header = hangups.hangouts_pb2.EventRequestHeader(
+                conversation_id=hangups.hangouts_pb2.ConversationId( id=self.id_ ),
+                client_generated_id=self._client.get_client_generated_id(),
+                expected_otr = otr_status ))
+
+        yield from self.bot._outbound.submit(
+            self.id_,
+            functools.partial(self._client.send_chat_message, request),
+            timeout = context.get("send_timeout"))
@@ -18,7 +18,7 @@ import plugins
 
 from exceptions import HangupsBotExceptions
 from event import (TypingEvent, WatermarkEvent, ConversationEvent)
-from hangups_conversation import (HangupsConversation, FakeConversation)
+from hangups_conversation import (HangupsConversation, FakeConversation, OutboundQueue)
 
 from commands import command
 from permamem import conversation_memory
@@ -51,6 +51,8 @@ class HangupsBot(object):
 
         self._cache_event_id = {} # workaround for duplicate events
 
+        self._outbound = OutboundQueue(self) # per-conversation send queues
+
         self._locales = {}
 
         # Load config file
@@ -70,11 +72,12 @@ class HangupsBot(object):
         if memory_file:
             _failsafe_backups = int(self.get_config_option('memory-failsafe_backups') or 3)
             _save_delay = int(self.get_config_option('memory-save_delay') or 1)
+            _storage = self.get_config_option('memory-storage') or "json"
 
-            logger.info("memory = {}, failsafe = {}, delay = {}".format(
-                memory_file, _failsafe_backups, _save_delay))
+            logger.info("memory = {}, failsafe = {}, delay = {}, storage = {}".format(
+                memory_file, _failsafe_backups, _save_delay, _storage))
 
-            self.memory = config.Config(memory_file, failsafe_backups=_failsafe_backups, save_delay=_save_delay)
+            self.memory = config.Config(memory_file, failsafe_backups=_failsafe_backups, save_delay=_save_delay, storage=_storage)
             if not os.path.isfile(memory_file):
                 try:
                     logger.info("creating memory file: {}".format(memory_file))
@@ -174,8 +177,8 @@ class HangupsBot(object):
                 finally:
                     loop.run_until_complete(plugins.unload_all(self))
 
-                    self.memory.flush()
-                    self.config.flush()
+                    loop.run_until_complete(self.memory.flush())
+                    loop.run_until_complete(self.config.flush())
 
                 logger.info('Waiting %s seconds...', 5 + retry * 5)
                 time.sleep(5 + retry * 5)
@@ -568,6 +571,7 @@ class HangupsBot(object):
 
         self.conversations = yield from permamem.initialise_permanent_memory(self)
 
+        plugins.load(self, "httpclient")
         plugins.load(self, "commands.plugincontrol")
         plugins.load(self, "commands.basic")
         plugins.load(self, "commands.tagging")
@@ -781,7 +785,7 @@ class HangupsBot(object):
                                              image_id = response[2],
                                              context = context )
             except hangups.NetworkError as e:
-                logger.exception("CORO_SEND_MESSAGE: error sending {}".format(response[0]))
+                logger.exception("CORO_SEND_MESSAGE: error sending {}, giving up after retries".format(response[0]))
 
 
     @asyncio.coroutine
@@ -0,0 +1,98 @@
+"""bot-wide shared aiohttp client session
+
+keep-alive connections and dns lookups are re-used across all plugins:
+
+    session = bot.call_shared("http.session")
+    response = yield from session.get(url)
+    raw = yield from bot.call_shared("http.read", response)
+
+configuration (all optional):
+    "http.limit": total simultaneous connections (default 100)
+    "http.limit_per_host": simultaneous connections per host (default 8)
+    "http.dns_ttl": seconds to cache dns lookups (default 300)
+    "http.timeout": total seconds allowed per request (default 60)
+    "http.max_size": largest response body http.read() accepts, in bytes (default 25MB)
+"""
+
+import asyncio
+import logging
+
+import aiohttp
+
+import plugins
+
+
+logger = logging.getLogger(__name__)
+
+
+_externals = { "bot": None,
+               "session": None }
+
+
+class ResponseTooLarge(aiohttp.ClientError):
+    pass
+
+
+def _initialise(bot):
+    _externals["bot"] = bot
+    plugins.register_shared("http.session", get_session)
+    plugins.register_shared("http.read", read)
+
+
+@asyncio.coroutine
+def _finalise(bot):
+    session = _externals["session"]
+    _externals["session"] = None
+    if session and not session.closed:
+        yield from session.close()
+
+
+def _option(key, default):
+    value = _externals["bot"].get_config_option("http." + key)
+    return default if value is None else value
+
+
+def get_session():
+    """return the shared session, (re)created on first use"""
+    session = _externals["session"]
+    if session is None or session.closed:
+        connector = aiohttp.TCPConnector( limit = _option("limit", 100),
+                                          limit_per_host = _option("limit_per_host", 8),
+                                          use_dns_cache = True,
+                                          ttl_dns_cache = _option("dns_ttl", 300) )
+        session = aiohttp.ClientSession( connector = connector,
+                                         timeout = aiohttp.ClientTimeout(total=_option("timeout", 60)) )
+        _externals["session"] = session
+        logger.info("shared session created")
+    return session
+
+
+@asyncio.coroutine
+def read(response, max_size=None):
+    """read a response body, refusing anything larger than max_size (or http.max_size)
+
+    raises ResponseTooLarge, a subclass of aiohttp.ClientError"""
+
+    if max_size is None:
+        max_size = _option("max_size", 25 * 1024 * 1024)
+
+    try:
+        if response.content_length is not None and response.content_length > max_size:
+            raise ResponseTooLarge("{} declares {} bytes, limit {}".format(
+                response.url, response.content_length, max_size))
+
+        chunks = []
+        size = 0
+        while True:
+            chunk = yield from response.content.read(65536)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > max_size:
+                raise ResponseTooLarge("{} exceeds {} bytes".format(response.url, max_size))
+            chunks.append(chunk)
+
+        return b"".join(chunks)
+
+    finally:
+        response.release()
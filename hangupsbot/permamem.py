@@ -1,4 +1,4 @@
-import asyncio, datetime, logging, random, re
+import asyncio, bisect, datetime, logging, random, re, time
 
 import hangups
 
@@ -45,16 +45,78 @@ def initialise_permanent_memory(bot):
     return permamem
 
 
+def _trigrams(text):
+    return set( text[i:i+3] for i in range(len(text) - 2) )
+
+
 class conversation_memory:
     bot = None
     catalog = {}
 
     log_info_unchanged = False
 
+    lookup_window = 0.25 # seconds to coalesce user lookups
+    lookup_concurrency = 4 # maximum getentitybyid() requests in flight
+    lookup_unknown_backoff = 300 # seconds before an unknown user is retried, doubled each miss
+
     def __init__(self, bot):
         self.bot = bot
         self.catalog = {}
 
+        """user resolution, see get_users_from_query()"""
+        self._lookups = {} # chat_id -> asyncio.Future for queued and in-flight lookups
+        self._lookups_queued = []
+        self._lookups_batch_max = 20
+        self._lookups_handle = None
+        self._lookups_unknown = {} # chat_id -> (misses, retry after timestamp)
+
+        """secondary indices for .get(), maintained by _catalog_set() and _catalog_remove()"""
+        self._indexed = {} # conv_id -> values that were indexed, for removal
+        self._index_participant = {} # chat_id -> set(conv_id)
+        self._index_type = {} # lower-case type -> set(conv_id)
+        self._index_count = [] # sorted [(number of participants, conv_id)]
+        self._index_trigram = {} # title trigram -> set(conv_id)
+
+    def _catalog_set(self, conv_id, convdata):
+        """add or replace a catalog entry, updating all secondary indices"""
+        if conv_id in self._indexed:
+            self._catalog_unindex(conv_id)
+
+        self.catalog[conv_id] = convdata
+
+        participants = tuple(convdata.get("participants", []))
+        type = convdata.get("type", "unknown").lower()
+        title_lower = (convdata.get("title") or "").lower()
+        trigrams = _trigrams(title_lower) | _trigrams(title_lower.replace(" ", ""))
+
+        for chat_id in participants:
+            self._index_participant.setdefault(chat_id, set()).add(conv_id)
+        self._index_type.setdefault(type, set()).add(conv_id)
+        bisect.insort(self._index_count, (len(participants), conv_id))
+        for trigram in trigrams:
+            self._index_trigram.setdefault(trigram, set()).add(conv_id)
+
+        self._indexed[conv_id] = (participants, type, trigrams)
+
+    def _catalog_unindex(self, conv_id):
+        participants, type, trigrams = self._indexed.pop(conv_id)
+
+        for chat_id in participants:
+            self._index_participant[chat_id].discard(conv_id)
+            if not self._index_participant[chat_id]:
+                del self._index_participant[chat_id]
+        self._index_type[type].discard(conv_id)
+        position = bisect.bisect_left(self._index_count, (len(participants), conv_id))
+        del self._index_count[position]
+        for trigram in trigrams:
+            self._index_trigram[trigram].discard(conv_id)
+            if not self._index_trigram[trigram]:
+                del self._index_trigram[trigram]
+
+    def _catalog_remove(self, conv_id):
+        self._catalog_unindex(conv_id)
+        del self.catalog[conv_id]
+
     def stats(self):
         logger.info("total conversations: {}".format(len(self.catalog)))
 
@@ -144,7 +206,7 @@ class conversation_memory:
             _users_to_fetch = []
 
             for convid in convs:
-                self.catalog[convid] = convs[convid]
+                self._catalog_set(convid, convs[convid])
 
                 if "participants" in self.catalog[convid] and len(self.catalog[convid]["participants"]) > 0:
                     for _chat_id in self.catalog[convid]["participants"]:
@@ -204,46 +266,73 @@ class conversation_memory:
 
 
     @asyncio.coroutine
-    def get_users_from_query(self, chat_ids, batch_max=20):
-        """retrieve definitive user data by requesting it from the server"""
+    def get_users_from_query(self, chat_ids, batch_max=20, force=False):
+        """retrieve definitive user data by requesting it from the server
+        * concurrent callers share lookups already in progress or queued for the same chat ids
+        * requests within lookup_window seconds are coalesced, then run in chunks of batch_max
+            with at most lookup_concurrency chunks in flight
+        * chat ids that keep resolving as unknown are skipped for an increasing period,
+            unless force=True
+        returns number of users that were updated
+        """
+
+        loop = asyncio.get_event_loop()
+        now = time.time()
+
+        waiting = []
+        for chat_id in set(chat_ids):
+            if chat_id in self._lookups:
+                waiting.append(self._lookups[chat_id])
+                continue
 
-        chat_ids = list(set(chat_ids))
+            if not force and chat_id in self._lookups_unknown:
+                misses, retry_after = self._lookups_unknown[chat_id]
+                if retry_after > now:
+                    logger.debug("getentitybyid(): skipped {}, unknown {} time(s)".format(chat_id, misses))
+                    continue
 
-        chunks = [ chat_ids[i:i+batch_max]
-                   for i in range(0, len(chat_ids), batch_max) ]
+            future = asyncio.Future()
+            self._lookups[chat_id] = future
+            self._lookups_queued.append(chat_id)
+            waiting.append(future)
 
-        updated_users = 0
+        self._lookups_batch_max = min(self._lookups_batch_max, batch_max)
 
-        for chunk in chunks:
-            logger.debug("getentitybyid(): {}".format(chunk))
+        if self._lookups_queued and not self._lookups_handle:
+            self._lookups_handle = loop.call_later(self.lookup_window, self._lookups_flush)
 
-            try:
-                _request = hangups.hangouts_pb2.GetEntityByIdRequest(
-                    request_header=self.bot._client.get_request_header(),
-                    batch_lookup_spec=[ hangups.hangouts_pb2.EntityLookupSpec( gaia_id=chat_id) 
-                                        for chat_id in chunk ])
+        if not waiting:
+            return 0
 
-                _response = yield from self.bot._client.get_entity_by_id(_request)
+        # futures are shared with other callers, cancelling this caller must not cancel them
+        results = yield from asyncio.gather(*[ asyncio.shield(future) for future in waiting ])
 
-                for _user in _response.entity:
-                    UserID = hangups.user.UserID(chat_id=_user.id.chat_id, gaia_id=_user.id.gaia_id)
-                    User = hangups.user.User(
-                        UserID,
-                        _user.properties.display_name,
-                        _user.properties.first_name,
-                        _user.properties.photo_url,
-                        list(_user.properties.email), # repeated field
-                        False)
+        return sum(results)
 
-                    """this function usually called because hangups user list is incomplete, so help fill it in as well"""
-                    logger.debug("updating hangups user list {} ({})".format(User.id_.chat_id, User.full_name))
-                    self.bot._user_list._user_dict[User.id_] = User
+    def _lookups_flush(self):
+        """take everything queued so far and start a batched lookup for it"""
+        queued, self._lookups_queued = self._lookups_queued, []
+        batch_max, self._lookups_batch_max = self._lookups_batch_max, 20
+        self._lookups_handle = None
 
-                    if self.store_user_memory(User, is_definitive=True, automatic_save=False):
-                        updated_users = updated_users + 1
+        chunks = [ queued[i:i+batch_max]
+                   for i in range(0, len(queued), batch_max) ]
 
-            except hangups.exceptions.NetworkError as e:
-                logger.exception("getentitybyid(): FAILED for chunk {}".format(chunk))
+        asyncio.ensure_future(
+            self._lookups_run(chunks)
+        ).add_done_callback(self._lookups_done)
+
+    def _lookups_done(self, future):
+        if not future.cancelled() and future.exception() is not None:
+            logger.error("getentitybyid(): batched lookup failed", exc_info=future.exception())
+
+    @asyncio.coroutine
+    def _lookups_run(self, chunks):
+        semaphore = asyncio.Semaphore(self.lookup_concurrency)
+
+        updated = yield from asyncio.gather(*[ self._lookups_chunk(chunk, semaphore)
+                                               for chunk in chunks ])
+        updated_users = sum(updated)
 
         if updated_users > 0:
             self.bot.memory.save()
@@ -252,7 +341,73 @@ class conversation_memory:
             if self.log_info_unchanged:
                 logger.info("getentitybyid(): no change")
 
-        return updated_users
+    @asyncio.coroutine
+    def _lookups_chunk(self, chunk, semaphore):
+        updated = { chat_id: False for chat_id in chunk }
+        resolved = set()
+        answered = False # only an answer from the server can report chat ids as unknown
+        error = None
+
+        try:
+            with (yield from semaphore):
+                logger.debug("getentitybyid(): {}".format(chunk))
+
+                try:
+                    _request = hangups.hangouts_pb2.GetEntityByIdRequest(
+                        request_header=self.bot._client.get_request_header(),
+                        batch_lookup_spec=[ hangups.hangouts_pb2.EntityLookupSpec( gaia_id=chat_id)
+                                            for chat_id in chunk ])
+
+                    _response = yield from self.bot._client.get_entity_by_id(_request)
+                    answered = True
+
+                    for _user in _response.entity:
+                        UserID = hangups.user.UserID(chat_id=_user.id.chat_id, gaia_id=_user.id.gaia_id)
+                        User = hangups.user.User(
+                            UserID,
+                            _user.properties.display_name,
+                            _user.properties.first_name,
+                            _user.properties.photo_url,
+                            list(_user.properties.email), # repeated field
+                            False)
+
+                        """this function usually called because hangups user list is incomplete, so help fill it in as well"""
+                        logger.debug("updating hangups user list {} ({})".format(User.id_.chat_id, User.full_name))
+                        self.bot._user_list._user_dict[User.id_] = User
+
+                        if not (User.full_name.upper() == "UNKNOWN" and User.first_name == User.full_name):
+                            resolved.add(User.id_.chat_id)
+
+                        if self.store_user_memory(User, is_definitive=True, automatic_save=False):
+                            updated[User.id_.chat_id] = True
+
+                except hangups.exceptions.NetworkError as e:
+                    logger.exception("getentitybyid(): FAILED for chunk {}".format(chunk))
+
+        except Exception as e:
+            # unexpected failure: passed on to the waiters, the chat ids are not counted as unknown
+            logger.exception("getentitybyid(): FAILED for chunk {}".format(chunk))
+            error = e
+
+        finally:
+            # waiters must always be released, even if the lookup failed unexpectedly
+            now = time.time()
+            for chat_id in chunk:
+                if chat_id in resolved:
+                    self._lookups_unknown.pop(chat_id, None)
+                elif answered and error is None:
+                    misses = self._lookups_unknown.get(chat_id, (0, 0))[0] + 1
+                    retry_after = now + min(self.lookup_unknown_backoff * 2 ** (misses - 1), 86400)
+                    self._lookups_unknown[chat_id] = (misses, retry_after)
+
+                future = self._lookups.pop(chat_id, None)
+                if future is not None and not future.done():
+                    if error is not None:
+                        future.set_exception(error)
+                    else:
+                        future.set_result(updated.get(chat_id, False))
+
+        return sum(updated.values())
 
 
     def store_user_memory(self, User, automatic_save=True, is_definitive=False):
@@ -439,7 +594,7 @@ class conversation_memory:
             memory["updated"] = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
             self.bot.memory.set_by_path(["convmem", conv.id_], memory)
 
-            self.catalog[conv.id_] = memory
+            self._catalog_set(conv.id_, memory)
 
             if automatic_save:
                 # if users_changed this would write those changes as well
@@ -467,7 +622,7 @@ class conversation_memory:
             if _cached["type"] == "GROUP":
                 logger.info("removing conv: {} {}".format(conv_id, _cached["title"]))
                 self.bot.memory.pop_by_path(["convmem", conv_id])
-                del self.catalog[conv_id]
+                self._catalog_remove(conv_id)
 
             else:
                 logger.warning("cannot remove conv: {} {} {}".format(
@@ -508,85 +663,97 @@ class conversation_memory:
             # second condition is to ensure at least one term, even if blank
             terms.append([operator, raw_filter])
 
-        sourcelist = self.catalog.copy()
-        matched = {}
+        sourcelist = None # None represents the entire catalog
+        matched = set()
 
         logger.debug("get(): {}".format(terms))
 
         for operator, term in terms:
             if operator == "and":
                 sourcelist = matched
-                matched = {}
-
-            """extra search term types added here"""
-
-            if not term:
-                # return everything
-                matched = sourcelist
-
-            elif term.startswith("id:"):
-                # explicit request for single conv
-                convid = term[3:]
-                matched[convid] = sourcelist[convid]
-
-            elif term in sourcelist:
-                # prioritise exact convid matches
-                matched[term] = sourcelist[term]
-
-            elif term.startswith("text:"):
-                # perform case-insensitive search
-                filter_lower = term[5:].lower()
-                for convid, convdata in sourcelist.items():
-                    title_lower = convdata["title"].lower()
-                    if( filter_lower in title_lower
-                            or filter_lower in title_lower.replace(" ", "") ):
-                        matched[convid] = convdata
-
-            elif term.startswith("chat_id:"):
-                # return all conversations user is in
-                filter_chat_id = term[8:]
-                for convid, convdata in sourcelist.items():
-                    for chat_id in convdata["participants"]:
-                        if filter_chat_id == chat_id:
-                            matched[convid] = convdata
-
-            elif term.startswith("tag:"):
-                # return all conversations with the tag
-                filter_tag = term[4:]
-                if filter_tag in self.bot.tags.indices["tag-convs"]:
-                    for conv_id in self.bot.tags.indices["tag-convs"][filter_tag]:
-                        if conv_id in sourcelist:
-                            matched[conv_id] = sourcelist[conv_id]
-
-            elif term.startswith("type:"):
-                # return all conversations with matching type (case-insensitive)
-                filter_type = term[5:]
-                for convid, convdata in sourcelist.items():
-                    if convdata["type"].lower() == filter_type.lower():
-                        matched[convid] = convdata
-
-            elif term.startswith("minusers:"):
-                # return all conversations with number of users or higher
-                filter_numusers = term[9:]
-                for convid, convdata in sourcelist.items():
-                    if len(convdata["participants"]) >= int(filter_numusers):
-                        matched[convid] = convdata
-
-            elif term.startswith("maxusers:"):
-                # return all conversations with number of users or lower
-                filter_numusers = term[9:]
-                for convid, convdata in sourcelist.items():
-                    if len(convdata["participants"]) <= int(filter_numusers):
-                        matched[convid] = convdata
-
-            elif term.startswith("random:"):
-                # return random conversations based on selection threshold
-                filter_random = term[7:]
-                for convid, convdata in sourcelist.items():
-                    if random.random() <= float(filter_random):
-                        matched[convid] = convdata
-
-        return matched
+                matched = set()
+
+            results = self._match_term(term, sourcelist)
+            if sourcelist is not None:
+                results &= sourcelist
+
+            matched |= results
+
+        return { convid: self.catalog[convid] for convid in matched }
+
+    def _match_term(self, term, sourcelist):
+        """evaluate a single filter term using the secondary indices, returns a set of conv ids
+        results may still contain conv ids outside of sourcelist
+        """
+
+        """extra search term types added here"""
+
+        if not term:
+            # return everything
+            return set(self.catalog) if sourcelist is None else set(sourcelist)
+
+        elif term.startswith("id:"):
+            # explicit request for single conv
+            convid = term[3:]
+            if convid not in (self.catalog if sourcelist is None else sourcelist):
+                raise KeyError(convid)
+            return { convid }
+
+        elif term in (self.catalog if sourcelist is None else sourcelist):
+            # prioritise exact convid matches
+            return { term }
+
+        elif term.startswith("text:"):
+            # perform case-insensitive search
+            filter_lower = term[5:].lower()
+            filter_trigrams = _trigrams(filter_lower)
+            if filter_trigrams:
+                candidates = set.intersection(*[ self._index_trigram.get(trigram, set())
+                                                 for trigram in filter_trigrams ])
+            else:
+                # too short to use the index
+                candidates = self.catalog if sourcelist is None else sourcelist
+
+            results = set()
+            for convid in candidates:
+                title_lower = self.catalog[convid]["title"].lower()
+                if( filter_lower in title_lower
+                        or filter_lower in title_lower.replace(" ", "") ):
+                    results.add(convid)
+            return results
+
+        elif term.startswith("chat_id:"):
+            # return all conversations user is in
+            return set(self._index_participant.get(term[8:], set()))
+
+        elif term.startswith("tag:"):
+            # return all conversations with the tag
+            filter_tag = term[4:]
+            if filter_tag in self.bot.tags.indices["tag-convs"]:
+                return set(self.bot.tags.indices["tag-convs"][filter_tag]) & set(self.catalog)
+            return set()
+
+        elif term.startswith("type:"):
+            # return all conversations with matching type (case-insensitive)
+            return set(self._index_type.get(term[5:].lower(), set()))
+
+        elif term.startswith("minusers:"):
+            # return all conversations with number of users or higher
+            position = bisect.bisect_left(self._index_count, (int(term[9:]), ""))
+            return set( convid for count, convid in self._index_count[position:] )
+
+        elif term.startswith("maxusers:"):
+            # return all conversations with number of users or lower
+            position = bisect.bisect_left(self._index_count, (int(term[9:]) + 1, ""))
+            return set( convid for count, convid in self._index_count[:position] )
+
+        elif term.startswith("random:"):
+            # return random conversations based on selection threshold
+            filter_random = float(term[7:])
+            return set( convid for convid in (self.catalog if sourcelist is None else sourcelist)
+                        if random.random() <= filter_random )
+
+        return set()
 
     def get_name(self, conv, truncate=False, fallback_string=False):
         """drop-in replacement for hangups.ui.utils.get_conv_name
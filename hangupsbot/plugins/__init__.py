@@ -539,6 +539,8 @@ def unload(bot, module_path):
                         logger.debug("deregistering tagged command {}".format(command_name))
                         del command.command_tagsets[command_name]
 
+            command.invalidate()
+
             for type in bot._handlers.pluggables:
                 for handler in bot._handlers.pluggables[type]:
                     if handler[2]["module.path"] == module_path:
@@ -1,13 +1,14 @@
 import aiohttp
 import asyncio
+import functools
 import json
 import logging
 import re
 import requests
+import time
 
 from html import unescape
 from urllib.parse import parse_qs
-from urllib.request import urlopen
 
 import emoji
 
@@ -29,6 +30,13 @@ _externals = { "plugin_name": "slackBasic", # same plugin name in SlackAsyncList
 
 class SlackAsyncListener(AsyncRequestHandler):
     _slack_cache = {"user": {}, "channel": {}}
+    _slack_cache_refreshed = {"user": 0, "channel": 0}
+    _slack_cache_refreshing = {} # type_str -> future of the running bulk refresh
+
+    # labels are refreshed in bulk once they are older than slack_label_ttl,
+    #   unknown ids trigger a bulk refresh at most every slack_label_retry seconds
+    slack_label_ttl = 3600
+    slack_label_retry = 60
 
     def process_request(self, path, query_string, content):
         payload  = parse_qs(content)
@@ -56,8 +64,8 @@ class SlackAsyncListener(AsyncRequestHandler):
                         file_name = tokens[1]
                         text = re.sub(re.escape(match), "{} with title \"{}\"".format(full_link, file_name), text)
 
-                    text = self._slack_label_users(text)
-                    text = self._slack_label_channels(text)
+                    text = yield from self._slack_label_users(text)
+                    text = yield from self._slack_label_channels(text)
 
                     user = payload["user_name"][0] + "@slack"
                     original_message = unescape(text)
@@ -70,56 +78,97 @@ class SlackAsyncListener(AsyncRequestHandler):
                         {   "source_user": user,
                             "source_title": False })
 
+    @asyncio.coroutine
     def _slack_label_users(self, text):
         for fragment in re.findall("(<@([A-Z0-9]+)(\|[^>]*?)?>)", text):
             """detect and map <@Uididid> and <@Uididid|namename>"""
             full_token = fragment[0]
             id = full_token[2:-1].split("|", maxsplit=1)[0]
-            username = self._slack_get_label(id, "user")
+            username = yield from self._slack_get_label(id, "user")
             text = text.replace(full_token, username)
         return text
 
+    @asyncio.coroutine
     def _slack_label_channels(self, text):
         for fragment in re.findall("<#[A-Z0-9]+>", text):
             id = fragment[2:-1]
-            username = self._slack_get_label(id, "channel")
+            username = yield from self._slack_get_label(id, "channel")
             text = text.replace(fragment, username)
         return text
 
+    @asyncio.coroutine
     def _slack_get_label(self, id, type_str):
-        # hacky way to get the first token:
-        slack_sink_configuration = self._bot.get_config_option('slack')
-        token = slack_sink_configuration[0]["key"]
-
-        prefix = "?"
         if type_str == "user":
-            url = 'https://slack.com/api/users.info?token=' + token + '&user=' + id
             prefix = "@"
         elif type_str == "channel":
-            url = 'https://slack.com/api/channels.info?token=' + token + '&channel=' + id
             prefix = "#"
         else:
             raise ValueError('unknown label type_str')
 
-        label = "UNKNOWN"
-        if id in self._slack_cache[type_str]:
-            label = self._slack_cache[type_str][id]
+        cache = self._slack_cache[type_str]
+        age = time.time() - self._slack_cache_refreshed[type_str]
+        if age > self.slack_label_ttl or (id not in cache and age > self.slack_label_retry):
+            yield from self._slack_refresh_labels(type_str)
+
+        if id in cache:
+            label = cache[id]
             logger.debug("slack label resolved from cache: {} = {}".format(id, label))
         else:
-            try:
-                response = urlopen(url)
-                json_string = str(response.read().decode('utf-8'))
-                data = json.loads(json_string)
-                if type_str in data:
-                    label = data[type_str]["name"]
-                    self._slack_cache[type_str][id] = label
-                    logger.debug("slack label resolved from API: {} = {}".format(id, label))
-
-            except Exception as e:
-                logger.exception("FAILED to resolve slack label for {}".format(id))
+            label = "UNKNOWN"
 
         return prefix + label
 
+    @asyncio.coroutine
+    def _slack_refresh_labels(self, type_str):
+        """refresh all labels of type_str with users.list/channels.list,
+            concurrent callers share the running refresh"""
+
+        refreshing = self._slack_cache_refreshing.get(type_str)
+        if refreshing is None:
+            refreshing = asyncio.ensure_future(self._slack_fetch_labels(type_str))
+            self._slack_cache_refreshing[type_str] = refreshing
+            refreshing.add_done_callback(lambda future: self._slack_cache_refreshing.pop(type_str, None))
+
+        yield from asyncio.shield(refreshing)
+
+    @asyncio.coroutine
+    def _slack_fetch_labels(self, type_str):
+        # hacky way to get the first token:
+        slack_sink_configuration = self._bot.get_config_option('slack')
+        token = slack_sink_configuration[0]["key"]
+
+        if type_str == "user":
+            url, key = 'https://slack.com/api/users.list', "members"
+        else:
+            url, key = 'https://slack.com/api/channels.list', "channels"
+
+        labels = {}
+        params = { "token": token, "limit": 1000 }
+        try:
+            session = self._bot.call_shared("http.session")
+            while True:
+                response = yield from session.get(url, params=params)
+                data = json.loads((yield from self._bot.call_shared("http.read", response)).decode('utf-8'))
+                if not data.get("ok"):
+                    raise RuntimeError(data.get("error"))
+                for item in data.get(key, []):
+                    labels[item["id"]] = item["name"]
+                cursor = data.get("response_metadata", {}).get("next_cursor")
+                if not cursor:
+                    break
+                params["cursor"] = cursor
+
+        except Exception as e:
+            logger.exception("FAILED to refresh slack {} labels".format(type_str))
+
+        else:
+            self._slack_cache[type_str].clear()
+            self._slack_cache[type_str].update(labels)
+            logger.debug("slack {} labels refreshed from API: {}".format(type_str, len(labels)))
+
+        # failures also wait for slack_label_retry before hitting the API again
+        self._slack_cache_refreshed[type_str] = time.time()
+
 class BridgeInstance(WebFramework):
     def setup_plugin(self):
         self.plugin_name = _externals["plugin_name"]
@@ -161,7 +210,14 @@ class BridgeInstance(WebFramework):
     def _send_deferred_photo(self, image_link, relay_channels, client, slack_api_params):
         for relay_channel in relay_channels:
             logger.info("deferred post to {}".format(relay_channel))
-            client.chat_post_message(relay_channel,  image_link, **slack_api_params)
+            yield from self._chat_post_message(client, relay_channel, image_link, slack_api_params)
+
+    @asyncio.coroutine
+    def _chat_post_message(self, client, channel, message, slack_api_params):
+        # pyslack is blocking, keep it off the event loop
+        yield from asyncio.get_event_loop().run_in_executor(
+            None,
+            functools.partial(client.chat_post_message, channel, message, **slack_api_params))
 
     @asyncio.coroutine
     def _send_to_external_chat(self, config, event):
@@ -226,7 +282,7 @@ class BridgeInstance(WebFramework):
         """standard message relay"""
 
         for relay_channel in relay_channels:
-            client.chat_post_message(relay_channel,  message, **slack_api_params)
+            yield from self._chat_post_message(client, relay_channel, message, slack_api_params)
 
 
 def _initialise(bot):
@@ -11,7 +11,7 @@ import urllib.parse
 from hangups import hangouts_pb2
 import emoji
 
-from webbridge import WebFramework, FakeEvent
+from webbridge import WebFramework, FakeEvent, routing
 import plugins
 
 from .core import HANGOUTS, SLACK, Base, Message
@@ -156,7 +156,7 @@ class BridgeInstance(WebFramework):
                     raise ValueError("MIME '{}' does not match extension '{}', we probably didn't get the right file." +
                                      " Attempt [{}/3]"
                                      .format(mime_type, name_ext, retry_count+1))
-                image = yield from resp.read()
+                image = yield from self.bot.call_shared("http.read", resp)
                 image_id = yield from self.bot._client.upload_image(BytesIO(image), filename=filename)
                 yield from self._relay_msg(msg, conv_id, image_id)
                 break
@@ -203,7 +203,7 @@ def on_membership_change(bot, event, command=""):
     for team, channel in syncs:
         for bridge in Base.bridges[team]:
             if bridge.channel == channel:
-                config = bridge.applicable_configuration(event.conv_id)
+                config = routing.lookup(bridge, event.conv_id)
                 passthru = {"original_request": {"message": text,
                                                  "image_id": None,
                                                  "segments": None,
@@ -1,4 +1,3 @@
-import aiohttp
 import asyncio
 from collections import defaultdict
 import logging
@@ -72,7 +71,11 @@ class Slack(object):
         self.callbacks = []
         # Internal tracking of the RTM task, used to cancel on plugin unload.
         self._task = None
-        self._sess = aiohttp.ClientSession()
+
+    @property
+    def _sess(self):
+        # keep-alive connections are shared with the other plugins
+        return Base.bot.call_shared("http.session")
 
     @asyncio.coroutine
     def dm(self, user_id):
@@ -189,8 +192,6 @@ class Slack(object):
         if self._task:
             self._task.cancel()
             self._task = None
-        if self._sess:
-            yield from self._sess.close()
 
 
 class Identities(object):
@@ -13,6 +13,8 @@ logger = logging.getLogger(__name__)
 
 
 class BridgeInstance(WebFramework):
+    relay_via_outbound = True
+
     def setup_plugin(self):
         self.plugin_name = "syncroomsBasic"
 
@@ -68,28 +70,37 @@ class BridgeInstance(WebFramework):
         if attach and not message:
             message = "shared an image"
 
-        for relay_id in relay_ids:
-            """XXX: media sending:
+        """XXX: media sending:
 
-            * if media link is already available, send it immediately
-              * real events from google servers will have the medialink in event.conv_event.attachment
-            """
+        * if media link is already available, send it immediately
+          * real events from google servers will have the medialink in event.conv_event.attachment
+        """
 
-            # catch actual events with media link, upload it to get a valid image id
-            if attach:
-                logger.info("media link in original event: {}".format(attach))
-                image_id = yield from self.bot.call_shared("image_upload_single", attach)
+        # catch actual events with media link, upload it once to get a valid image id for every target
+        if attach:
+            logger.info("media link in original event: {}".format(attach))
+            image_id = yield from self._upload_attachment(attach)
 
-            """standard message relay"""
+        """standard message relay"""
 
-            formatted_message = self.format_incoming_message( message,
-                                                              event.passthru["chatbridge"] )
+        formatted_message = self.format_incoming_message( message,
+                                                          event.passthru["chatbridge"] )
 
-            yield from self.bot.coro_send_message(
+        # delivered directly: this already runs inside a _fan_out() slot, a nested fan-out
+        #   would wait for slots held by its own callers
+        timeout = self.relay_timeout()
+        results = yield from asyncio.gather(*[
+            self.bot.coro_send_message(
                 relay_id,
                 formatted_message,
                 image_id = image_id,
-                context = { "passthru": event.passthru })
+                context = { "passthru": event.passthru,
+                            "send_timeout": timeout })
+            for relay_id in relay_ids ], return_exceptions=True)
+
+        for relay_id, result in zip(relay_ids, results):
+            if isinstance(result, Exception):
+                logger.error("{}:{}:relay to {} failed: {}".format(self.plugin_name, self.uid, relay_id, repr(result)))
 
     def start_listening(self, bot):
         """syncrooms do not need any special listeners"""
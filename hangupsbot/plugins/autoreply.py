@@ -4,10 +4,15 @@ import hangups
 
 import plugins
 
+from utils import PhraseAutomaton
+
 
 logger = logging.getLogger(__name__)
 
 
+_compiled = {} # conv_id -> ((config generation, merge), AutoreplyRules)
+
+
 def _initialise(bot):
     plugins.register_handler(_handle_autoreply, type="message")
     plugins.register_handler(_handle_autoreply, type="membership")
@@ -39,19 +44,26 @@ def _handle_autoreply(bot, event, command):
     else:
         raise RuntimeError("unhandled event type")
 
-    # get_config_suboption returns the convo specific autoreply settings. If none set, it returns the global settings.
-    autoreplies_list = bot.get_config_suboption(event.conv_id, 'autoreplies')
+    for kwds, sentences in _compiled_rules(bot, event.conv_id).matching(event_type, event.text):
 
-    """option to merge per-conversation and global autoreplies, by:
-    * tagging a conversation with "autoreplies-merge" explicitly or by wildcard conv tag
-    * setting global config key: autoreplies.merge = true
-    note: you must also define the appropriate autoreply keys for a specific conversation
-    (by default per-conversation autoreplies replaces global autoreplies settings completely)"""
+        if isinstance(sentences, list):
+            message = random.choice(sentences)
+        else:
+            message = sentences
 
-    tagged_autoreplies_merge = "autoreplies-merge" in bot.tags.convactive(event.conv_id)
-    config_autoreplies_merge = bot.get_config_option('autoreplies.merge') or False
+        if isinstance(kwds, list):
+            logger.info("matched chat: {}".format(kwds))
+        else:
+            logger.info("matched event: {}".format(kwds))
+
+        yield from send_reply(bot, event, message)
 
-    if tagged_autoreplies_merge or config_autoreplies_merge:
+
+def _merged_rules(bot, conv_id, merge):
+    # get_config_suboption returns the convo specific autoreply settings. If none set, it returns the global settings.
+    autoreplies_list = bot.get_config_suboption(conv_id, 'autoreplies') or []
+
+    if merge:
 
         # load any global settings as well
         autoreplies_list_global = bot.get_config_option('autoreplies')
@@ -80,28 +92,90 @@ def _handle_autoreply(bot, event, command):
                 if not overlap:
                     add_to_autoreplies.extend( [[kwds_gbl, sentences_gbl]] )
 
-            # Extend original list with non-disgarded entries.
-            autoreplies_list.extend( add_to_autoreplies )
+            # Consolidate into a new list, the configured lists must not be modified.
+            autoreplies_list = autoreplies_list + add_to_autoreplies
 
-    if autoreplies_list:
-        for kwds, sentences in autoreplies_list:
+    return autoreplies_list
 
-            if isinstance(sentences, list):
-                message = random.choice(sentences)
-            else:
-                message = sentences
 
-            if isinstance(kwds, list):
-                for kw in kwds:
-                    if _words_in_text(kw, event.text) or kw == "*":
-                        logger.info("matched chat: {}".format(kw))
-                        yield from send_reply(bot, event, message)
-                        break
+def _compiled_rules(bot, conv_id):
+    """compiled autoreplies for conv_id, cached per config generation
+
+    option to merge per-conversation and global autoreplies, by:
+    * tagging a conversation with "autoreplies-merge" explicitly or by wildcard conv tag
+    * setting global config key: autoreplies.merge = true
+    note: you must also define the appropriate autoreply keys for a specific conversation
+    (by default per-conversation autoreplies replaces global autoreplies settings completely)"""
+
+    tagged_autoreplies_merge = "autoreplies-merge" in bot.tags.convactive(conv_id)
+    config_autoreplies_merge = bot.get_config_option('autoreplies.merge') or False
+    merge = bool(tagged_autoreplies_merge or config_autoreplies_merge)
+
+    key = (bot.config.generation, merge)
+    cached = _compiled.get(conv_id)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+
+    rules = AutoreplyRules(_merged_rules(bot, conv_id, merge))
+    _compiled[conv_id] = (key, rules)
+    return rules
+
+
+def _is_word(char):
+    return char.isalnum() or char == "_"
 
-            elif event_type == kwds:
-                logger.info("matched event: {}".format(kwds))
-                yield from send_reply(bot, event, message)
 
+class AutoreplyRules:
+    """autoreply rules of a conversation, compiled once so that every message is scanned once
+    * literal keywords share a single utils.PhraseAutomaton, a hit is accepted on the
+      same boundaries as _words_in_text()
+    * "regex:" keywords are compiled once and searched individually
+    * "*" matches any text, event rules ("JOIN", "LEAVE", "RENAME", ...) match by type
+    """
+
+    def __init__(self, rules):
+        self.rules = rules
+        self._always = set() # rule indices
+        self._events = {} # event type -> set of rule indices
+        self._keywords = {} # literal keyword -> set of rule indices
+        self._patterns = [] # (compiled regex, rule index)
+
+        for number, (kwds, sentences) in enumerate(rules):
+            if isinstance(kwds, str):
+                self._events.setdefault(kwds, set()).add(number)
+                continue
+            elif not isinstance(kwds, list):
+                continue
+
+            for kw in kwds:
+                if not isinstance(kw, str):
+                    logger.warning("invalid autoreply keyword {}".format(kw))
+                elif kw == "*":
+                    self._always.add(number)
+                elif kw and not kw.startswith("regex:"):
+                    self._keywords.setdefault(kw, set()).add(number)
+                else:
+                    try:
+                        self._patterns.append((_compile_words(kw), number))
+                    except re.error as e:
+                        logger.warning("invalid autoreply keyword {}: {}".format(kw, e))
+
+        self._automaton = PhraseAutomaton(self._keywords)
+
+    def matching(self, event_type, text):
+        """list of rules matching an event of event_type with text, in configured order"""
+        matched = self._always | self._events.get(event_type, set())
+
+        for start, end, kw in self._automaton.finditer(text):
+            if ( (start == 0 or not _is_word(text[start - 1]))
+                    and (end == len(text) or not _is_word(text[end])) ):
+                matched |= self._keywords[kw]
+
+        for pattern, number in self._patterns:
+            if number not in matched and pattern.search(text):
+                matched.add(number)
+
+        return [ self.rules[number] for number in sorted(matched) ]
 
 @asyncio.coroutine
 def send_reply(bot, event, message):
@@ -168,17 +242,19 @@ def send_reply(bot, event, message):
     return True
 
 
-def _words_in_text(word, text):
-    """Return True if word is in text"""
-
+def _compile_words(word):
     if word.startswith("regex:"):
         word = word[6:]
     else:
         word = re.escape(word)
 
-    regexword = "(?<!\w)" + word + "(?!\w)"
+    return re.compile("(?<!\w)" + word + "(?!\w)", re.IGNORECASE)
+
+
+def _words_in_text(word, text):
+    """Return True if word is in text"""
 
-    return True if re.search(regexword, text, re.IGNORECASE) else False
+    return True if _compile_words(word).search(text) else False
 
 
 def autoreply(bot, event, cmd=None, *args):
@@ -225,7 +301,7 @@ def autoreply(bot, event, cmd=None, *args):
 * FOR FUTURE-PROOFING, INCLUDE [image] PLUGIN IN YOUR CONFIG.JSON
 """
 
-import aiohttp, io, os, re
+import io, os, re
 
 def image_validate_link(image_uri, reject_googleusercontent=True):
     """
@@ -277,8 +353,8 @@ def image_validate_link(image_uri, reject_googleusercontent=True):
 def image_upload_single(image_uri, bot):
     logger.info("getting {}".format(image_uri))
     filename = os.path.basename(image_uri)
-    r = yield from aiohttp.request('get', image_uri)
-    raw = yield from r.read()
+    r = yield from bot.call_shared("http.session").get(image_uri)
+    raw = yield from bot.call_shared("http.read", r)
     image_data = io.BytesIO(raw)
     image_id = yield from bot._client.upload_image(image_data, filename=filename)
     return image_id
@@ -2,7 +2,6 @@ import asyncio, logging
 
 
 import discord
-import aiohttp
 import plugins
 import io
 
@@ -207,8 +206,9 @@ async def on_message(message):
     if attachments_len > 0:
         LOGGER.info("We have an attachment that needs fwding...")
         for a in message.attachments:
-            async with aiohttp.request("GET", a.url) as resp:
-                raw = await resp.read()
+            session = CLIENT.hangouts_bot.call_shared("http.session")
+            async with session.get(a.url) as resp:
+                raw = await CLIENT.hangouts_bot.call_shared("http.read", resp)
                 image_data = io.BytesIO(raw)
                 LOGGER.info("uploading: {}".format(a.url))
                 image_id = await CLIENT.hangouts_bot._client.upload_image(
@@ -14,8 +14,7 @@ import plugins
 logger = logging.getLogger(__name__)
 
 
-_externals = { "bot": None,
-               "ClientSession": aiohttp.ClientSession() }
+_externals = { "bot": None }
 
 
 try:
@@ -91,7 +90,7 @@ def image_upload_single(image_uri):
     filename = os.path.basename(image_uri)
     logger.info("fetching {}".format(filename))
     try:
-        r = yield from _externals["ClientSession"].get(image_uri)
+        r = yield from _externals["bot"].call_shared("http.session").get(image_uri)
         content_type = r.headers['Content-Type']
 
         image_handling = False # must == True if valid image, can contain additonal directives
@@ -111,7 +110,7 @@ def image_upload_single(image_uri):
 
         if image_handling:
             logger.debug("reading {}".format(image_uri))
-            raw = yield from r.read()
+            raw = yield from _externals["bot"].call_shared("http.read", r)
             logger.debug("finished {}".format(image_uri))
             if image_handling is not "standard":
                 try:
@@ -123,6 +122,7 @@ def image_upload_single(image_uri):
                     logger.exception("custom image handler failed: {}".format(image_handling))
         else:
             logger.warning("not image/image-like, filename={}, headers={}".format(filename, r.headers))
+            r.release()
             return False
 
     except (aiohttp_clienterror) as exc:
@@ -2,15 +2,24 @@
 based on the word/image list for the image linker bot on reddit
 sauce: http://www.reddit.com/r/image_linker_bot/comments/2znbrg/image_suggestion_thread_20/
 """
-import aiohttp, io, logging, os, random, re
+import asyncio, io, logging, os, random, re
 
 import plugins
 
+from handlers import ExpiringRegistry
+
 
 logger = logging.getLogger(__name__)
 
 
 _lookup = {}
+_order = {} # trigger -> position in sauce.txt
+
+# every <word>.<ext> token, triggers are resolved by looking up <word> in _lookup
+_trigger_token = re.compile(r'\b(\w+)\.(?:jpg|png|gif|bmp)\b')
+
+# image link -> upload future, repeated memes re-use the image_id
+_uploads = ExpiringRegistry("reddit meme uploads", ttl=86400, max_size=500)
 
 
 def _initialise(bot):
@@ -29,39 +38,60 @@ def redditmemeword(bot, event, *args):
 
 def _scan_for_triggers(bot, event, command):
     limit = 3
-    count = 0
-    lctext = event.text.lower()
-    image_links = []
-    for trigger in _lookup:
-        pattern = '\\b' + trigger + '\.(jpg|png|gif|bmp)\\b'
-        if re.search(pattern, lctext):
-            image_links.append(_get_a_link(trigger))
-            count = count + 1
-            if count >= limit:
-                break
+    triggers = set( token for token in _trigger_token.findall(event.text.lower())
+                    if token in _lookup )
+
+    image_links = [ _get_a_link(trigger) for trigger in sorted(triggers, key=_order.get)[:limit] ]
 
     image_links = list(set(image_links)) # make unique
 
     if len(image_links) > 0:
         for image_link in image_links:
-            try:
-                image_id = yield from bot.call_shared('image_validate_and_upload_single', image_link)
-            except KeyError:
-                logger.warning('image plugin not loaded - using legacy code')
-                if re.match(r'^https?://gfycat.com', image_link):
-                    image_link = re.sub(r'^https?://gfycat.com/', 'https://thumbs.gfycat.com/', image_link) + '-size_restricted.gif'
-                elif "imgur.com" in image_link:
-                    image_link = image_link.replace(".gifv",".gif")
-                    image_link = image_link.replace(".webm",".gif")
-                filename = os.path.basename(image_link)
-                r = yield from aiohttp.request('get', image_link)
-                raw = yield from r.read()
-                image_data = io.BytesIO(raw)
-                logger.debug("uploading: {}".format(filename))
-                image_id = yield from bot._client.upload_image(image_data, filename=filename)
+            image_id = yield from _upload_cached(bot, image_link)
             yield from bot.coro_send_message(event.conv.id_, "", image_id=image_id)
 
 
+@asyncio.coroutine
+def _upload_cached(bot, image_link):
+    """upload image_link once, concurrent and later triggers await the same upload"""
+    upload = _uploads.get(image_link)
+    if upload is None:
+        upload = asyncio.ensure_future(_upload(bot, image_link))
+        _uploads[image_link] = upload
+
+    try:
+        image_id = yield from asyncio.shield(upload)
+    except Exception:
+        if _uploads.get(image_link) is upload:
+            _uploads.pop(image_link, None)
+        raise
+
+    if not image_id and _uploads.get(image_link) is upload:
+        _uploads.pop(image_link, None)
+
+    return image_id
+
+
+@asyncio.coroutine
+def _upload(bot, image_link):
+    try:
+        image_id = yield from bot.call_shared('image_validate_and_upload_single', image_link)
+    except KeyError:
+        logger.warning('image plugin not loaded - using legacy code')
+        if re.match(r'^https?://gfycat.com', image_link):
+            image_link = re.sub(r'^https?://gfycat.com/', 'https://thumbs.gfycat.com/', image_link) + '-size_restricted.gif'
+        elif "imgur.com" in image_link:
+            image_link = image_link.replace(".gifv",".gif")
+            image_link = image_link.replace(".webm",".gif")
+        filename = os.path.basename(image_link)
+        r = yield from bot.call_shared("http.session").get(image_link)
+        raw = yield from bot.call_shared("http.read", r)
+        image_data = io.BytesIO(raw)
+        logger.debug("uploading: {}".format(filename))
+        image_id = yield from bot._client.upload_image(image_data, filename=filename)
+    return image_id
+
+
 def _load_all_the_things():
     plugin_dir = os.path.dirname(os.path.realpath(__file__))
     source_file = os.path.join(plugin_dir, "sauce.txt")
@@ -74,9 +104,12 @@ def _load_all_the_things():
             triggers = [x.strip() for x in triggers.split(',')]
             images = [re.search('\((.*?)\)$', x).group(1) for x in images.split(' ')]
             for trigger in triggers:
-                if trigger in _lookup:
+                if not re.fullmatch(r'\w+', trigger):
+                    logger.warning("ignoring trigger {}: not a single word".format(trigger))
+                elif trigger in _lookup:
                     _lookup[trigger].extend(images)
                 else:
+                    _order[trigger] = len(_order)
                     _lookup[trigger] = images
     logger.info("{} trigger(s) loaded".format(len(_lookup)))
 
@@ -38,7 +38,7 @@ def _watch_image_link(bot, event, command):
 * FOR FUTURE-PROOFING, INCLUDE [image] PLUGIN IN YOUR CONFIG.JSON
 """
 
-import aiohttp, io, os, re
+import io, os, re
 
 def image_validate_link(image_uri, reject_googleusercontent=True):
     """
@@ -90,8 +90,8 @@ def image_validate_link(image_uri, reject_googleusercontent=True):
 def image_upload_single(image_uri, bot):
     logger.info("getting {}".format(image_uri))
     filename = os.path.basename(image_uri)
-    r = yield from aiohttp.request('get', image_uri)
-    raw = yield from r.read()
+    r = yield from bot.call_shared("http.session").get(image_uri)
+    raw = yield from bot.call_shared("http.read", r)
     image_data = io.BytesIO(raw)
     image_id = yield from bot._client.upload_image(image_data, filename=filename)
     return image_id
@@ -1,16 +1,178 @@
-import asyncio, logging, re, string
+import asyncio, collections, logging, re, string, time
 
 from pushbullet import PushBullet
 
 import plugins
 
+from handlers import ExpiringRegistry
 from utils import remove_accents
 
 
 logger = logging.getLogger(__name__)
 
 
-nicks = {}
+_MentionForms = collections.namedtuple("_MentionForms", [
+    "full_name", "nickname", "nickname_lower",
+    "joined_lower",         # lowercase name, spaces removed + "\0" + spaces as underscores
+    "joined_upper",         # as joined_lower, uppercase without accents
+    "fragments",            # words of the full name
+    "normalised_fragments" ]) # uppercase words of the full name, without accents
+
+
+class MentionIndex:
+    """mention-resolution index, built from permamem users and memory nicknames
+    * nicknames are read from memory once, then kept current by set_nickname() -
+      setnickname is the only command that changes them
+    * remembered 1-to-1s and optouts are read from memory per resolved user
+    * name forms of a user are computed once, and rebuilt only when the full
+      name or nickname of that user changes
+    * every gram_size-character slice of the name forms points back to the
+      users containing it, so match() tests only the users sharing all slices
+      of the mention instead of scanning every name
+    """
+
+    gram_size = 2
+
+    def __init__(self):
+        self._forms = {}
+        self._grams = {}
+        self._nicknames = None
+        self._by_nickname = {}
+
+    def _load_nicknames(self, bot):
+        if self._nicknames is not None:
+            return
+        self._nicknames = {}
+        if bot.memory.exists(["user_data"]):
+            for chat_id, user_data in bot.memory["user_data"].items():
+                if isinstance(user_data, dict) and user_data.get("nickname"):
+                    self._add_nickname(chat_id, user_data["nickname"])
+
+    def _add_nickname(self, chat_id, nickname):
+        self._nicknames[chat_id] = nickname
+        self._by_nickname.setdefault(nickname.lower(), set()).add(chat_id)
+
+    def set_nickname(self, bot, chat_id, nickname):
+        """record a nickname change made via memory, an empty nickname removes it"""
+        self._load_nicknames(bot)
+
+        previous = self._nicknames.pop(chat_id, None)
+        if previous:
+            owners = self._by_nickname.get(previous.lower(), set())
+            owners.discard(chat_id)
+            if not owners:
+                self._by_nickname.pop(previous.lower(), None)
+        if nickname:
+            self._add_nickname(chat_id, nickname)
+
+    def _slices(self, text):
+        return { text[position:position + self.gram_size]
+                 for position in range(len(text) - self.gram_size + 1) }
+
+    def _index_forms(self, chat_id, forms, operation):
+        for gram in self._slices(forms.joined_lower) | self._slices(forms.joined_upper):
+            if operation == "add":
+                self._grams.setdefault(gram, set()).add(chat_id)
+            else:
+                chat_ids = self._grams.get(gram, set())
+                chat_ids.discard(chat_id)
+                if not chat_ids:
+                    self._grams.pop(gram, None)
+
+    def forms(self, user):
+        chat_id = user.id_.chat_id
+        full_name = user.full_name or ""
+        nickname = self._nicknames.get(chat_id, "") if self._nicknames else ""
+
+        forms = self._forms.get(chat_id)
+        if forms is None or forms.full_name != full_name or forms.nickname != nickname:
+            if forms is not None:
+                self._index_forms(chat_id, forms, "remove")
+
+            normalised_upper = remove_accents(full_name.upper())
+            # "\0" never appears in a mention: one substring test covers both variants
+            forms = _MentionForms(
+                full_name, nickname, nickname.lower(),
+                full_name.replace(" ", "").lower() + "\0" + full_name.replace(" ", "_").lower(),
+                normalised_upper.replace(" ", "") + "\0" + normalised_upper.replace(" ", "_"),
+                frozenset(full_name.split(" ")),
+                frozenset(normalised_upper.split(" ")) )
+            self._forms[chat_id] = forms
+            self._index_forms(chat_id, forms, "add")
+
+        return forms
+
+    def nickname(self, bot, chat_id):
+        self._load_nicknames(bot)
+        return self._nicknames.get(chat_id, "")
+
+    def nickname_owners(self, bot, nickname):
+        """set of chat_ids using nickname, case-insensitive"""
+        self._load_nicknames(bot)
+        return self._by_nickname.get(nickname.lower(), set())
+
+    def one_to_ones(self, bot, chat_ids, initiator_conv_id):
+        """chat_id -> remembered 1-to-1 conversation id for every chat_id,
+        False if the user opted out (see bot.get_1to1), None if not known yet"""
+        resolved = {}
+        for chat_id in chat_ids:
+            user_data = bot.memory["user_data"].get(chat_id) if bot.memory.exists(["user_data"]) else None
+            if not isinstance(user_data, dict):
+                resolved[chat_id] = None
+                continue
+            optout = user_data.get("optout")
+            if optout is True or (isinstance(optout, list) and initiator_conv_id in optout):
+                resolved[chat_id] = False
+            else:
+                resolved[chat_id] = user_data.get("1on1")
+        return resolved
+
+    def _candidates(self, username_lower, username_upper):
+        """chat_ids whose name forms contain every slice of the mention, None if it is too short"""
+        if len(username_lower) < self.gram_size or len(username_upper) < self.gram_size:
+            return None
+
+        candidates = set(self._by_nickname.get(username_lower, ()))
+        for slices in ( self._slices(username_lower), self._slices(username_upper) ):
+            postings = sorted(( self._grams.get(gram, set()) for gram in slices ), key=len)
+            if postings and postings[0]:
+                candidates.update(postings[0].intersection(*postings[1:]))
+        return candidates
+
+    def match(self, bot, users, username):
+        """list of (user, exact nickname match, exact fragment match) for every
+        user matching username, in the order supplied"""
+        self._load_nicknames(bot)
+
+        username_lower = username.lower()
+        username_upper = username.upper()
+        match_all = username_lower == "all"
+
+        for user in users:
+            self.forms(user)
+        candidates = None if match_all else self._candidates(username_lower, username_upper)
+
+        matches = []
+        for user in users:
+            if candidates is not None and user.id_.chat_id not in candidates:
+                continue
+
+            forms = self._forms[user.id_.chat_id]
+
+            exact_nickname = username_lower == forms.nickname_lower
+            exact_fragment = username in forms.fragments or username_upper in forms.normalised_fragments
+
+            if (match_all or exact_nickname or exact_fragment or
+                    username_lower in forms.joined_lower or
+                    username_upper in forms.joined_upper):
+                matches.append((user, exact_nickname, exact_fragment))
+
+        return matches
+
+index = MentionIndex()
+
+# 1-to-1 conversation id -> earliest time the next alert may be sent
+_next_alert = ExpiringRegistry("mention alert slots", ttl=300, max_size=10000)
 
 
 def _initialise(bot):
@@ -145,7 +307,6 @@ def mention(bot, event, *args):
     conversation_name = bot.conversations.get_name(event.conv)
     logger.info("@mention '{}' in '{}' ({})".format(username, conversation_name, event.conv.id_))
     username_lower = username.lower()
-    username_upper = username.upper()
 
     """is @all available globally/per-conversation/initiator?"""
     if username_lower == "all":
@@ -184,69 +345,48 @@ def mention(bot, event, *args):
     exact_nickname_matches = []
     exact_fragment_matches = []
     mention_list = []
-    for u in users_in_chat:
-
-        # mentions also checks nicknames if one is configured
-        #  exact matches only! see following IF block
-        nickname = ""
-        nickname_lower = ""
-        if bot.memory.exists(['user_data', u.id_.chat_id, "nickname"]):
-            nickname = bot.memory.get_by_path(['user_data', u.id_.chat_id, "nickname"])
-            nickname_lower = nickname.lower()
-
-        _normalised_full_name_upper = remove_accents(u.full_name.upper())
+    listed_chat_ids = set()
+    for u, exact_nickname, exact_fragment in index.match(bot, users_in_chat, username):
 
-        if (username_lower == "all" or
+        logger.info("user {} ({}) is present".format(u.full_name, u.id_.chat_id))
 
-                username_lower in u.full_name.replace(" ", "").lower() or
-                    username_upper in _normalised_full_name_upper.replace(" ", "") or
+        if u.is_self:
+            """bot cannot be @mentioned"""
+            logger.debug("suppressing bot mention by {} ({})".format(event.user.full_name, event.user.id_.chat_id))
+            continue
 
-                username_lower in u.full_name.replace(" ", "_").lower() or
-                    username_upper in _normalised_full_name_upper.replace(" ", "_") or
+        if u.id_.chat_id == event.user.id_.chat_id and username_lower == "all":
+            """prevent initiating user from receiving duplicate @all"""
+            logger.debug("suppressing @all for {} ({})".format(event.user.full_name, event.user.id_.chat_id))
+            continue
 
-                username_lower == nickname_lower or
-                username in u.full_name.split(" ")):
+        if u.id_.chat_id == event.user.id_.chat_id and not noisy_mention_test:
+            """prevent initiating user from mentioning themselves"""
+            logger.debug("suppressing @self for {} ({})".format(event.user.full_name, event.user.id_.chat_id))
+            continue
 
-            logger.info("user {} ({}) is present".format(u.full_name, u.id_.chat_id))
+        if u.id_.chat_id in mention_chat_ids:
+            """prevent most duplicate mentions (in the case of syncouts)"""
+            logger.debug("suppressing duplicate mention for {} ({})".format(event.user.full_name, event.user.id_.chat_id))
+            continue
 
-            if u.is_self:
-                """bot cannot be @mentioned"""
-                logger.debug("suppressing bot mention by {} ({})".format(event.user.full_name, event.user.id_.chat_id))
-                continue
-
-            if u.id_.chat_id == event.user.id_.chat_id and username_lower == "all":
-                """prevent initiating user from receiving duplicate @all"""
-                logger.debug("suppressing @all for {} ({})".format(event.user.full_name, event.user.id_.chat_id))
-                continue
-
-            if u.id_.chat_id == event.user.id_.chat_id and not noisy_mention_test:
-                """prevent initiating user from mentioning themselves"""
-                logger.debug("suppressing @self for {} ({})".format(event.user.full_name, event.user.id_.chat_id))
-                continue
-
-            if u.id_.chat_id in mention_chat_ids:
-                """prevent most duplicate mentions (in the case of syncouts)"""
-                logger.debug("suppressing duplicate mention for {} ({})".format(event.user.full_name, event.user.id_.chat_id))
+        if bot.memory.exists(["donotdisturb"]):
+            if _user_has_dnd(bot, u.id_.chat_id):
+                logger.info("suppressing @mention for {} ({})".format(u.full_name, u.id_.chat_id))
+                user_tracking["ignored"].append(u.full_name)
                 continue
 
-            if bot.memory.exists(["donotdisturb"]):
-                if _user_has_dnd(bot, u.id_.chat_id):
-                    logger.info("suppressing @mention for {} ({})".format(u.full_name, u.id_.chat_id))
-                    user_tracking["ignored"].append(u.full_name)
-                    continue
-
-            if username_lower == nickname_lower:
-                if u not in exact_nickname_matches:
-                    exact_nickname_matches.append(u)
-
-            if (username in u.full_name.split(" ") or
-                    username_upper in _normalised_full_name_upper.split(" ")):
+        if exact_nickname:
+            if u not in exact_nickname_matches:
+                exact_nickname_matches.append(u)
 
-                if u not in exact_fragment_matches:
-                    exact_fragment_matches.append(u)
+        if exact_fragment:
+            if u not in exact_fragment_matches:
+                exact_fragment_matches.append(u)
 
-            if u not in mention_list:
-                mention_list.append(u)
+        if u.id_.chat_id not in listed_chat_ids:
+            listed_chat_ids.add(u.id_.chat_id)
+            mention_list.append(u)
 
     if len(exact_nickname_matches) == 1:
         """prioritise exact nickname matches"""
@@ -274,8 +414,9 @@ def mention(bot, event, *args):
 
                 for u in mention_list:
                     text_html += u.full_name
-                    if bot.memory.exists(['user_data', u.id_.chat_id, "nickname"]):
-                        text_html += ' (' + bot.memory.get_by_path(['user_data', u.id_.chat_id, "nickname"]) + ')'
+                    nickname = index.nickname(bot, u.id_.chat_id)
+                    if nickname:
+                        text_html += ' (' + nickname + ')'
                     text_html += '<br />'
 
                 text_html += "<br /><em>To toggle this message on/off, use <b>/bot bemorespecific</b></em>"
@@ -292,64 +433,17 @@ def mention(bot, event, *args):
         source_name = event._external_source
 
     """send @mention alerts"""
-    for u in mention_list:
-            alert_via_1on1 = True
-
-            """pushbullet integration"""
-            if bot.memory.exists(['user_data', u.id_.chat_id, "pushbullet"]):
-                pushbullet_config = bot.memory.get_by_path(['user_data', u.id_.chat_id, "pushbullet"])
-                if pushbullet_config is not None:
-                    if pushbullet_config["api"] is not None:
-                        success = False
-                        try:
-                            pb = PushBullet(pushbullet_config["api"])
-                            push = pb.push_link(
-                                title = _("{} mentioned you in {}").format(source_name, conversation_name),
-                                    body=event.text,
-                                    url='https://hangouts.google.com/chat/{}'.format(event.conv.id_) )
-                            if isinstance(push, tuple):
-                                # backward-compatibility for pushbullet library < 0.8.0
-                                success = push[0]
-                            elif isinstance(push, dict):
-                                success = True
-                            else:
-                                raise TypeError("unknown return from pushbullet library: {}".format(push))
-                        except Exception as e:
-                            logger.exception("pushbullet error")
-
-                        if success:
-                            user_tracking["mentioned"].append(u.full_name)
-                            logger.info("{} ({}) alerted via pushbullet".format(u.full_name, u.id_.chat_id))
-                            alert_via_1on1 = False # disable 1on1 alert
-                        else:
-                            user_tracking["failed"]["pushbullet"].append(u.full_name)
-                            logger.warning("pushbullet alert failed for {} ({})".format(u.full_name, u.id_.chat_id))
-
-            if alert_via_1on1:
-                """send alert with 1on1 conversation"""
-                conv_1on1 = yield from bot.get_1to1(u.id_.chat_id, context={ 'initiator_convid': event.conv_id })
-                if username_lower == "all":
-                    message_mentioned = _("<b>{}</b> @mentioned ALL in <i>{}</i>:<br />{}")
-                else:
-                    message_mentioned = _("<b>{}</b> @mentioned you in <i>{}</i>:<br />{}")
-                if conv_1on1:
-                    yield from bot.coro_send_message(
-                        conv_1on1,
-                        message_mentioned.format(
-                            source_name,
-                            conversation_name,
-                            event.text)) # prevent internal parser from removing <tags>
-                    mention_chat_ids.append(u.id_.chat_id)
-                    user_tracking["mentioned"].append(u.full_name)
-                    logger.info("{} ({}) alerted via 1on1 ({})".format(u.full_name, u.id_.chat_id, conv_1on1.id_))
-                else:
-                    user_tracking["failed"]["one2one"].append(u.full_name)
-                    if bot.get_config_suboption(event.conv_id, 'mentionerrors'):
-                        yield from bot.coro_send_message(
-                            event.conv,
-                            _("@mention didn't work for <b>{}</b>. User must say something to me first.").format(
-                                u.full_name))
-                    logger.warning("user {} ({}) could not be alerted via 1on1".format(u.full_name, u.id_.chat_id))
+    if username_lower == "all":
+        message_mentioned = _("<b>{}</b> @mentioned ALL in <i>{}</i>:<br />{}")
+    else:
+        message_mentioned = _("<b>{}</b> @mentioned you in <i>{}</i>:<br />{}")
+    message_mentioned = message_mentioned.format(
+        source_name,
+        conversation_name,
+        event.text) # prevent internal parser from removing <tags>
+
+    user_tracking = yield from _deliver_alerts(bot, event, mention_list, source_name, conversation_name,
+                                               message_mentioned, user_tracking)
 
     if noisy_mention_test:
         text_html = _("<b>@mentions:</b><br />")
@@ -369,6 +463,112 @@ def mention(bot, event, *args):
 
         yield from bot.coro_send_message(event.conv, text_html)
 
+def _option(bot, key, default):
+    value = bot.get_config_option("mentions." + key)
+    return default if value is None else value
+
+
+def _pushbullet_alert(api_key, title, body, url):
+    """blocking pushbullet push, returns True on success"""
+    pb = PushBullet(api_key)
+    push = pb.push_link(title=title, body=body, url=url)
+    if isinstance(push, tuple):
+        # backward-compatibility for pushbullet library < 0.8.0
+        return push[0]
+    elif isinstance(push, dict):
+        return True
+    else:
+        raise TypeError("unknown return from pushbullet library: {}".format(push))
+
+
+@asyncio.coroutine
+def _deliver_alerts(bot, event, mention_list, source_name, conversation_name, message_mentioned, user_tracking):
+    """alert every user in mention_list, concurrently
+
+    * all known 1-to-1s are resolved in one pass from the mention index,
+        unknown ones via bot.get_1to1()
+    * at most mentions.alert_concurrency alerts (default 10) are in flight
+    * a 1-to-1 receives at most one alert every mentions.alert_interval seconds (default 1),
+        later alerts to the same destination are delayed
+
+    returns user_tracking, updated with the outcome for every user"""
+
+    one_to_ones = index.one_to_ones(bot, [ u.id_.chat_id for u in mention_list ], event.conv_id)
+    semaphore = asyncio.Semaphore(_option(bot, "alert_concurrency", 10))
+
+    yield from asyncio.gather(*[ _alert(bot, event, u, one_to_ones[u.id_.chat_id], semaphore,
+                                        source_name, conversation_name, message_mentioned, user_tracking)
+                                 for u in mention_list ])
+
+    return user_tracking
+
+
+@asyncio.coroutine
+def _alert(bot, event, u, conv_id_1on1, semaphore, source_name, conversation_name, message_mentioned, user_tracking):
+    with (yield from semaphore):
+        alert_via_1on1 = True
+
+        """pushbullet integration"""
+        if bot.memory.exists(['user_data', u.id_.chat_id, "pushbullet"]):
+            pushbullet_config = bot.memory.get_by_path(['user_data', u.id_.chat_id, "pushbullet"])
+            if pushbullet_config is not None and pushbullet_config["api"] is not None:
+                success = False
+                try:
+                    success = yield from asyncio.get_event_loop().run_in_executor(
+                        None,
+                        _pushbullet_alert,
+                        pushbullet_config["api"],
+                        _("{} mentioned you in {}").format(source_name, conversation_name),
+                        event.text,
+                        'https://hangouts.google.com/chat/{}'.format(event.conv.id_))
+                except Exception as e:
+                    logger.exception("pushbullet error")
+
+                if success:
+                    user_tracking["mentioned"].append(u.full_name)
+                    logger.info("{} ({}) alerted via pushbullet".format(u.full_name, u.id_.chat_id))
+                    alert_via_1on1 = False # disable 1on1 alert
+                else:
+                    user_tracking["failed"]["pushbullet"].append(u.full_name)
+                    logger.warning("pushbullet alert failed for {} ({})".format(u.full_name, u.id_.chat_id))
+
+        if not alert_via_1on1:
+            return
+
+        """send alert with 1on1 conversation"""
+        if conv_id_1on1 is None:
+            conv_1on1 = yield from bot.get_1to1(u.id_.chat_id, context={ 'initiator_convid': event.conv_id })
+            conv_id_1on1 = conv_1on1.id_ if conv_1on1 else False
+
+        if not conv_id_1on1:
+            user_tracking["failed"]["one2one"].append(u.full_name)
+            if bot.get_config_suboption(event.conv_id, 'mentionerrors'):
+                yield from bot.coro_send_message(
+                    event.conv,
+                    _("@mention didn't work for <b>{}</b>. User must say something to me first.").format(
+                        u.full_name))
+            logger.warning("user {} ({}) could not be alerted via 1on1".format(u.full_name, u.id_.chat_id))
+            return
+
+    """per-destination rate limit: reserve the next slot, wait outside the pool"""
+    now = time.time()
+    slot = max(now, _next_alert.get(conv_id_1on1, now))
+    _next_alert[conv_id_1on1] = slot + _option(bot, "alert_interval", 1)
+    if slot > now:
+        yield from asyncio.sleep(slot - now)
+
+    with (yield from semaphore):
+        try:
+            yield from bot.coro_send_message(conv_id_1on1, message_mentioned)
+        except Exception as e:
+            user_tracking["failed"]["one2one"].append(u.full_name)
+            logger.exception("user {} ({}) could not be alerted via 1on1 ({})".format(u.full_name, u.id_.chat_id, conv_id_1on1))
+            return
+
+    user_tracking["mentioned"].append(u.full_name)
+    logger.info("{} ({}) alerted via 1on1 ({})".format(u.full_name, u.id_.chat_id, conv_id_1on1))
+
+
 def pushbulletapi(bot, event, *args):
     """allow users to configure pushbullet integration with api key
         /bot pushbulletapi [<api key>|false, 0, -1]"""
@@ -459,31 +659,21 @@ def setnickname(bot, event, *args):
             nickname = pattern.sub(substitution[original], nickname)
 
     # Prevent duplicate nicknames
-    # First, populate list of nicks if not already
-    if not nicks:
-        for userchatid in bot.memory.get_option("user_data"):
-            usernick = bot.memory.get_suboption("user_data", userchatid, "nickname")
-            if usernick:
-                nicks[userchatid] = usernick.lower()
-
     # is the user trying to re-set his own nickname? - don't do anything if that is the case
-    if event.user.id_.chat_id in nicks:
-        if nickname.lower() == nicks[event.user.id_.chat_id].lower():
-            actual_nickname = bot.memory.get_suboption("user_data", event.user.id_.chat_id, "nickname")
-            yield from bot.coro_send_message(event.conv, _('<i>Your nickname is already <b>`{}`</b></i>').format(actual_nickname))
-            return
+    actual_nickname = index.nickname(bot, event.user.id_.chat_id)
+    if actual_nickname and nickname.lower() == actual_nickname.lower():
+        yield from bot.coro_send_message(event.conv, _('<i>Your nickname is already <b>`{}`</b></i>').format(actual_nickname))
+        return
 
     # check whether another user has the same nickname
-    if nickname.lower() in nicks.values():
+    if nickname and index.nickname_owners(bot, nickname):
         yield from bot.coro_send_message(event.conv, _('<i>Nickname <b>`{}`</b> is already in use by another user').format(nickname))
         return
 
     bot.initialise_memory(event.user.id_.chat_id, "user_data")
 
     bot.memory.set_by_path(["user_data", event.user.id_.chat_id, "nickname"], nickname)
-
-    # Update nicks cache with new nickname
-    nicks[event.user.id_.chat_id] = nickname.lower()
+    index.set_nickname(bot, event.user.id_.chat_id, nickname)
 
     try:
         label = '{0} ({1})'.format(event.user.full_name.split(' ', 1)[0], nickname)
@@ -57,7 +57,7 @@ from .commands_hangouts import ( slacks,
                                  slack_showslackrealnames,
                                  slack_showhorealnames,
                                  slack_identify )
-from .core import SlackRTMThread
+from .core import SlackRTMListener
 from .utils import _slackrtms
 
 
@@ -69,19 +69,15 @@ def _initialise(bot):
     #   previously, this plugin wrote into "user_data" key to store its internal team settings
     _slackrtm_conversations_migrate_20170319(bot)
 
-    # Start and asyncio event loop
-    loop = asyncio.get_event_loop()
     slack_sink = bot.get_config_option('slackrtm')
-    threads = []
+    listeners = []
     if isinstance(slack_sink, list):
         for sinkConfig in slack_sink:
-            # start up slack listener in a separate thread
-            t = SlackRTMThread(bot, loop, sinkConfig)
-            t.daemon = True
-            t.start()
-            t.isFullyLoaded.wait()
-            threads.append(t)
-    logger.info("%d sink thread(s) started", len(threads))
+            # slack listeners read their websocket on the bot's event loop
+            listener = SlackRTMListener(bot, sinkConfig)
+            plugins.start_asyncio_task(listener.run)
+            listeners.append(listener)
+    logger.info("%d sink listener(s) started", len(listeners))
 
     plugins.register_handler(_handle_membership_change, type="membership")
     plugins.register_handler(_handle_rename, type="rename")
@@ -132,7 +128,7 @@ def _plugin_unloaded(future):
 def _handle_membership_change(bot, event, command):
     for slackrtm in _slackrtms:
         try:
-            slackrtm.handle_ho_membership(event)
+            yield from slackrtm.handle_ho_membership(event)
         except Exception as e:
             logger.exception('_handle_membership_change threw: %s', str(e))
 
@@ -143,6 +139,6 @@ def _handle_rename(bot, event, command):
         return
     for slackrtm in _slackrtms:
         try:
-            slackrtm.handle_ho_rename(event)
+            yield from slackrtm.handle_ho_rename(event)
         except Exception as e:
             logger.exception('_handle_rename threw: %s', str(e))
@@ -6,7 +6,8 @@ from webbridge import ( WebFramework,
                         FakeEvent )
 
 from .utils import ( _slackrtms,
-                     _slackrtm_conversations_get )
+                     _slackrtm_conversations_get,
+                     _slackrtm_conversations_generation )
 
 
 logger = logging.getLogger(__name__)
@@ -23,6 +24,10 @@ class BridgeInstance(WebFramework):
         self.hangouts_id = hangouts_id
         self.channel_id = channel_id
 
+    def routing_generation(self):
+        # synced conversations are stored in memory, only replaced via _slackrtm_conversations_set()
+        return (self.bot.config.generation, _slackrtm_conversations_generation())
+
     def applicable_configuration(self, conv_id):
         """because of the object hierachy of original slackrtm, each bridgeinstance cannot maintain
             knowledge of the entire configuration, only return a single applicable configuration"""
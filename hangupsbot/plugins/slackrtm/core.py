@@ -1,21 +1,25 @@
 import asyncio
+import functools
 import json
 import html
+import io
 import logging
 import mimetypes
 import os
 import pprint
 import re
-import threading
 import time
-import urllib.request
+
+from collections import deque
+
 import hangups
 import emoji
 
 import hangups_shim as hangups
 
+import aiohttp
+
 from slackclient import SlackClient
-from websocket import WebSocketConnectionClosedException
 
 from .bridgeinstance import ( BridgeInstance,
                               FakeEvent )
@@ -40,6 +44,41 @@ emoji.EMOJI_UNICODE[':simple_smile:'] = emoji.EMOJI_UNICODE[':smiling_face:']
 emoji.EMOJI_ALIAS_UNICODE[':simple_smile:'] = emoji.EMOJI_UNICODE[':smiling_face:']
 
 
+# hidden hangouts relay tag, see SlackRTM.handle_ho_message
+_HO_ID = re.compile(r'^(.*) <ho://([^/]+)/([^|]+)\| >$', re.MULTILINE | re.DOTALL)
+_GOOGLEUSERCONTENT = re.compile(r'^(.*)<(https?://[^\s/]*googleusercontent.com/[^\s]*)>$', re.MULTILINE | re.DOTALL)
+_SKIN_TONE = re.compile(r"::skin-tone-\d:", re.IGNORECASE)
+
+# slack references: <@U123>, <#C123|name>, <http://link|label>
+_REFERENCE = re.compile(r'<((.)([^|>]*))((\|)([^>]*)|([^>]*))>')
+
+
+def _referenced_ids(reply):
+    """(user ids, channel ids) a reply refers to: sender, channel and <@user>/<#channel> references"""
+    users = set()
+    channels = set()
+
+    message = reply.get('message') or {}
+    comment = reply.get('comment') or {}
+    for user in ( reply.get('user'), (message.get('edited') or {}).get('user'), comment.get('user') ):
+        if user:
+            users.add(user)
+    for channel in ( reply.get('channel'), reply.get('group') ):
+        if isinstance(channel, str):
+            channels.add(channel)
+
+    for text in ( reply.get('text'), message.get('text'), comment.get('comment') ):
+        if not text:
+            continue
+        for match in _REFERENCE.finditer(text):
+            if match.group(2) == '@':
+                users.add(match.group(3))
+            elif match.group(2) == '#':
+                channels.add(match.group(3))
+
+    return users, channels
+
+
 class SlackMessage(object):
     def __init__(self, slackrtm, reply):
         self.text = None
@@ -129,15 +168,13 @@ class SlackMessage(object):
                 file_attachment = reply['file']['url_private_download']
 
         # now we check if the message has the hidden ho relay tag, extract and remove it
-        hoidfmt = re.compile(r'^(.*) <ho://([^/]+)/([^|]+)\| >$', re.MULTILINE | re.DOTALL)
-        match = hoidfmt.match(text)
+        match = _HO_ID.match(text)
         if match:
             text = match.group(1)
             from_ho_id = match.group(2)
             sender_id = match.group(3)
             if 'googleusercontent.com' in text:
-                gucfmt = re.compile(r'^(.*)<(https?://[^\s/]*googleusercontent.com/[^\s]*)>$', re.MULTILINE | re.DOTALL)
-                match = gucfmt.match(text)
+                match = _GOOGLEUSERCONTENT.match(text)
                 if match:
                     text = match.group(1)
                     file_attachment = match.group(2)
@@ -150,7 +187,7 @@ class SlackMessage(object):
         * depends on the slack users emoji style, e.g. hangouts style has no skin tone support
         * do it BEFORE emojize() for more reliable detection of sub-pattern :some_emoji(::skin-tone-\d:)
         """
-        text = re.sub(r"::skin-tone-\d:", ":", text, flags=re.IGNORECASE)
+        text = _SKIN_TONE.sub(":", text)
 
         # convert emoji aliases into their unicode counterparts
         text = emoji.emojize(text, use_aliases=True)
@@ -266,40 +303,47 @@ class SlackRTMSync(object):
 
 
 class SlackRTM(object):
-    def __init__(self, sink_config, bot, loop, threaded=False):
+    # unknown users/channels/groups reload the full list at most every label_refresh_interval seconds
+    label_refresh_interval = 60
+
+    # chat.postMessage, opt-in via "post_batch_max" in the slackrtm sink config (default 1: off):
+    #   consecutive queued messages to a channel with identical parameters and no attachments
+    #   are sent as one message, up to post_batch_max messages or post_batch_chars characters
+    post_batch_max = 1
+    post_batch_chars = 3000
+
+    # memoized reference translations, flushed when user/channel/group lists reload
+    references_max = 10000
+
+    def __init__(self, sink_config, bot, loop, login_data):
+        """login_data: rtm.start response, see SlackRTMListener"""
+
         self.bot = bot
         self.loop = loop
         self.config = sink_config
         self.apikey = self.config['key']
-        self.threadname = None
         self.lastimg = ''
+        self.post_batch_max = self.config.get('post_batch_max', self.post_batch_max)
 
+        self._reloaded = {} # users/channels/groups -> time of the last full reload
+        self._references = {} # slack reference markup -> translated text
+        self._post_queues = {} # channelid -> deque of (parameters, text, future)
+
+        # web api only, the rtm websocket is read by SlackRTMListener
         self.slack = SlackClient(self.apikey)
-        if not self.slack.rtm_connect():
-            raise ConnectionFailedError
-        for key in ['self', 'team', 'users', 'channels', 'groups']:
-            if key not in self.slack.server.login_data:
-                raise IncompleteLoginError
-        if threaded:
-            if 'name' in self.config:
-                self.name = self.config['name']
-            else:
-                self.name = '%s@%s' % (self.slack.server.login_data['self']['name'], self.slack.server.login_data['team']['domain'])
-                logger.warning('no name set in config file, using computed name %s', self.name)
-            self.threadname = 'SlackRTM:' + self.name
-            threading.current_thread().name = self.threadname
-            logger.info('started RTM connection for SlackRTM thread %s', pprint.pformat(threading.current_thread()))
-            for t in threading.enumerate():
-                if t.name == self.threadname and t != threading.current_thread():
-                    logger.info('old thread found: %s - killing it', pprint.pformat(t))
-                    t.stop()
-
-        self.update_userinfos(self.slack.server.login_data['users'])
-        self.update_channelinfos(self.slack.server.login_data['channels'])
-        self.update_groupinfos(self.slack.server.login_data['groups'])
-        self.update_teaminfos(self.slack.server.login_data['team'])
+
+        if 'name' in self.config:
+            self.name = self.config['name']
+        else:
+            self.name = '%s@%s' % (login_data['self']['name'], login_data['team']['domain'])
+            logger.warning('no name set in config file, using computed name %s', self.name)
+
+        self.update_userinfos(login_data['users'])
+        self.update_channelinfos(login_data['channels'])
+        self.update_groupinfos(login_data['groups'])
+        self.update_teaminfos(login_data['team'])
         self.dminfos = {}
-        self.my_uid = self.slack.server.login_data['self']['id']
+        self.my_uid = login_data['self']['id']
 
         self.admins = []
         if 'admins' in self.config:
@@ -345,6 +389,8 @@ class SlackRTM(object):
                 _new_sync.team_name = self.name # chatbridge needs this for context
                 self.syncs.append(_new_sync)
 
+        self._index_syncs()
+
     # As of https://github.com/slackhq/python-slackclient/commit/ac343caf6a3fd8f4b16a79246264a05a7d257760
     # SlackClient.api_call returns a pre-parsed json object (a dict).
     # Wrap this call in a compatibility duck-hunt.
@@ -359,34 +405,141 @@ class SlackRTM(object):
 
         return response
 
+    @asyncio.coroutine
+    def api_call_async(self, *args, **kwargs):
+        """api_call() in an executor, SlackClient is blocking"""
+        return (yield from self.loop.run_in_executor(None, functools.partial(self.api_call, *args, **kwargs)))
+
+    @asyncio.coroutine
+    def post_message(self, channel, text, **kwargs):
+        """queue a chat.postMessage for channel, messages to a channel keep their order
+
+        messages queued while a previous post is in flight may be batched, see post_batch_max"""
+
+        future = asyncio.Future()
+        if channel in self._post_queues:
+            self._post_queues[channel].append((kwargs, text, future))
+        else:
+            self._post_queues[channel] = deque([(kwargs, text, future)])
+            asyncio.ensure_future(self._drain_posts(channel))
+        return (yield from future)
+
+    @asyncio.coroutine
+    def _drain_posts(self, channel):
+        queue = self._post_queues[channel]
+        try:
+            while queue:
+                parameters, text, future = queue.popleft()
+                batch = [ future ]
+                texts = [ text ]
+                size = len(text)
+                while( queue and len(batch) < self.post_batch_max
+                        and "attachments" not in parameters
+                        and queue[0][0] == parameters
+                        and size + len(queue[0][1]) < self.post_batch_chars ):
+                    _parameters, text, future = queue.popleft()
+                    batch.append(future)
+                    texts.append(text)
+                    size += len(text)
+
+                if len(batch) > 1:
+                    logger.debug("batching {} messages to {}".format(len(batch), channel))
+
+                try:
+                    response = yield from self.api_call_async('chat.postMessage',
+                                                              channel = channel,
+                                                              text = "\n".join(texts),
+                                                              **parameters)
+                except Exception as e:
+                    for future in batch:
+                        if not future.done():
+                            future.set_exception(e)
+                else:
+                    for future in batch:
+                        if not future.done():
+                            future.set_result(response)
+
+        finally:
+            del self._post_queues[channel]
+            for parameters, text, future in queue:
+                if not future.done():
+                    future.cancel()
+
+    def _reload_due(self, kind):
+        now = time.time()
+        if now - self._reloaded.get(kind, 0) < self.label_refresh_interval:
+            return False
+        self._reloaded[kind] = now
+        return True
+
+    @asyncio.coroutine
     def get_slackDM(self, userid):
         if not userid in self.dminfos:
-            self.dminfos[userid] = self.api_call('im.open', user = userid)['channel']
+            response = yield from self.api_call_async('im.open', user = userid)
+            self.dminfos[userid] = response['channel']
         return self.dminfos[userid]['id']
 
-    def update_userinfos(self, users=None):
-        if users is None:
-            response = self.api_call('users.list')
-            users = response['members']
+    @asyncio.coroutine
+    def reload_infos(self, kind):
+        """reload the full users/channels/groups list, the web api call runs in an executor"""
+        method, key = { "users": ("users.list", "members"),
+                        "channels": ("channels.list", "channels"),
+                        "groups": ("groups.list", "groups") }[kind]
+        response = yield from self.api_call_async(method)
+        getattr(self, "update_{}infos".format(kind[:-1]))(response[key])
+
+    def _reload_later(self, kind):
+        """lookups stay cache-only on the event loop: reload a list in the background, if due"""
+        if not self._reload_due(kind):
+            return
+        logger.debug('%s not found, reloading %s', kind[:-1], kind)
+        task = asyncio.ensure_future(self.reload_infos(kind), loop=self.loop)
+        task.add_done_callback(self._reload_done)
+
+    def _reload_done(self, task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.error('reloading failed: %s', repr(task.exception()))
+
+    @asyncio.coroutine
+    def resolve_unknown(self, users=(), channels=()):
+        """reload (at most every label_refresh_interval seconds) the lists missing any of the ids,
+        so that the cache-only lookups for them succeed"""
+        missing = []
+        if any(user not in self.userinfos for user in users):
+            missing.append('users')
+        if any(channel.startswith('C') and channel not in self.channelinfos for channel in channels):
+            missing.append('channels')
+        if any(channel.startswith('G') and channel not in self.groupinfos for channel in channels):
+            missing.append('groups')
+
+        for kind in missing:
+            if not self._reload_due(kind):
+                continue
+            try:
+                yield from self.reload_infos(kind)
+            except Exception as e:
+                # the lookups fall back to their defaults
+                logger.error('reloading %s failed: %s', kind, repr(e))
+
+    def update_userinfos(self, users):
         userinfos = {}
         for u in users:
             userinfos[u['id']] = u
         self.userinfos = userinfos
+        self._references = {}
 
     def get_channel_users(self, channelid, default=None):
         channelinfo = None
         if channelid.startswith('C'):
             if not channelid in self.channelinfos:
-                self.update_channelinfos()
-            if not channelid in self.channelinfos:
+                self._reload_later('channels')
                 logger.error('get_channel_users: Failed to find channel %s' % channelid)
                 return None
             else:
                 channelinfo = self.channelinfos[channelid]
         else:
             if not channelid in self.groupinfos:
-                self.update_groupinfos()
-            if not channelid in self.groupinfos:
+                self._reload_later('groups')
                 logger.error('get_channel_users: Failed to find private group %s' % channelid)
                 return None
             else:
@@ -402,10 +555,7 @@ class SlackRTM(object):
 
         return users
 
-    def update_teaminfos(self, team=None):
-        if team is None:
-            response = self.api_call('team.info')
-            team = response['team']
+    def update_teaminfos(self, team):
         self.team = team
 
     def get_teamname(self):
@@ -418,11 +568,9 @@ class SlackRTM(object):
 
     def get_realname(self, user, default=None):
         if user not in self.userinfos:
-            logger.debug('user not found, reloading users')
-            self.update_userinfos()
-            if user not in self.userinfos:
-                logger.warning('could not find user "%s" although reloaded', user)
-                return default
+            self._reload_later('users')
+            logger.warning('could not find user "%s"', user)
+            return default
         if not self.userinfos[user]['real_name']:
             return default
         return self.userinfos[user]['real_name']
@@ -430,21 +578,17 @@ class SlackRTM(object):
 
     def get_username(self, user, default=None):
         if user not in self.userinfos:
-            logger.debug('user not found, reloading users')
-            self.update_userinfos()
-            if user not in self.userinfos:
-                logger.warning('could not find user "%s" although reloaded', user)
-                return default
+            self._reload_later('users')
+            logger.warning('could not find user "%s"', user)
+            return default
         return self.userinfos[user]['name']
 
-    def update_channelinfos(self, channels=None):
-        if channels is None:
-            response = self.api_call('channels.list')
-            channels = response['channels']
+    def update_channelinfos(self, channels):
         channelinfos = {}
         for c in channels:
             channelinfos[c['id']] = c
         self.channelinfos = channelinfos
+        self._references = {}
 
     def get_channelgroupname(self, channel, default=None):
         if channel.startswith('C'):
@@ -457,32 +601,41 @@ class SlackRTM(object):
 
     def get_channelname(self, channel, default=None):
         if channel not in self.channelinfos:
-            logger.debug('channel not found, reloading channels')
-            self.update_channelinfos()
-            if channel not in self.channelinfos:
-                logger.warning('could not find channel "%s" although reloaded', channel)
-                return default
+            self._reload_later('channels')
+            logger.warning('could not find channel "%s"', channel)
+            return default
         return self.channelinfos[channel]['name']
 
-    def update_groupinfos(self, groups=None):
-        if groups is None:
-            response = self.api_call('groups.list')
-            groups = response['groups']
+    def update_groupinfos(self, groups):
         groupinfos = {}
         for c in groups:
             groupinfos[c['id']] = c
         self.groupinfos = groupinfos
+        self._references = {}
 
     def get_groupname(self, group, default=None):
         if group not in self.groupinfos:
-            logger.debug('group not found, reloading groups')
-            self.update_groupinfos()
-            if group not in self.groupinfos:
-                logger.warning('could not find group "%s" although reloaded', group)
-                return default
+            self._reload_later('groups')
+            logger.warning('could not find group "%s"', group)
+            return default
         return self.groupinfos[group]['name']
 
+    def _index_syncs(self):
+        """rebuild the channelid/hangoutid -> syncs indices, call after self.syncs changed"""
+        by_channel = {}
+        by_hangout = {}
+        for sync in self.syncs:
+            by_channel.setdefault(sync.channelid, []).append(sync)
+            by_hangout.setdefault(sync.hangoutid, []).append(sync)
+        self._syncs_by_channel = { key: tuple(syncs) for key, syncs in by_channel.items() }
+        self._syncs_by_hangout = { key: tuple(syncs) for key, syncs in by_hangout.items() }
+
     def get_syncs(self, channelid=None, hangoutid=None):
+        if hangoutid is None:
+            return self._syncs_by_channel.get(channelid, ())
+        if channelid is None:
+            return self._syncs_by_hangout.get(hangoutid, ())
+
         syncs = []
         for sync in self.syncs:
             if channelid == sync.channelid:
@@ -491,11 +644,20 @@ class SlackRTM(object):
                 syncs.append(sync)
         return syncs
 
-    def rtm_read(self):
-        return self.slack.rtm_read()
+    def translate(self, text):
+        """translate slack message text (references and markdown) into hangouts markdown"""
+        return slack_markdown_to_hangups(_REFERENCE.sub(self._translate_reference, text))
 
-    def ping(self):
-        return self.slack.server.ping()
+    def _translate_reference(self, match):
+        reference = match.group(0)
+        try:
+            return self._references[reference]
+        except KeyError:
+            pass
+        if len(self._references) >= self.references_max:
+            self._references = {}
+        translated = self._references[reference] = self.matchReference(match)
+        return translated
 
     def matchReference(self, match):
         out = ""
@@ -528,10 +690,10 @@ class SlackRTM(object):
         token = self.apikey
         logger.info('downloading %s', image_uri)
         filename = os.path.basename(image_uri)
-        request = urllib.request.Request(image_uri)
-        request.add_header("Authorization", "Bearer %s" % token)
-        image_response = urllib.request.urlopen(request)
-        content_type = image_response.info().get_content_type()
+        image_response = yield from self.bot.call_shared("http.session").get(
+            image_uri, headers={ "Authorization": "Bearer %s" % token })
+        content_type = image_response.content_type
+        image_data = io.BytesIO((yield from self.bot.call_shared("http.read", image_response)))
 
         filename_extension = mimetypes.guess_extension(content_type).lower() # returns with "."
         physical_extension = "." + filename.rsplit(".", 1).pop().lower()
@@ -546,7 +708,7 @@ class SlackRTM(object):
             filename += filename_extension
 
         logger.info('uploading as %s', filename)
-        image_id = yield from self.bot._client.upload_image(image_response, filename=filename)
+        image_id = yield from self.bot._client.upload_image(image_data, filename=filename)
 
         logger.info('sending HO message, image_id: %s', image_id)
         yield from sync._bridgeinstance._send_to_internal_chat(
@@ -567,6 +729,7 @@ class SlackRTM(object):
         sync.team_name = self.name # chatbridge needs this for context
         logger.info('adding sync: %s', sync.toDict())
         self.syncs.append(sync)
+        self._index_syncs()
         syncs = _slackrtm_conversations_get(self.bot, self.name)
         if not syncs:
             syncs = []
@@ -583,6 +746,7 @@ class SlackRTM(object):
                 logger.info('removing running sync: %s', s)
                 s._bridgeinstance.close()
                 self.syncs.remove(s)
+        self._index_syncs()
         if not sync:
             raise NotSyncingError
 
@@ -728,9 +892,12 @@ class SlackRTM(object):
         _slackrtm_conversations_set(self.bot, self.name, syncs)
         return
 
+    @asyncio.coroutine
     def handle_reply(self, reply):
         """handle incoming replies from slack"""
 
+        yield from self.resolve_unknown(*_referenced_ids(reply))
+
         try:
             msg = SlackMessage(self, reply)
         except ParseError as e:
@@ -740,33 +907,31 @@ class SlackRTM(object):
             return
 
         # commands can be processed even from unsynced channels
-        try:
-            slackCommandHandler(self, msg)
-        except Exception as e:
-            logger.exception('error in handleCommands: %s(%s)', type(e), str(e))
+        if msg.user and msg.text.lstrip().lower().startswith(("@hobot", "<@" + self.my_uid.lower() + ">")):
+            asyncio.ensure_future(self._handle_command(msg))
 
         syncs = self.get_syncs(channelid=msg.channel)
         if not syncs:
             # stop processing replies if no syncs are available (optimisation)
             return
 
-        reffmt = re.compile(r'<((.)([^|>]*))((\|)([^>]*)|([^>]*))>')
-        message = reffmt.sub(self.matchReference, msg.text)
-        message = slack_markdown_to_hangups(message)
+        message = None # translated once, only if a sync relays it
 
         for sync in syncs:
             if not sync.sync_joins and msg.is_joinleave:
                 continue
 
             if msg.from_ho_id != sync.hangoutid:
+                if message is None:
+                    message = self.translate(msg.text)
+
                 username = msg.realname4ho if sync.showslackrealnames else msg.username4ho
                 channel_name = self.get_channelgroupname(msg.channel)
 
                 if msg.file_attachment:
                     if sync.image_upload:
 
-                        self.loop.call_soon_threadsafe(
-                            asyncio.ensure_future,
+                        asyncio.ensure_future(
                             self.upload_image(
                                 msg.file_attachment,
                                 sync,
@@ -779,8 +944,7 @@ class SlackRTM(object):
                         # we should not upload the images, so we have to send the url instead
                         response += msg.file_attachment
 
-                self.loop.call_soon_threadsafe(
-                    asyncio.ensure_future,
+                asyncio.ensure_future(
                     sync._bridgeinstance._send_to_internal_chat(
                         sync.hangoutid,
                         message,
@@ -790,14 +954,20 @@ class SlackRTM(object):
                             "source_gid": sync.channelid,
                             "source_title": channel_name }))
 
+    @asyncio.coroutine
+    def _handle_command(self, msg):
+        try:
+            yield from slackCommandHandler(self, msg)
+        except Exception as e:
+            logger.exception('error in handleCommands: %s(%s)', type(e), str(e))
+
     @asyncio.coroutine
     def _send_deferred_media(self, image_link, sync, full_name, link_names, photo_url, fragment):
-        self.api_call('chat.postMessage',
-                      channel = sync.channelid,
-                      text = "{} {}".format(image_link, fragment),
-                      username = full_name,
-                      link_names = True,
-                      icon_url = photo_url)
+        yield from self.post_message(sync.channelid,
+                                     "{} {}".format(image_link, fragment),
+                                     username = full_name,
+                                     link_names = True,
+                                     icon_url = photo_url)
 
     @asyncio.coroutine
     def handle_ho_message(self, event, conv_id, channel_id):
@@ -895,13 +1065,13 @@ class SlackRTM(object):
             message = "{} {}".format(message, slackrtm_fragment)
 
             logger.info("message {}: {}".format(sync.channelid, message))
-            self.api_call('chat.postMessage',
-                          channel = sync.channelid,
-                          text = message,
-                          username = display_name,
-                          link_names = True,
-                          icon_url = bridge_user["photo_url"])
+            yield from self.post_message(sync.channelid,
+                                         message,
+                                         username = display_name,
+                                         link_names = True,
+                                         icon_url = bridge_user["photo_url"])
 
+    @asyncio.coroutine
     def handle_ho_membership(self, event):
         # Generate list of added or removed users
         links = []
@@ -929,12 +1099,12 @@ class SlackRTM(object):
                 message = u'%s has left _%s_' % (names, honame)
             message = u'%s <ho://%s/%s| >' % (message, event.conv_id, event.user_id.chat_id)
             logger.debug("sending to channel/group %s: %s", sync.channelid, message)
-            self.api_call('chat.postMessage',
-                          channel=sync.channelid,
-                          text=message,
-                          as_user=True,
-                          link_names=True)
+            yield from self.post_message(sync.channelid,
+                                         message,
+                                         as_user=True,
+                                         link_names=True)
 
+    @asyncio.coroutine
     def handle_ho_rename(self, event):
         name = self.bot.conversations.get_name(event.conv, truncate=False)
 
@@ -946,11 +1116,10 @@ class SlackRTM(object):
             message = u'%s has renamed the Hangout%s to _%s_' % (invitee, hotagaddendum, name)
             message = u'%s <ho://%s/%s| >' % (message, event.conv_id, event.user_id.chat_id)
             logger.debug("sending to channel/group %s: %s", sync.channelid, message)
-            self.api_call('chat.postMessage',
-                          channel=sync.channelid,
-                          text=message,
-                          as_user=True,
-                          link_names=True)
+            yield from self.post_message(sync.channelid,
+                                         message,
+                                         as_user=True,
+                                         link_names=True)
 
     def close(self):
         logger.debug("closing all bridge instances")
@@ -958,80 +1127,109 @@ class SlackRTM(object):
             s._bridgeinstance.close()
 
 
-class SlackRTMThread(threading.Thread):
-    def __init__(self, bot, loop, config):
-        super(SlackRTMThread, self).__init__()
-        self._stop = threading.Event()
+class SlackRTMListener(object):
+    """reads the rtm websocket of one slack team on the bot's event loop
+
+    replies are queued and handled in order by a separate task, so the read loop never waits for
+    web api calls made while handling a reply
+
+    reconnects with exponential backoff, starting at reconnect_delay up to reconnect_delay_max seconds
+    """
+
+    reconnect_delay = 1
+    reconnect_delay_max = 300
+
+    def __init__(self, bot, config):
         self._bot = bot
-        self._loop = loop
         self._config = config
         self._listener = None
-        self.isFullyLoaded = threading.Event()
 
-    def run(self):
-        logger.debug('SlackRTMThread.run()')
-        asyncio.set_event_loop(self._loop)
+    @asyncio.coroutine
+    def run(self, bot=None):
+        delay = self.reconnect_delay
+        while True:
+            connected_at = time.time()
+            try:
+                yield from self._connect_and_read()
+                logger.warning('websocket closed, reconnecting')
+
+            except asyncio.CancelledError:
+                self.stop()
+                raise
+
+            except (ConnectionFailedError, IncompleteLoginError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.exception('connection failed: %s(%s)', type(e).__name__, str(e))
+
+            except Exception as e:
+                logger.exception('SlackRTMListener: unhandled exception: %s', str(e))
+
+            self.stop()
+
+            if time.time() - connected_at > self.reconnect_delay_max:
+                # the previous connection was healthy, start over
+                delay = self.reconnect_delay
+            logger.info('reconnecting in %s sec', delay)
+            yield from asyncio.sleep(delay)
+            delay = min(delay * 2, self.reconnect_delay_max)
+
+    @asyncio.coroutine
+    def _connect_and_read(self):
+        session = self._bot.call_shared("http.session")
+
+        response = yield from session.post("https://slack.com/api/rtm.start",
+                                           data={ "token": self._config['key'] })
+        login_data = yield from response.json()
+        if not login_data.get("ok"):
+            raise ConnectionFailedError(login_data.get("error"))
+        for key in ['self', 'team', 'users', 'channels', 'groups', 'url']:
+            if key not in login_data:
+                raise IncompleteLoginError
 
         start_ts = time.time()
+
+        self._listener = SlackRTM(self._config, self._bot, asyncio.get_event_loop(), login_data)
+        _slackrtms.append(self._listener)
+        logger.info('started RTM connection for %s', self._listener.name)
+
+        socket = yield from session.ws_connect(login_data['url'], heartbeat=30.0)
+
+        replies = asyncio.Queue()
+        handling = asyncio.ensure_future(self._handle_replies(self._listener, replies))
         try:
-            if self._listener and self._listener in _slackrtms:
-                self._listener.close()
-                _slackrtms.remove(self._listener)
-            self._listener = SlackRTM(self._config, self._bot, self._loop, threaded=True)
-            _slackrtms.append(self._listener)
-            last_ping = int(time.time())
-            self.isFullyLoaded.set()
             while True:
-                if self.stopped():
+                message = yield from socket.receive()
+                if message.type == aiohttp.WSMsgType.TEXT:
+                    self._dispatch(json.loads(message.data), start_ts, replies)
+                elif message.type in (aiohttp.WSMsgType.CLOSE, aiohttp.WSMsgType.CLOSING,
+                                      aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR):
                     return
-                replies = self._listener.rtm_read()
-                if replies:
-                    for reply in replies:
-                        if "type" not in reply:
-                            logger.warning("no type available for {}".format(reply))
-                            continue
-                        if reply["type"] == "hello":
-                            # discard the initial api reply
-                            continue
-                        if reply["type"] == "message" and float(reply["ts"]) < start_ts:
-                            # discard messages in the queue older than the thread start timestamp
-                            continue
-                        try:
-                            self._listener.handle_reply(reply)
-                        except Exception as e:
-                            logger.exception('error during handle_reply(): %s\n%s', str(e), pprint.pformat(reply))
-                now = int(time.time())
-                if now > last_ping + 30:
-                    self._listener.ping()
-                    last_ping = now
-                time.sleep(.1)
-        except KeyboardInterrupt:
-            # close, nothing to do
+        finally:
+            handling.cancel()
+            yield from socket.close()
+
+    def _dispatch(self, reply, start_ts, replies):
+        if "type" not in reply:
+            logger.warning("no type available for {}".format(reply))
             return
-        except WebSocketConnectionClosedException as e:
-            logger.exception('WebSocketConnectionClosedException(%s)', str(e))
-            return self.run()
-        except IncompleteLoginError:
-            logger.exception('IncompleteLoginError, restarting')
-            time.sleep(1)
-            return self.run()
-        except (ConnectionFailedError, TimeoutError):
-            logger.exception('Connection failed or Timeout, waiting 10 sec trying to restart')
-            time.sleep(10)
-            return self.run()
-        except ConnectionResetError:
-            logger.exception('ConnectionResetError, attempting to restart')
-            time.sleep(1)
-            return self.run()
-        except Exception as e:
-            logger.exception('SlackRTMThread: unhandled exception: %s', str(e))
-        return
+        if reply["type"] == "hello":
+            # discard the initial api reply
+            return
+        if reply["type"] == "message" and float(reply["ts"]) < start_ts:
+            # discard messages in the queue older than the connection timestamp
+            return
+        replies.put_nowait(reply)
+
+    @asyncio.coroutine
+    def _handle_replies(self, listener, replies):
+        while True:
+            reply = yield from replies.get()
+            try:
+                yield from listener.handle_reply(reply)
+            except Exception as e:
+                logger.exception('error during handle_reply(): %s\n%s', str(e), pprint.pformat(reply))
 
     def stop(self):
         if self._listener and self._listener in _slackrtms:
             self._listener.close()
             _slackrtms.remove(self._listener)
-        self._stop.set()
-
-    def stopped(self):
-        return self._stop.isSet()
+        self._listener = None
@@ -55,10 +55,19 @@ def render_link(link, label):
     else:
         return link + " (" + label + ")"
 
+_slack_link = re.compile(r"<(.*?)\|(.*?)>")
+
 def convert_slack_links(text):
-    text = re.sub(r"<(.*?)\|(.*?)>",  lambda m: render_link(m.group(1), m.group(2)), text)
+    if "<" not in text:
+        return text
+    text = _slack_link.sub(lambda m: render_link(m.group(1), m.group(2)), text)
     return text
 
+_star_prefix = re.compile(r"^\*[^* ]")
+
+# placeholder for "**" while parsing, generated once
+_replacement_token = "[2star:" + str(uuid.uuid4()) + "]"
+
 def slack_markdown_to_hangups(text, debug=False):
     lines = text.split("\n")
     nlines = []
@@ -71,11 +80,11 @@ def slack_markdown_to_hangups(text, debug=False):
             continue
 
         # workaround: common pattern *<text>
-        if re.match("^\*[^* ]", line) and line.count("*") % 2:
+        if _star_prefix.match(line) and line.count("*") % 2:
             line = line.replace("*", "* ", 1)
 
         # workaround: accidental consumption of * in "**test"
-        replacement_token = "[2star:" + str(uuid.uuid4()) + "]"
+        replacement_token = _replacement_token
         line = line.replace("**", replacement_token)
 
         segments = parser_slack_to_hangups.parse(line)
@@ -6,7 +6,11 @@ logger = logging.getLogger(__name__)
 
 _slackrtms = []
 
+# bumped whenever the synced conversations of a team are replaced in memory
+_synced_conversations_generation = 0
+
 def _slackrtm_conversations_set(bot, team_name, synced_hangouts):
+    global _synced_conversations_generation
     memory_root_key = "slackrtm"
 
     if not bot.memory.exists([ memory_root_key ]):
@@ -18,6 +22,11 @@ def _slackrtm_conversations_set(bot, team_name, synced_hangouts):
     bot.memory.set_by_path([ memory_root_key, team_name, "synced_conversations" ], synced_hangouts)
     bot.memory.save()
 
+    _synced_conversations_generation += 1
+
+def _slackrtm_conversations_generation():
+    return _synced_conversations_generation
+
 def _slackrtm_conversations_get(bot, team_name):
     memory_root_key = "slackrtm"
     synced_conversations = False
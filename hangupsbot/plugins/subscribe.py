@@ -5,16 +5,76 @@ import sys
 
 import plugins
 
-from utils import remove_accents
+from utils import remove_accents, PhraseAutomaton
 
 
 logger = logging.getLogger(__name__)
 
 
+def _is_word(char):
+    return char.isalnum() or char == "_"
+
+
+class KeywordMatcher():
+    """every subscribed phrase, compiled into a single utils.PhraseAutomaton
+    * subscribers are tracked per phrase and updated incrementally, the automaton
+      is only rebuilt (on the next search) when a phrase gains its first or loses
+      its last subscriber
+    * search() is a single case-insensitive pass over the text, a hit is accepted on
+      the same boundaries as re.search(r"(^|\b| )" + re.escape(phrase) + r"($|\b)")
+    """
+
+    def __init__(self):
+        self.subscribers = {} # lowercase phrase -> set of chat_ids
+        self._phrases = {} # chat_id -> set of lowercase phrases
+        self._automaton = None
+
+    def update(self, chat_id, phrases):
+        """replace all subscriptions of chat_id with phrases"""
+        wanted = set(phrase.lower() for phrase in phrases if phrase)
+        current = self._phrases.get(chat_id, set())
+
+        for phrase in current - wanted:
+            self.subscribers[phrase].discard(chat_id)
+            if not self.subscribers[phrase]:
+                del self.subscribers[phrase]
+                self._automaton = None
+
+        for phrase in wanted - current:
+            if phrase not in self.subscribers:
+                self.subscribers[phrase] = set()
+                self._automaton = None
+            self.subscribers[phrase].add(chat_id)
+
+        if wanted:
+            self._phrases[chat_id] = wanted
+        else:
+            self._phrases.pop(chat_id, None)
+
+    def search(self, text):
+        """set of subscribed phrases found in text"""
+        if not self.subscribers:
+            return set()
+        if self._automaton is None:
+            self._automaton = PhraseAutomaton(self.subscribers)
+
+        return set( phrase for start, end, phrase in self._automaton.finditer(text)
+                    if self._bounded(text, start, end) )
+
+    @staticmethod
+    def _bounded(text, start, end):
+        if start > 0 and text[start - 1] != " " and _is_word(text[start - 1]) == _is_word(text[start]):
+            return False
+        if end < len(text) and _is_word(text[end - 1]) == _is_word(text[end]):
+            return False
+        return True
+
+
 class __internal_vars():
     def __init__(self):
         """ Cache to keep track of what keywords are being watched. Listed by user_id """
         self.keywords = {}
+        self.matcher = KeywordMatcher()
 
 _internal = __internal_vars()
 
@@ -32,6 +92,11 @@ def _handle_keyword(bot, event, command, include_event_user=False):
 
     _populate_keywords(bot, event)
 
+    event_text = re.sub(r"\s+", " ", event.text)
+    matched_phrases = _internal.matcher.search(event_text)
+    if not matched_phrases:
+        return
+
     users_in_chat = event.conv.users
 
     """check if synced room and syncing is enabled
@@ -46,16 +111,20 @@ def _handle_keyword(bot, event, command, include_event_user=False):
                         users_in_chat += bot.get_users_in_conversation(syncedroom)
                 users_in_chat = list(set(users_in_chat)) # make unique
 
-    event_text = re.sub(r"\s+", " ", event.text)
+    subscribers = set()
+    for phrase in matched_phrases:
+        subscribers.update(_internal.matcher.subscribers[phrase])
+
     event_text_lower = event.text.lower()
     for user in users_in_chat:
         chat_id = user.id_.chat_id
+        if chat_id not in subscribers:
+            continue
         try:
             if _internal.keywords[chat_id] and ( not chat_id in event.user.id_.chat_id
                                                  or include_event_user ):
                 for phrase in _internal.keywords[chat_id]:
-                    regexphrase = r"(^|\b| )" + re.escape(phrase) + r"($|\b)"
-                    if re.search(regexphrase, event_text, re.IGNORECASE):
+                    if phrase.lower() in matched_phrases:
 
                         """XXX: suppress alerts if it appears to be a valid mention to same user
                         logic condensed from the detection function in the mentions plugin, we may
@@ -98,6 +167,7 @@ def _populate_keywords(bot, event):
                 _internal.keywords[userchatid] = userkeywords
             else:
                 _internal.keywords[userchatid] = []
+            _internal.matcher.update(userchatid, _internal.keywords[userchatid])
 
 
 @asyncio.coroutine
@@ -181,6 +251,8 @@ def subscribe(bot, event, *args):
             _("Note: You will not be able to trigger your own subscriptions. To test, please ask somebody else to test this for you."))
 
 
+    _internal.matcher.update(event.user.id_.chat_id, _internal.keywords[event.user.id_.chat_id])
+
     # Save to file
     bot.memory.set_by_path(["user_data", event.user.id_.chat_id, "keywords"], _internal.keywords[event.user.id_.chat_id])
     bot.memory.save()
@@ -209,6 +281,8 @@ def unsubscribe(bot, event, *args):
         yield from bot.coro_send_message(
             event.conv,_("Error: keyword not found"))
 
+    _internal.matcher.update(event.user.id_.chat_id, _internal.keywords[event.user.id_.chat_id])
+
     # Save to file
     bot.memory.set_by_path(["user_data", event.user.id_.chat_id, "keywords"], _internal.keywords[event.user.id_.chat_id])
     bot.memory.save()
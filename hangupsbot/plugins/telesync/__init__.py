@@ -30,13 +30,21 @@ logger = logging.getLogger(__name__)
 reg_code_prefix = "VERIFY"
 
 
-client_session = None
+# bumped whenever the ho2tg/tg2ho linkages in memory are replaced, see TelegramBridge.routing_generation()
+_linkage_generation = 0
+
+
+def _store_linkages(memory, tg2ho_dict, ho2tg_dict):
+    """replace the telesync linkages in memory and save it"""
+    global _linkage_generation
+    memory.set_by_path(['telesync'], {'tg2ho': tg2ho_dict, 'ho2tg': ho2tg_dict})
+    memory.save()
+    _linkage_generation += 1
+
 
 @asyncio.coroutine
 def convert_online_mp4_to_gif(source_url, fallback_url=False):
     """experimental utility function to convert telegram mp4s back into gifs"""
-    global client_session
-
     config = _telesync_config(tg_bot.ho_bot)
 
     if "convert-with-gifscom" in config and not config["convert-with-gifscom"]:
@@ -51,9 +59,12 @@ def convert_online_mp4_to_gif(source_url, fallback_url=False):
         # XXX: demo api key from https://gifs.com/
         api_key = "gifs56d63999f0f34"
 
+    # the shared session is owned by httpclient, which may have replaced a closed one
+    client_session = tg_bot.ho_bot.call_shared("http.session")
+
     # retrieve the source image
     api_request = yield from client_session.get(source_url)
-    raw_image = yield from api_request.read()
+    raw_image = yield from tg_bot.ho_bot.call_shared("http.read", api_request)
 
     # upload it to gifs.com for conversion
 
@@ -628,8 +639,8 @@ def tg_on_supergroup_upgrade(bot, msg):
     new_chat_id = str(msg['migrate_to_chat_id'])
 
     memory = bot.ho_bot.memory.get_by_path(['telesync'])
-    tg2ho_dict = memory['tg2ho']
-    ho2tg_dict = memory['ho2tg']
+    tg2ho_dict = dict(memory['tg2ho'])
+    ho2tg_dict = dict(memory['ho2tg'])
 
     if old_chat_id in tg2ho_dict:
 
@@ -639,9 +650,7 @@ def tg_on_supergroup_upgrade(bot, msg):
 
         del tg2ho_dict[old_chat_id]
 
-        new_memory = {'tg2ho': tg2ho_dict, 'ho2tg': ho2tg_dict}
-        bot.ho_bot.memory.set_by_path(['telesync'], new_memory)
-        bot.ho_bot.memory.save()
+        _store_linkages(bot.ho_bot.memory, tg2ho_dict, ho2tg_dict)
 
         logger.info("SUPERGROUP: {} to {}".format( old_chat_id,
                                                    new_chat_id ))
@@ -680,8 +689,8 @@ def tg_command_set_sync_ho(bot, chat_id, args):  # /setsyncho <hangout conv_id>
         return
 
     memory = bot.ho_bot.memory.get_by_path(['telesync'])
-    tg2ho_dict = memory['tg2ho']
-    ho2tg_dict = memory['ho2tg']
+    tg2ho_dict = dict(memory['tg2ho'])
+    ho2tg_dict = dict(memory['ho2tg'])
 
     if str(chat_id) in tg2ho_dict:
         yield from bot.sendMessage(chat_id,
@@ -691,9 +700,7 @@ def tg_command_set_sync_ho(bot, chat_id, args):  # /setsyncho <hangout conv_id>
         tg2ho_dict[str(chat_id)] = str(params[0])
         ho2tg_dict[str(params[0])] = str(chat_id)
 
-        new_memory = {'tg2ho': tg2ho_dict, 'ho2tg': ho2tg_dict}
-        bot.ho_bot.memory.set_by_path(['telesync'], new_memory)
-        bot.ho_bot.memory.save()
+        _store_linkages(bot.ho_bot.memory, tg2ho_dict, ho2tg_dict)
 
         yield from bot.sendMessage(chat_id, "Sync target set to '{ho_conv_id}''".format(ho_conv_id=str(params[0])))
 
@@ -705,17 +712,15 @@ def tg_command_clear_sync_ho(bot, chat_id, args):
         yield from bot.sendMessage(chat_id, "Only admins can do that")
         return
     memory = bot.ho_bot.memory.get_by_path(['telesync'])
-    tg2ho_dict = memory['tg2ho']
-    ho2tg_dict = memory['ho2tg']
+    tg2ho_dict = dict(memory['tg2ho'])
+    ho2tg_dict = dict(memory['ho2tg'])
 
     if str(chat_id) in tg2ho_dict:
         ho_conv_id = tg2ho_dict[str(chat_id)]
         del tg2ho_dict[str(chat_id)]
         del ho2tg_dict[ho_conv_id]
 
-    new_memory = {'tg2ho': tg2ho_dict, 'ho2tg': ho2tg_dict}
-    bot.ho_bot.memory.set_by_path(['telesync'], new_memory)
-    bot.ho_bot.memory.save()
+    _store_linkages(bot.ho_bot.memory, tg2ho_dict, ho2tg_dict)
 
     yield from bot.sendMessage(chat_id, "Sync target cleared")
 
@@ -795,8 +800,8 @@ def tg_command_sync_profile(bot, chat_id, args):
     telegram_uid = str(args['user_id'])
     hangoutsbot = bot.ho_bot
 
-    tg2ho_dict = hangoutsbot.memory.get_by_path(['profilesync'])['tg2ho']
-    ho2tg_dict = hangoutsbot.memory.get_by_path(['profilesync'])['ho2tg']
+    tg2ho_dict = dict(hangoutsbot.memory.get_by_path(['profilesync'])['tg2ho'])
+    ho2tg_dict = dict(hangoutsbot.memory.get_by_path(['profilesync'])['ho2tg'])
 
     if telegram_uid in tg2ho_dict:
         if isinstance(tg2ho_dict[telegram_uid], str):
@@ -833,8 +838,8 @@ def tg_command_unsync_profile(bot, chat_id, args):
     telegram_uid = str(args['user_id'])
     hangoutsbot = bot.ho_bot
 
-    tg2ho_dict = hangoutsbot.memory.get_by_path(['profilesync'])['tg2ho']
-    ho2tg_dict = hangoutsbot.memory.get_by_path(['profilesync'])['ho2tg']
+    tg2ho_dict = dict(hangoutsbot.memory.get_by_path(['profilesync'])['tg2ho'])
+    ho2tg_dict = dict(hangoutsbot.memory.get_by_path(['profilesync'])['ho2tg'])
 
     if telegram_uid in tg2ho_dict:
         if isinstance(tg2ho_dict[telegram_uid], str):
@@ -907,6 +912,10 @@ class BridgeInstance(WebFramework):
 
         return self.configuration
 
+    def routing_generation(self):
+        # linkages are stored in memory, only replaced via _store_linkages()
+        return (self.bot.config.generation, _linkage_generation)
+
     def applicable_configuration(self, conv_id):
         """telesync configuration compatibility
 
@@ -1088,19 +1097,15 @@ def _initialise(bot):
         return
 
     if not bot.memory.exists(['telesync']):
-        bot.memory.set_by_path(['telesync'], {'ho2tg': {}, 'tg2ho': {}})
-        bot.memory.save()
+        _store_linkages(bot.memory, {}, {})
 
     if not bot.memory.exists(['profilesync']):
         bot.memory.set_by_path(['profilesync'], {'ho2tg': {}, 'tg2ho': {}})
         bot.memory.save()
 
-    global client_session
     global tg_bot
     global tg_loop
 
-    client_session = aiohttp.ClientSession()
-
     tg_bot = TelegramBot(bot)
 
     tg_bot.set_on_message_callback(tg_on_message)
@@ -1132,11 +1137,8 @@ def _initialise(bot):
 
 @asyncio.coroutine
 def _finalise(bot):
-    global client_session
     global tg_bot
     global tg_loop
-    if client_session:
-        yield from client_session.close()
     if tg_bot:
         tg_bot.chatbridge.close()
     if tg_loop:
@@ -1158,8 +1160,8 @@ def syncprofile(bot, event, *args):
 
     parameters = list(args)
 
-    ho2tg_dict = bot.memory.get_by_path(['profilesync'])['ho2tg']
-    tg2ho_dict = bot.memory.get_by_path(['profilesync'])['tg2ho']
+    ho2tg_dict = dict(bot.memory.get_by_path(['profilesync'])['ho2tg'])
+    tg2ho_dict = dict(bot.memory.get_by_path(['profilesync'])['tg2ho'])
 
     hangouts_uid = str(event.user_id.chat_id)
 
@@ -1219,8 +1221,8 @@ def telesync(bot, event, *args):
     conv_id = event.conv_id
 
     memory = bot.memory.get_by_path(['telesync'])
-    tg2ho_dict = memory['tg2ho']
-    ho2tg_dict = memory['ho2tg']
+    tg2ho_dict = dict(memory['tg2ho'])
+    ho2tg_dict = dict(memory['ho2tg'])
 
     if len(parameters) == 0:
         if conv_id in ho2tg_dict:
@@ -1259,9 +1261,7 @@ def telesync(bot, event, *args):
     else:
         yield from bot.coro_send_message(conv_id, "too many arguments")
 
-    new_memory = {'ho2tg': ho2tg_dict, 'tg2ho': tg2ho_dict}
-    bot.memory.set_by_path(['telesync'], new_memory)
-    bot.memory.save()
+    _store_linkages(bot.memory, tg2ho_dict, ho2tg_dict)
 
 
 @asyncio.coroutine
@@ -17,10 +17,26 @@ class tags:
     bot = None
     indices = {}
 
+    generation = 0 # incremented whenever the indices change, for cache invalidation
+
+    active_max = 50000 # resolved useractive/convactive entries kept per generation
+
     def __init__(self, bot):
         self.bot = bot
+        self._active = {} # ("conv", conv_id) | ("user", chat_id, conv_id) -> tuple of active tags
+        self._tag_users = {} # tag -> (set of chat_ids, tagged by a user wildcard)
+        self._active_generation = None
+        self._unsaved = False # memory changed by _apply(), not yet saved
         self.refresh_indices()
 
+    def _active_cache(self):
+        """resolved tag caches, emptied whenever the tags generation changes"""
+        if self._active_generation != self.generation or len(self._active) > self.active_max:
+            self._active = {}
+            self._tag_users = {}
+            self._active_generation = self.generation
+        return self._active
+
     def _load_from_memory(self, key, type):
         if self.bot.memory.exists([key]):
             for id, data in self.bot.memory[key].items():
@@ -42,41 +58,60 @@ class tags:
                         for tag in tags:
                             self.add_to_index("user", tag, conv_id + "|" + chat_id)
 
+        self.generation += 1
+
         logger.info("refreshed")
 
     def add_to_index(self, type, tag, id):
         tag_to_object = "tag-{}s".format(type)
         object_to_tag = "{}-tags".format(type)
 
-        if tag not in self.indices[tag_to_object]:
-            self.indices[tag_to_object][tag] = []
-        if id not in self.indices[tag_to_object][tag]:
-            self.indices[tag_to_object][tag].append(id)
-
-        if id not in self.indices[object_to_tag]:
-            self.indices[object_to_tag][id] = []
-        if tag not in self.indices[object_to_tag][id]:
-            self.indices[object_to_tag][id].append(tag)
+        self.indices[tag_to_object].setdefault(tag, set()).add(id)
+        self.indices[object_to_tag].setdefault(id, set()).add(tag)
 
     def remove_from_index(self, type, tag, id):
         tag_to_object = "tag-{}s".format(type)
         object_to_tag = "{}-tags".format(type)
 
-        if tag in self.indices[tag_to_object]:
-            if id in self.indices[tag_to_object][tag]:
-                self.indices[tag_to_object][tag].remove(id)
-                if len(self.indices[tag_to_object][tag]) == 0:
-                    # remove key entirely it its empty
-                    del(self.indices[tag_to_object][tag])
+        objects = self.indices[tag_to_object].get(tag)
+        if objects is not None:
+            objects.discard(id)
+            if not objects:
+                # remove key entirely it its empty
+                del(self.indices[tag_to_object][tag])
 
-        if id in self.indices[object_to_tag]:
-            if tag in self.indices[object_to_tag][id]:
-                self.indices[object_to_tag][id].remove(tag)
-                if len(self.indices[object_to_tag][id]) == 0:
-                    # remove key entirely it its empty
-                    del(self.indices[object_to_tag][id])
+        tags = self.indices[object_to_tag].get(id)
+        if tags is not None:
+            tags.discard(tag)
+            if not tags:
+                # remove key entirely it its empty
+                del(self.indices[object_to_tag][id])
 
     def update(self, type, id, action, tag):
+        """apply a single action=set|remove of tag to (type=conv|user|convuser) id"""
+        try:
+            updated = self._apply(type, id, action, tag)
+        finally:
+            if self._unsaved:
+                self._unsaved = False
+                self.bot.memory.save()
+        return updated
+
+    def update_many(self, changes):
+        """apply a list of (type, id, action, tag) changes with a single memory write,
+            returns the number of changes that modified the tags"""
+        updated = 0
+        try:
+            for change in changes:
+                if self._apply(*change):
+                    updated = updated + 1
+        finally:
+            if self._unsaved:
+                self._unsaved = False
+                self.bot.memory.save()
+        return updated
+
+    def _apply(self, type, id, action, tag):
         updated = False
         tags = None
 
@@ -154,19 +189,27 @@ class tags:
             raise ValueError("unrecognised action {}".format(action))
 
         if updated:
+            self.generation += 1
+
+            # written to memory here, saved once by update()/update_many()
             if type == "conv":
-                self.bot.conversation_memory_set(id, "tags", tags)
+                self.bot.initialise_memory(id, "conv_data")
+                self.bot.memory.set_by_path(["conv_data", id, "tags"], tags)
 
             elif type == "user":
-                self.bot.user_memory_set(id, "tags", tags)
+                self.bot.initialise_memory(id, "user_data")
+                self.bot.memory.set_by_path(["user_data", id, "tags"], tags)
 
             elif type == "convuser":
                 tags_users[chat_id] = tags
-                self.bot.conversation_memory_set(conv_id, "tags-users", tags_users)
+                self.bot.initialise_memory(conv_id, "conv_data")
+                self.bot.memory.set_by_path(["conv_data", conv_id, "tags-users"], tags_users)
 
             else:
                 raise TypeError("unhandled update type {}".format(type))
 
+            self._unsaved = True
+
             logger.info("{}/{} action={} value={}".format(type, id, action, tag))
         else:
             logger.info("{}/{} action={} value={} [NO CHANGE]".format(type, id, action, tag))
@@ -191,7 +234,7 @@ class tags:
         if type == "user" or type == "convuser":
             for key in self.indices["user-tags"]:
 
-                match_user = (type == "user" and (key == id or id=="ALL"))
+                match_user = (type == "user" and "|" not in key and (key == id or id=="ALL"))
                     # runs if type=="user"
                 match_convuser = (key.endswith("|" + id) or (id=="ALL" and "|" in key))
                     # runs if type=="user" or type=="convuser"
@@ -220,23 +263,26 @@ class tags:
                 for tag in self.indices[_index_name]:
                     if tag == id or id == "ALL":
                         for key in self.indices[_index_name][tag]:
-                            remove.append((_type, key, id))
+                            if _type == "user" and "|" in key:
+                                remove.append(("convuser", key, tag))
+                            else:
+                                remove.append((_type, key, tag))
 
         else:
             raise TypeError("{}".format(type))
 
-        records_removed = 0
-        if remove:
-            for args in remove:
-                if self.remove(*args):
-                    records_removed = records_removed + 1
-
-        return records_removed
+        # all removals are applied first, memory is written once
+        return self.update_many([ (_type, key, "remove", tag) for _type, key, tag in remove ])
 
 
     def convactive(self, conv_id):
         """return active tags for conv_id, or generic GROUP, ONE_TO_ONE keys"""
 
+        cache = self._active_cache()
+        key = ("conv", conv_id)
+        if key in cache:
+            return list(cache[key])
+
         active_tags = []
         check_keys = []
 
@@ -251,20 +297,31 @@ class tags:
             check_keys.extend([ self.wildcard["conversation"] ])
         else:
             logger.warning("convactive: conversation {} does not exist".format(conv_id))
+            return active_tags
+
+        active_tags = self._resolve(self.indices["conv-tags"], check_keys)
+        cache[key] = tuple(active_tags)
+        return active_tags
 
+    def _resolve(self, index, check_keys):
+        """merge tags of the first matching key, continuing to the next key while tagging-merge is active"""
+        active_tags = set()
         for _key in check_keys:
-            if _key in self.indices["conv-tags"]:
-                active_tags.extend(self.indices["conv-tags"][_key])
-                active_tags = list(set(active_tags))
+            if _key in index:
+                active_tags.update(index[_key])
                 if "tagging-merge" not in active_tags:
                     break
-
-        return active_tags
+        return list(active_tags)
 
 
     def useractive(self, chat_id, conv_id="*"):
         """return active tags of user for current conv_id if supplied, globally if not"""
 
+        cache = self._active_cache()
+        key = ("user", chat_id, conv_id)
+        if key in cache:
+            return list(cache[key])
+
         active_tags = []
         check_keys = []
 
@@ -285,22 +342,36 @@ class tags:
 
                 else:
                     logger.warning("useractive: conversation {} does not exist".format(conv_id))
+                    # not cached, the conversation may appear later
+                    key = None
 
             check_keys.extend([ chat_id,
                                 self.wildcard["user"] ])
 
         else:
             logger.warning("useractive: user {} does not exist".format(chat_id))
+            return active_tags
 
-        for _key in check_keys:
-            if _key in self.indices["user-tags"]:
-                active_tags.extend(self.indices["user-tags"][_key])
-                active_tags = list(set(active_tags))
-                if "tagging-merge" not in active_tags:
-                    break
-
+        active_tags = self._resolve(self.indices["user-tags"], check_keys)
+        if key:
+            cache[key] = tuple(active_tags)
         return active_tags
 
+    def _users_tagged(self, tag):
+        """inverted index: (chat_ids with tag on any of their keys, whether a user wildcard key has tag)"""
+        self._active_cache()
+        if tag not in self._tag_users:
+            chat_ids = set()
+            wildcard = False
+            for key in self.indices["tag-users"].get(tag, ()):
+                chat_id = key.rsplit("|", 1)[-1]
+                if chat_id == self.wildcard["user"]:
+                    wildcard = True
+                else:
+                    chat_ids.add(chat_id)
+            self._tag_users[tag] = (chat_ids, wildcard)
+        return self._tag_users[tag]
+
 
     def userlist(self, conv_id, tags=False):
         """return dict of participating chat_ids to tags, optionally filtered by tag/list of tags"""
@@ -314,6 +385,15 @@ class tags:
         except KeyError:
             logger.warning("userlist: conversation {} does not exist".format(conv_id))
 
+        if tags:
+            # only users carrying every tag on some key (or covered by a wildcard) can match
+            candidates = set(userlist)
+            for tag in tags:
+                chat_ids, wildcard = self._users_tagged(tag)
+                if not wildcard:
+                    candidates &= chat_ids
+            userlist = [ chat_id for chat_id in userlist if chat_id in candidates ]
+
         results = {}
         for chat_id in userlist:
             user_tags = self.useractive(chat_id, conv_id)
@@ -0,0 +1,79 @@
+"""micro-benchmark for autoreply rule matching via autoreply.AutoreplyRules
+usage: bench-autoreply.py [-h] [-r RULES] [-m MESSAGES] [--baseline]
+
+optional arguments:
+  -h, --help            show this help message and exit
+  -r RULES, --rules RULES
+                        number of synthetic autoreply rules
+  -m MESSAGES, --messages MESSAGES
+                        number of synthetic messages to match
+  --baseline            also time (and compare with) a _words_in_text() call per keyword
+
+example usage (from the hangupsbot directory):
+python3 tests/bench-autoreply.py --rules 1000 --messages 10000
+"""
+import argparse, logging, os, random, sys, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from plugins.autoreply import AutoreplyRules, _words_in_text
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-r", "--rules", type=int, default=1000, help="number of synthetic autoreply rules")
+parser.add_argument("-m", "--messages", type=int, default=10000, help="number of synthetic messages to match")
+parser.add_argument("--baseline", action="store_true", help="also time (and compare with) a _words_in_text() call per keyword")
+
+args = parser.parse_args()
+
+logging.basicConfig(level=logging.WARNING)
+
+
+random.seed(0)
+vocabulary = [ "word{}".format(number) for number in range(args.rules * 2) ]
+filler = [ "the", "a", "and", "is", "of", "to", "in", "it", "you", "that" ]
+
+rules = []
+for number in range(args.rules):
+    if number % 100 == 0:
+        kwds = [ "regex:w(or|ir)d{}+".format(number) ]
+    elif number % 50 == 0:
+        kwds = "JOIN"
+    else:
+        kwds = random.sample(vocabulary, random.randint(1, 3))
+        if number % 7 == 0:
+            kwds.append("{} {}".format(random.choice(filler), random.choice(vocabulary)))
+    rules.append([ kwds, [ "reply {}".format(number) ] ])
+
+messages = [ " ".join( random.choice(vocabulary).upper() if random.randrange(10) == 0 else random.choice(filler)
+                       for word in range(random.randint(5, 25)) )
+             for number in range(args.messages) ]
+
+
+def baseline(text):
+    return [ rule for rule in rules
+             if isinstance(rule[0], list) and any(_words_in_text(kw, text) or kw == "*" for kw in rule[0]) ]
+
+
+start_time = time.time()
+compiled = AutoreplyRules(rules)
+compile_time = time.time() - start_time
+
+start_time = time.time()
+matched = [ compiled.matching("MESSAGE", text) for text in messages ]
+interval = time.time() - start_time
+
+print("{} rules compiled in {:.3f}s".format(args.rules, compile_time))
+print("{} messages, {} matches: {:.3f}s total, {:.2f}us per message".format(
+    args.messages, sum(len(rules_matched) for rules_matched in matched), interval,
+    interval / args.messages * 1e6))
+
+if args.baseline:
+    start_time = time.time()
+    expected = [ baseline(text) for text in messages ]
+    interval = time.time() - start_time
+
+    assert matched == expected, "compiled rules disagree with _words_in_text()"
+
+    print("baseline: {:.3f}s total, {:.2f}us per message".format(
+        interval, interval / args.messages * 1e6))
@@ -0,0 +1,101 @@
+"""micro-benchmark for EventHandler.run_pluggable_omnibus
+usage: bench-handlers.py [-h] [-e EVENTS] [-n HANDLERS] [--debug]
+
+optional arguments:
+  -h, --help            show this help message and exit
+  -e EVENTS, --events EVENTS
+                        number of synthetic events to dispatch
+  -n HANDLERS, --handlers HANDLERS
+                        number of handlers to register
+  --debug               enable debug logging (measures label formatting)
+
+example usage (from the hangupsbot directory):
+python3 tests/bench-handlers.py --events 10000 --handlers 40
+"""
+import argparse, asyncio, logging, os, sys, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import handlers
+import plugins
+
+from exceptions import HangupsBotExceptions
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-e", "--events", type=int, default=10000, help="number of synthetic events to dispatch")
+parser.add_argument("-n", "--handlers", type=int, default=40, help="number of handlers to register")
+parser.add_argument("--debug", action="store_true", help="enable debug logging (measures label formatting)")
+
+args = parser.parse_args()
+
+logging.basicConfig(level=logging.DEBUG if args.debug else logging.WARNING,
+                    stream=open(os.devnull, "w") if args.debug else sys.stderr)
+
+
+class StubConfig:
+    generation = 0
+
+
+class StubBot:
+    def __init__(self):
+        self.Exceptions = HangupsBotExceptions()
+        self.config = StubConfig()
+        self.shared = {}
+
+    def get_config_option(self, option):
+        return None
+
+    def register_shared(self, id, objectref, forgiving=False):
+        self.shared[id] = objectref
+
+
+class StubEvent:
+    def __init__(self, number):
+        self.text = "synthetic event {}".format(number)
+        self.counter = 0
+
+
+def _make_handler(index):
+    # alternate between the accepted signatures
+    if index % 2:
+        def _handler(bot, event, command):
+            event.counter += 1
+    else:
+        def _handler(bot, event):
+            event.counter += 1
+    _handler.__name__ = "handler_{}".format(index)
+    return _handler
+
+
+bot = StubBot()
+plugins.tracking.set_bot(bot)
+event_handler = handlers.EventHandler(bot)
+
+plugins.tracking.start({ "module": "bench", "module.path": "tests.bench" })
+for index in range(args.handlers):
+    event_handler.register_handler(_make_handler(index), type="message", priority=index % 5 * 10)
+plugins.tracking.end()
+
+events = [ StubEvent(number) for number in range(args.events) ]
+
+
+@asyncio.coroutine
+def dispatch_all():
+    for event in events:
+        yield from event_handler.run_pluggable_omnibus("message", bot, event, None)
+
+
+loop = asyncio.get_event_loop()
+
+start_time = time.time()
+loop.run_until_complete(dispatch_all())
+interval = time.time() - start_time
+
+calls = sum(event.counter for event in events)
+assert calls == args.events * args.handlers, "expected {} calls, got {}".format(args.events * args.handlers, calls)
+
+print("{} events x {} handlers: {:.3f}s total, {:.2f}us per event, {:.3f}us per handler call".format(
+    args.events, args.handlers, interval,
+    interval / args.events * 1e6,
+    interval / calls * 1e6))
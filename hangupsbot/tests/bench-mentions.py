@@ -0,0 +1,90 @@
+"""micro-benchmark for @mention resolution via mentions.MentionIndex
+usage: bench-mentions.py [-h] [-m MENTIONS] [-u USERS] [-n NICKNAMES]
+
+optional arguments:
+  -h, --help            show this help message and exit
+  -m MENTIONS, --mentions MENTIONS
+                        number of synthetic @mentions to resolve
+  -u USERS, --users USERS
+                        number of synthetic users present in the conversation
+  -n NICKNAMES, --nicknames NICKNAMES
+                        percentage of users with a nickname
+
+example usage (from the hangupsbot directory):
+python3 tests/bench-mentions.py --mentions 1000 --users 5000
+"""
+import argparse, logging, os, random, sys, time
+
+from collections import namedtuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from plugins.mentions import MentionIndex
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-m", "--mentions", type=int, default=1000, help="number of synthetic @mentions to resolve")
+parser.add_argument("-u", "--users", type=int, default=5000, help="number of synthetic users present in the conversation")
+parser.add_argument("-n", "--nicknames", type=int, default=20, help="percentage of users with a nickname")
+
+args = parser.parse_args()
+
+logging.basicConfig(level=logging.WARNING)
+
+
+StubUser = namedtuple("StubUser", [ "id_", "full_name", "is_self" ])
+StubUserID = namedtuple("StubUserID", [ "chat_id" ])
+
+
+class StubMemory(dict):
+    generation = 0
+
+    def exists(self, path):
+        return path[0] in self
+
+
+class StubBot:
+    def __init__(self):
+        self.memory = StubMemory()
+
+
+first_names = [ "Anna", "Björn", "Chloé", "Dmitri", "Émile", "Fatima", "Gustav", "Hana",
+                "Inès", "José", "Kenji", "Léa", "Mårten", "Noël", "Oscar", "Zoë" ]
+last_names = [ "Andersson", "Bąk", "Caña", "Dvořák", "Eriksen", "Fernández", "García",
+               "Håkansson", "Ibáñez", "Jørgensen", "Kowalski", "López", "Müller", "Núñez" ]
+
+random.seed(0)
+bot = StubBot()
+bot.memory["user_data"] = {}
+
+users = []
+for number in range(args.users):
+    chat_id = "{:021d}".format(number)
+    full_name = "{} {} {}".format(random.choice(first_names), random.choice(last_names), number)
+    users.append(StubUser(StubUserID(chat_id), full_name, False))
+    if random.randrange(100) < args.nicknames:
+        bot.memory["user_data"][chat_id] = { "nickname": "nick{}".format(number) }
+
+mentions = [ random.choice([ "all",
+                             random.choice(first_names),
+                             random.choice(last_names).lower(),
+                             "nick{}".format(random.randrange(args.users)),
+                             "user{}".format(random.randrange(args.users)) ])
+             for number in range(args.mentions) ]
+
+index = MentionIndex()
+
+start_time = time.time()
+index.match(bot, users, "warmup")
+warmup = time.time() - start_time
+
+start_time = time.time()
+matched = 0
+for username in mentions:
+    matched += len(index.match(bot, users, username))
+interval = time.time() - start_time
+
+print("{} users: index built in {:.3f}s".format(args.users, warmup))
+print("{} mentions, {} matches: {:.3f}s total, {:.2f}ms per mention".format(
+    args.mentions, matched, interval,
+    interval / args.mentions * 1e3))
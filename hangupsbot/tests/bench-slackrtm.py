@@ -0,0 +1,85 @@
+"""micro-benchmark for the slackrtm slack->hangouts translation in SlackRTM.handle_reply
+usage: bench-slackrtm.py [-h] [-r REPLIES] [-u USERS] [-c CHANNELS]
+
+optional arguments:
+  -h, --help            show this help message and exit
+  -r REPLIES, --replies REPLIES
+                        number of synthetic slack replies to translate
+  -u USERS, --users USERS
+                        number of slack users known to the team
+  -c CHANNELS, --channels CHANNELS
+                        number of slack channels known to the team
+
+example usage (from the hangupsbot directory):
+python3 tests/bench-slackrtm.py --replies 100000
+"""
+import argparse, logging, os, random, sys, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from plugins.slackrtm.core import SlackMessage, SlackRTM
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-r", "--replies", type=int, default=100000, help="number of synthetic slack replies to translate")
+parser.add_argument("-u", "--users", type=int, default=500, help="number of slack users known to the team")
+parser.add_argument("-c", "--channels", type=int, default=50, help="number of slack channels known to the team")
+
+args = parser.parse_args()
+
+logging.basicConfig(level=logging.WARNING)
+
+
+class StubMemory:
+    def exists(self, path):
+        # slackrtm memory root exists, no synced conversations stored
+        return len(path) == 1
+
+
+class StubBot:
+    def __init__(self):
+        self.memory = StubMemory()
+
+    def list_conversations(self):
+        return []
+
+
+users = [ { "id": "U{:06d}".format(index),
+            "name": "user{}".format(index),
+            "real_name": "User Number {}".format(index) } for index in range(args.users) ]
+channels = [ { "id": "C{:06d}".format(index),
+               "name": "channel{}".format(index),
+               "members": [] } for index in range(args.channels) ]
+
+login_data = { "self": { "id": "UBOT", "name": "hobot" },
+               "team": { "name": "bench", "domain": "bench" },
+               "users": users,
+               "channels": channels,
+               "groups": [] }
+
+slackrtm = SlackRTM({ "key": "xoxb-bench", "name": "bench" }, StubBot(), None, login_data)
+
+templates = [ "hello <@{user}>, see <#{channel}> for *details*",
+              "_quick_ update: <https://example.com/{user}|the doc> is ready",
+              "plain message with no references at all",
+              "<@{user}> <@{user}|alias> ```code``` and `inline` bits",
+              "multi\nline *bold* and _italic_ from <#{channel}|somewhere>" ]
+
+random.seed(0)
+replies = [ { "type": "message",
+              "channel": random.choice(channels)["id"],
+              "user": random.choice(users)["id"],
+              "ts": "0",
+              "text": random.choice(templates).format( user = random.choice(users)["id"],
+                                                       channel = random.choice(channels)["id"] ) }
+            for number in range(args.replies) ]
+
+
+start_time = time.time()
+for reply in replies:
+    slackrtm.translate(SlackMessage(slackrtm, reply).text)
+interval = time.time() - start_time
+
+print("{} replies, {} users, {} channels: {:.3f}s total, {:.2f}us per reply".format(
+    args.replies, args.users, args.channels, interval,
+    interval / args.replies * 1e6))
@@ -0,0 +1,58 @@
+"""round-trip check for the sqlite memory backend
+usage: config-sqlite.py [-h] [-u USERS]
+
+optional arguments:
+  -h, --help            show this help message and exit
+  -u USERS, --users USERS
+                        number of user_data rows to store
+
+example usage (from the hangupsbot directory):
+python3 tests/config-sqlite.py --users 50
+"""
+import argparse, json, logging, os, sys, tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import config
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-u", "--users", type=int, default=50, help="number of user_data rows to store")
+
+args = parser.parse_args()
+
+logging.basicConfig(level=logging.WARNING)
+
+
+user_data = { str(number): { "nickname": "user {}".format(number),
+                             "_hangups": { "full_name": "User {}".format(number),
+                                           "emails": [ "{}@example.com".format(number) ] } }
+              for number in range(args.users) }
+
+with tempfile.TemporaryDirectory() as directory:
+    filename = os.path.join(directory, "memory.json")
+
+    memory = config.Config(filename, storage="sqlite")
+    memory.set_by_path(["user_data"], user_data)
+    memory.set_by_path(["convmem"], { "abc": { "title": "a conversation" } })
+
+    # a whole namespace is read back as a lazy view, it must still serialise as plain json
+    subtree = memory.get_by_path(["user_data"])
+    assert json.loads(config._serialise(subtree)) == user_data, "namespace did not round-trip"
+    assert json.loads(json.dumps(subtree, default=config._json_default)) == user_data, "namespace did not round-trip"
+
+    # storing a view below another key writes its contents, not the view
+    memory.set_by_path(["backup"], { "user_data": subtree })
+    memory.save(delay=False)
+
+    reloaded = config.Config(filename, storage="sqlite")
+    assert json.loads(config._serialise(reloaded.get_by_path(["user_data"]))) == user_data, "reloaded namespace differs"
+    assert reloaded.get_by_path(["backup", "user_data"]) == user_data, "reloaded copy differs"
+    assert json.loads(config._serialise(reloaded.config)) == { "user_data": user_data,
+                                                                "convmem": { "abc": { "title": "a conversation" } },
+                                                                "backup": { "user_data": user_data } }, "reloaded memory differs"
+
+    reloaded.storage._connection.close()
+    memory.storage._connection.close()
+
+print("{} user_data rows round-tripped through sqlite".format(args.users))
@@ -1,5 +1,5 @@
 # coding: utf-8
-import importlib, logging, unicodedata
+import collections, importlib, logging, unicodedata
 
 import hangups_shim as hangups
 
@@ -41,6 +41,58 @@ def unicode_to_ascii(text):
     return unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode()
 
 
+class PhraseAutomaton:
+    """aho-corasick automaton over a fixed set of phrases, matched case-insensitively
+
+    finditer(text) yields (start, end, phrase) for every occurrence of every phrase,
+    overlapping ones included, in a single pass over text"""
+
+    def __init__(self, phrases):
+        self._goto = [{}] # state -> { char: next state }, state 0 is the root
+        self._output = [()] # state -> phrases ending in this state
+        for phrase in set(phrases):
+            state = 0
+            for char in self._lower(phrase):
+                if char not in self._goto[state]:
+                    self._goto[state][char] = len(self._goto)
+                    self._goto.append({})
+                    self._output.append(())
+                state = self._goto[state][char]
+            if state:
+                self._output[state] += (phrase,)
+
+        self._fail = [0] * len(self._goto)
+        queue = collections.deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(char, 0)
+                self._output[next_state] += self._output[self._fail[next_state]]
+
+    @staticmethod
+    def _lower(text):
+        lowered = text.lower()
+        if len(lowered) != len(text):
+            # keep offsets aligned with text
+            lowered = "".join(char.lower() if len(char.lower()) == 1 else char for char in text)
+        return lowered
+
+    def finditer(self, text):
+        goto, fail, output = self._goto, self._fail, self._output
+
+        state = 0
+        for end, char in enumerate(self._lower(text), 1):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for phrase in output[state]:
+                yield end - len(phrase), end, phrase
+
+
 def class_from_name(module_name, class_name):
     """adapted from http://stackoverflow.com/a/13808375"""
     # load the module, will raise ImportError if module cannot be loaded
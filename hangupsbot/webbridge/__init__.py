@@ -1,14 +1,18 @@
 import asyncio
 import logging
+import time
 import uuid
 
 from collections import namedtuple
+from types import MappingProxyType
 
 from hangups import ChatMessageEvent
 
 import plugins
 import threadmanager
 
+from handlers import ExpiringRegistry
+
 from parsers.markdown import html_to_hangups_markdown
 
 from sinks import aiohttp_start
@@ -31,9 +35,50 @@ FakeUserID = namedtuple( 'userID', [ 'chat_id',
                                      'gaia_id' ])
 
 
+class RoutingIndex:
+    """shared routing table: conv_id -> { bridge uid: applicable configurations }
+    * entries are computed once via the bridge's applicable_configuration()
+    * an entry is recomputed only when the bridge's routing_generation() changes
+    * entries are stored as tuples of read-only configurations, shared by all callers
+    """
+
+    def __init__(self):
+        self._routes = {}
+
+    def lookup(self, bridge, conv_id):
+        generation = bridge.routing_generation()
+
+        try:
+            entry = self._routes[conv_id][bridge.uid]
+            if entry[0] == generation:
+                return entry[1]
+        except KeyError:
+            pass
+
+        configurations = tuple( MappingProxyType(configuration)
+                                for configuration in bridge.applicable_configuration(conv_id) or () )
+        self._routes.setdefault(conv_id, {})[bridge.uid] = (generation, configurations)
+        return configurations
+
+    def invalidate(self, uid=None):
+        if uid is None:
+            self._routes = {}
+            return
+        for bridges in self._routes.values():
+            bridges.pop(uid, None)
+
+routing = RoutingIndex()
+
+# attachment url -> upload future, shared by every bridge relaying the same attachment
+_attachment_uploads = ExpiringRegistry("attachment uploads", ttl=3600, max_size=500)
+
+
 class WebFramework:
     instance_number = 0
 
+    # True if _send_to_external_chat() sends via bot.coro_send_message() (and the outbound queue)
+    relay_via_outbound = False
+
     def __init__(self, bot, configkey, RequestHandler=IncomingRequestHandler, extra_metadata={}):
         self.uid = False
         self.plugin_name = False
@@ -44,6 +89,12 @@ class WebFramework:
 
         self.load_configuration(configkey)
 
+        self._relay_semaphore = asyncio.Semaphore(bot.get_config_option("chatbridge.relay.concurrency") or 4)
+
+        self._coalescing = {} # conv_id -> [(formatted message, passthru)]
+        self._coalesce_timers = {} # conv_id -> timer handle closing the open window
+        self._coalesce_flushes = set() # flush tasks started by expired windows
+
         self.setup_plugin()
 
         if not self.plugin_name:
@@ -58,6 +109,7 @@ class WebFramework:
 
         # Add to bot's tracking of bridges.
         bot.bridges[self.uid] = self
+        routing.invalidate(self.uid)
 
         self._handler_broadcast = plugins.register_handler(self._broadcast, type="sending", extra_metadata=extra_metadata)
         self._handler_repeat = plugins.register_handler(self._repeat, type="allmessages", extra_metadata=extra_metadata)
@@ -68,6 +120,7 @@ class WebFramework:
         plugins.deregister_handler(self._handler_broadcast, type="sending")
         plugins.deregister_handler(self._handler_repeat, type="allmessages")
         del self.bot.bridges[self.uid]
+        routing.invalidate(self.uid)
 
     def load_configuration(self, configkey):
         self.configuration = self.bot.get_config_option(self.configkey) or []
@@ -76,6 +129,11 @@ class WebFramework:
     def setup_plugin(self):
         logger.warning("setup_plugin should be overridden by derived class")
 
+    def routing_generation(self):
+        """value that changes whenever applicable_configuration() results may change
+        override in derived classes that also read their configuration from memory"""
+        return self.bot.config.generation
+
     def applicable_configuration(self, conv_id):
         """standardised configuration structure:
 
@@ -109,7 +167,7 @@ class WebFramework:
         message = broadcast_list[0][1]
         image_id = broadcast_list[0][2]
 
-        applicable_configurations = self.applicable_configuration(conv_id)
+        applicable_configurations = routing.lookup(self, conv_id)
         if not applicable_configurations:
             return
 
@@ -168,19 +226,21 @@ class WebFramework:
                                        "source_plugin": self.plugin_name }
 
         # for messages from other plugins, relay them
-        for config in applicable_configurations:
-            yield from self._send_to_external_chat(
+        yield from self._fan_out([
+            ( "{}#{}".format(self.uid, index),
+              self._send_to_external_chat(
                 config,
                 FakeEvent(
                     text = message,
                     user = user,
-                    passthru = passthru ))
+                    passthru = passthru )) )
+            for index, config in enumerate(applicable_configurations) ])
 
     @asyncio.coroutine
     def _repeat(self, bot, event, command):
         conv_id = event.conv_id
 
-        applicable_configurations = self.applicable_configuration(conv_id)
+        applicable_configurations = routing.lookup(self, conv_id)
         if not applicable_configurations:
             return
 
@@ -257,8 +317,84 @@ class WebFramework:
                                        "source_edit": False,
                                        "source_plugin": self.plugin_name }
 
-        for config in applicable_configurations:
-            yield from self._send_to_external_chat(config, event)
+        yield from self._fan_out([
+            ( "{}#{}".format(self.uid, index), self._send_to_external_chat(config, event) )
+            for index, config in enumerate(applicable_configurations) ])
+
+    @asyncio.coroutine
+    def _fan_out(self, deliveries):
+        """deliver to all targets concurrently
+
+        deliveries: list of (target label, coroutine)
+        * at most chatbridge.relay.concurrency deliveries of this bridge run at once
+        * each delivery is cancelled after chatbridge.relay.timeout seconds, unless the bridge
+            sends through the outbound queue (relay_via_outbound): time spent queued does not count,
+            the timeout is applied to each send attempt instead, see relay_timeout()
+        * a failing target does not affect the other targets
+        * must not be nested: _send_to_external_chat() runs while holding a delivery slot
+
+        returns list of (target label, latency in seconds, exception or None)
+        """
+
+        if not deliveries:
+            return []
+
+        timeout = None if self.relay_via_outbound else self.relay_timeout()
+
+        results = yield from asyncio.gather(*[ self._deliver(label, coro, timeout)
+                                               for label, coro in deliveries ])
+
+        logger.info("{}:{}:fan-out:{}".format(
+            self.plugin_name, self.uid,
+            ", ".join("{}={:.3f}s{}".format(label, latency, "" if error is None else " [{}]".format(repr(error)))
+                      for label, latency, error in results)))
+
+        return results
+
+    def relay_timeout(self):
+        return self.bot.get_config_option("chatbridge.relay.timeout") or 30
+
+    @asyncio.coroutine
+    def _deliver(self, label, coro, timeout):
+        start_time = time.time()
+        started = False
+        error = None
+        try:
+            with (yield from self._relay_semaphore):
+                started = True
+                if timeout is None:
+                    yield from coro
+                else:
+                    yield from asyncio.wait_for(coro, timeout)
+        except asyncio.TimeoutError as e:
+            error = e
+            logger.warning("{}:{}:delivery to {} timed out after {}s".format(self.plugin_name, self.uid, label, timeout))
+        except Exception as e:
+            error = e
+            logger.exception("{}:{}:delivery to {} failed".format(self.plugin_name, self.uid, label))
+        finally:
+            if not started and asyncio.iscoroutine(coro):
+                coro.close()
+        return label, time.time() - start_time, error
+
+    @asyncio.coroutine
+    def _upload_attachment(self, url):
+        """upload an attachment url once and share the resulting image_id
+
+        concurrent and subsequent relays of the same url await the same upload"""
+
+        upload = _attachment_uploads.get(url)
+        if upload is None:
+            logger.info("{}:{}:uploading {}".format(self.plugin_name, self.uid, url))
+            upload = asyncio.ensure_future(self.bot.call_shared("image_upload_single", url))
+            _attachment_uploads[url] = upload
+
+        try:
+            return (yield from asyncio.shield(upload))
+        except Exception:
+            if _attachment_uploads.get(url) is upload:
+                _attachment_uploads.pop(url, None)
+            raise
 
     @asyncio.coroutine
     def send_to_external_1to1(self, user_id, message):
@@ -313,12 +449,113 @@ class WebFramework:
 
         logger.info("{}:receive:{}".format(self.plugin_name, passthru))
 
+        window = self.bot.get_config_option("chatbridge.coalesce")
+        if window and not image_id and "executable" not in passthru:
+            self._coalesce(conv_id, formatted_message, passthru, window)
+            return
+
+        if conv_id in self._coalescing:
+            # keep the order: anything still in the window goes first
+            yield from self._flush_coalesced(conv_id)
+
         yield from self.bot.coro_send_message(
             conv_id,
             formatted_message,
             image_id = image_id,
             context = { "passthru": passthru })
 
+    def _coalesce(self, conv_id, formatted_message, passthru, window):
+        """opt-in: chatbridge.coalesce = window in milliseconds
+
+        text-only messages from this bridge arriving within the window after the first one
+            are merged into a single hangouts message"""
+
+        if conv_id not in self._coalescing:
+            self._coalescing[conv_id] = []
+            self._coalesce_timers[conv_id] = asyncio.get_event_loop().call_later(
+                window / 1000, self._coalesce_expired, conv_id)
+
+        self._coalescing[conv_id].append((formatted_message, passthru))
+
+    def _coalesce_expired(self, conv_id):
+        self._coalesce_timers.pop(conv_id, None)
+        task = asyncio.ensure_future(self._flush_coalesced(conv_id))
+        self._coalesce_flushes.add(task)
+        task.add_done_callback(self._coalesce_flushed)
+
+    def _coalesce_flushed(self, task):
+        self._coalesce_flushes.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("{}:{}:coalesced flush failed".format(self.plugin_name, self.uid),
+                         exc_info=task.exception())
+
+    @asyncio.coroutine
+    def _flush_coalesced(self, conv_id):
+        # flushed before the window expired: its timer must not close the next window early
+        timer = self._coalesce_timers.pop(conv_id, None)
+        if timer is not None:
+            timer.cancel()
+
+        entries = self._coalescing.pop(conv_id, None)
+        if not entries:
+            return
+
+        if len(entries) == 1:
+            formatted_message, passthru = entries[0]
+        else:
+            logger.info("{}:{}:coalesced {} messages for {}".format(self.plugin_name, self.uid, len(entries), conv_id))
+            formatted_message, passthru = self._merge_coalesced(entries)
+
+        yield from self.bot.coro_send_message(
+            conv_id,
+            formatted_message,
+            context = { "passthru": passthru })
+
+    def _merge_coalesced(self, entries):
+        """merge formatted messages (each keeps its sender prefix) and their passthrus
+
+        * norelay is the union of all norelay lists, preserving loop prevention
+        * original_request keeps the sender if all messages share one, otherwise
+            the bridge becomes the sender of the merged (prefixed) text"""
+
+        formatted_message = "<br />".join(message for message, passthru in entries)
+        passthrus = [ passthru for message, passthru in entries ]
+
+        norelay = []
+        for passthru in passthrus:
+            for uid in passthru.get("norelay", []):
+                if uid not in norelay:
+                    norelay.append(uid)
+
+        first = passthrus[0]
+        chatbridge = dict(first["chatbridge"])
+
+        if all(passthru["chatbridge"]["source_uid"] == chatbridge["source_uid"]
+               and passthru["original_request"]["user"] == first["original_request"]["user"]
+               for passthru in passthrus):
+
+            original_message = "\n".join(passthru["original_request"]["message"] or "" for passthru in passthrus)
+            user = first["original_request"]["user"]
+            for flag in ("source_edited", "source_action"):
+                chatbridge[flag] = all(passthru["chatbridge"].get(flag) for passthru in passthrus)
+
+        else:
+            original_message = formatted_message
+            user = self.plugin_name
+            chatbridge.update({ "source_user": self.plugin_name,
+                                "source_uid": False,
+                                "source_edited": False,
+                                "source_action": False })
+
+        return formatted_message, {
+            "original_request": {
+                "message": original_message,
+                "image_id": None,
+                "segments": None,
+                "user": user },
+            "chatbridge": chatbridge,
+            "norelay": norelay }
+
     def map_external_uid_with_hangups_user(self, source_uid, external_context):
         return False
 